@@ -0,0 +1,162 @@
+"""Cold storage for old completed workouts.
+
+The archival job moves completed workouts older than ARCHIVE_AFTER_DAYS, with their
+sets, from workouts/workout_sets into workouts_archive/workout_sets_archive, ids
+unchanged, so the hot tables and their indexes stay small enough to live in the
+page cache. Reads whose range reaches archived data query WorkoutHistory and
+WorkoutSetHistory (hot ∪ archive) instead, see history_models; a write to an
+archived workout first moves it back (restore_workout).
+
+Derived data is unaffected: daily_loads, usage counters and the search index keep
+covering archived sets, and nothing is logged for sync since no row changes.
+"""
+import os
+from datetime import date, datetime, timedelta
+from typing import Callable
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.orm import Session, selectinload
+
+from models import ArchivedSet, ArchivedWorkout, Workout, WorkoutHistory, WorkoutSet, WorkoutSetHistory
+from notes_search import index_archived_workouts
+
+ARCHIVE_AFTER_DAYS = int(os.getenv("FITCOUPLE_ARCHIVE_AFTER_DAYS", "0"))  # 0 keeps every workout hot
+ARCHIVE_BATCH = 200  # workouts moved per transaction
+
+WORKOUT_COLUMNS = [column.name for column in Workout.__table__.columns]
+SET_COLUMNS = [column.name for column in WorkoutSet.__table__.columns]
+
+
+def archived_through(db) -> datetime | None:
+    """Newest timestamp of any archived workout or set; later ranges never need the archive."""
+    return db.execute(select(func.max(ArchivedWorkout.last_activity_at))).scalar()
+
+
+def reaches_archive(db, since: datetime | date | None = None) -> bool:
+    horizon = archived_through(db)
+    if horizon is None:
+        return False
+    if since is None:
+        return True
+    if not isinstance(since, datetime):
+        since = datetime.combine(since, datetime.min.time())
+    return since <= horizon
+
+
+def history_models(db, since: datetime | date | None = None):
+    """(Workout, WorkoutSet) to read history from `since` on (all of it by default).
+
+    Their read-only hot ∪ archive twins when that range reaches archived data, so the
+    common, recent reads never touch the archive. `db` is a Session or a Connection.
+    """
+    if reaches_archive(db, since):
+        return WorkoutHistory, WorkoutSetHistory
+    return Workout, WorkoutSet
+
+
+def find_workout(db: Session, workout_id: int, eager_sets: bool = False):
+    """The workout with this id, hot (a Workout) or archived (a WorkoutHistory), else None."""
+    for workout_model, set_model in ((Workout, WorkoutSet), (WorkoutHistory, WorkoutSetHistory)):
+        query = db.query(workout_model).filter(workout_model.id == workout_id)
+        if eager_sets:
+            query = query.options(selectinload(workout_model.sets).joinedload(set_model.exercise))
+        workout = query.first()
+        if workout is not None:
+            return workout
+    return None
+
+
+def newest_workouts(db, page: Callable[[type], list], limit: int, key: str) -> list:
+    """Run `page`, a query of at most `limit` workouts newest first by `key`, on the hot table.
+
+    Archived workouts are all older than the archive horizon, so the hot result stands
+    unless it comes up short or its oldest row reaches the horizon; then it is rerun on
+    WorkoutHistory.
+    """
+    workouts = page(Workout)
+    if reaches_archive(db, getattr(workouts[-1], key) if workouts and len(workouts) == limit else None):
+        workouts = page(WorkoutHistory)
+    return workouts
+
+
+def _move(db: Session, source_workouts, source_sets, target_workouts, target_sets, workout_ids: list[int], extra=None):
+    workouts = db.execute(
+        select(*(source_workouts.__table__.c[c] for c in WORKOUT_COLUMNS)).where(source_workouts.id.in_(workout_ids))
+    ).mappings().all()
+    sets = db.execute(
+        select(*(source_sets.__table__.c[c] for c in SET_COLUMNS)).where(source_sets.workout_id.in_(workout_ids))
+    ).mappings().all()
+    db.execute(insert(target_workouts), [{**row, **(extra(row, sets) if extra else {})} for row in workouts])
+    if sets:
+        db.execute(insert(target_sets), [dict(row) for row in sets])
+    db.execute(delete(source_sets).where(source_sets.workout_id.in_(workout_ids)))
+    db.execute(delete(source_workouts).where(source_workouts.id.in_(workout_ids)))
+
+
+def _last_activity(workout, sets) -> datetime:
+    times = [workout["started_at"], workout["completed_at"]]
+    times += [s["logged_at"] for s in sets if s["workout_id"] == workout["id"]]
+    return max(t for t in times if t is not None)
+
+
+def archive_batch(db: Session, before: datetime, after_id: int = 0) -> tuple[int, int | None]:
+    """Archive up to ARCHIVE_BATCH workouts with id > after_id whose whole activity is before `before`.
+
+    Returns (archived, last id examined), the latter None once no candidates are left.
+    """
+    candidates = db.execute(
+        select(Workout.id, Workout.started_at, Workout.completed_at)
+        .where(
+            Workout.id > after_id,
+            Workout.completed_at.isnot(None),
+            Workout.completed_at < before,
+            Workout.started_at < before,
+        )
+        .order_by(Workout.id)
+        .limit(ARCHIVE_BATCH)
+    ).all()
+    if not candidates:
+        return 0, None
+    ids = [workout_id for workout_id, _started_at, _completed_at in candidates]
+    # Sets logged (or edited in) after the cutoff keep their workout hot
+    recent = {
+        workout_id for (workout_id,) in db.execute(
+            select(WorkoutSet.workout_id).where(WorkoutSet.workout_id.in_(ids), WorkoutSet.logged_at >= before).distinct()
+        )
+    }
+    movable = [workout_id for workout_id in ids if workout_id not in recent]
+    if movable:
+        _move(
+            db, Workout, WorkoutSet, ArchivedWorkout, ArchivedSet, movable,
+            extra=lambda row, sets: {"last_activity_at": _last_activity(row, sets)},
+        )
+        index_archived_workouts(db, movable)
+    return len(movable), ids[-1]
+
+
+def archive_old_workouts(run, before: datetime | None = None) -> int:
+    """Archive every eligible workout in ARCHIVE_BATCH-sized transactions. Returns the number archived.
+
+    `run` executes one unit of work in a committed transaction, e.g. WRITE_QUEUE.run,
+    so live writes interleave with the job instead of waiting for all of it.
+    """
+    before = before or datetime.utcnow() - timedelta(days=ARCHIVE_AFTER_DAYS)
+    archived, after_id = 0, 0
+    while after_id is not None:
+        moved, after_id = run(lambda db, after_id=after_id: archive_batch(db, before, after_id))
+        archived += moved
+    return archived
+
+
+def restore_workout(db: Session, workout_id: int) -> bool:
+    """Move an archived workout and its sets back to the hot tables. False when it isn't archived."""
+    if db.execute(select(ArchivedWorkout.id).where(ArchivedWorkout.id == workout_id)).first() is None:
+        return False
+    _move(db, ArchivedWorkout, ArchivedSet, Workout, WorkoutSet, [workout_id])
+    return True
+
+
+def restore_set_workout(db: Session, set_id: int) -> bool:
+    """Restore the archived workout holding set `set_id`. False when the set isn't archived."""
+    workout_id = db.execute(select(ArchivedSet.workout_id).where(ArchivedSet.id == set_id)).scalar()
+    return workout_id is not None and restore_workout(db, workout_id)
@@ -0,0 +1,207 @@
+"""Write-contention benchmark: many threads logging sets at once, with and without the writer queue.
+
+Runs against scratch household databases, removed afterwards:
+    python bench_writes.py --threads 32 --writes 50 --households 4
+    python bench_writes.py --backup --filler-sets 200000  # p99 while backups run in a loop
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from uuid import uuid4
+
+from sqlalchemy import event, insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+
+from backup import snapshot_database
+from database import Base, SessionLocal, current_household, households
+from models import Exercise, User, Workout, WorkoutSet
+import cache  # noqa: F401 – same flush hooks as the app
+import change_log  # noqa: F401
+import training_load  # noqa: F401
+from routers.workouts import insert_set
+from schemas import SetCreate
+from write_queue import WRITE_QUEUE, is_busy
+
+
+class CommitCounter:
+    """Transactions SQLite actually committed: COMMITs, and savepoint RELEASEs that ended a transaction."""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+        event.listen(Engine, "before_cursor_execute", self._before)
+        event.listen(Engine, "after_cursor_execute", self._after)
+        event.listen(Engine, "commit", self._commit)
+
+    def _add(self):
+        with self._lock:
+            self.count += 1
+
+    def _before(self, conn, _cursor, _statement, _parameters, _context, _executemany):
+        conn.info["bench_in_transaction"] = conn.connection.driver_connection.in_transaction
+
+    def _after(self, conn, _cursor, _statement, _parameters, _context, _executemany):
+        if conn.info.pop("bench_in_transaction", False) and not conn.connection.driver_connection.in_transaction:
+            self._add()
+
+    def _commit(self, conn):
+        if conn.connection.driver_connection.in_transaction:
+            self._add()
+
+
+COMMITS = CommitCounter()
+
+
+def _setup(household: str, threads: int, filler_sets: int = 0) -> tuple[int, list[int]]:
+    Base.metadata.create_all(bind=households.create(household))
+    db = SessionLocal(household=household)
+    try:
+        user = User(name="bench", theme_key="bench")
+        exercise = Exercise(name="Bench press", muscle_group="chest")
+        db.add_all([user, exercise])
+        db.flush()
+        workouts = [Workout(user_id=user.id, type="push") for _ in range(threads)]
+        db.add_all(workouts)
+        if filler_sets:  # a daily workout of 20 sets going back in time, so a backup has pages to copy
+            now = datetime.utcnow()
+            history = [
+                Workout(user_id=user.id, type="push", started_at=now - timedelta(days=day + 1))
+                for day in range((filler_sets + 19) // 20)
+            ]
+            db.add_all(history)
+            db.flush()
+            db.execute(insert(WorkoutSet), [
+                {
+                    "workout_id": history[n // 20].id, "exercise_id": exercise.id, "set_number": n % 20 + 1,
+                    "weight_kg": 60, "reps": 8, "logged_at": history[n // 20].started_at,
+                }
+                for n in range(filler_sets)
+            ])
+        db.commit()
+        return exercise.id, [w.id for w in workouts]
+    finally:
+        db.close()
+
+
+def _direct_write(workout_id: int, payload: SetCreate):
+    db = SessionLocal()
+    try:
+        insert_set(db, workout_id, payload)
+        db.commit()
+    finally:
+        db.close()
+
+
+def _queued_write(workout_id: int, payload: SetCreate):
+    WRITE_QUEUE.run(lambda db: insert_set(db, workout_id, payload).id)
+
+
+def _back_up_until(stop: threading.Event, names: list[str]) -> int:
+    """Snapshot the bench databases back to back until `stop` is set. Returns the number of snapshots."""
+    snapshots = 0
+    with tempfile.TemporaryDirectory() as directory:
+        while not stop.is_set():
+            for household in names:
+                snapshot_database(households.path_for(household), Path(directory) / f"{household}.db.gz")
+                snapshots += 1
+    return snapshots
+
+
+def run(mode: str, threads: int, writes: int, household_count: int, filler_sets: int = 0, backup: bool = False) -> dict:
+    run_id = uuid4().hex[:8]
+    names = [f"bench-{run_id}-{i}" for i in range(household_count)]
+    targets = []  # (household, exercise_id, workout_id) per thread
+    for i, household in enumerate(names):
+        share = threads // household_count + (i < threads % household_count)
+        exercise_id, workout_ids = _setup(household, share, filler_sets)
+        targets.extend((household, exercise_id, workout_id) for workout_id in workout_ids)
+    write = _queued_write if mode == "queue" else _direct_write
+    latencies: list[float] = []
+    errors = 0
+    lock = threading.Lock()
+    barrier = threading.Barrier(threads)
+
+    def worker(household: str, exercise_id: int, workout_id: int):
+        nonlocal errors
+        current_household.set(household)
+        barrier.wait()
+        for n in range(writes):
+            payload = SetCreate(exercise_id=exercise_id, set_number=n + 1, weight_kg=60, reps=8)
+            started = time.perf_counter()
+            try:
+                write(workout_id, payload)
+            except OperationalError as exc:
+                if not is_busy(exc):
+                    raise
+                with lock:
+                    errors += 1
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - started)
+
+    if mode == "queue":
+        WRITE_QUEUE.start()
+    commits_before = COMMITS.count
+    stop_backups = threading.Event()
+    backup_result = {}
+    backup_thread = threading.Thread(
+        target=lambda: backup_result.update(snapshots=_back_up_until(stop_backups, names)),
+    )
+    if backup:
+        backup_thread.start()
+    started = time.perf_counter()
+    pool = [threading.Thread(target=worker, args=target) for target in targets]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - started
+    if backup:
+        stop_backups.set()
+        backup_thread.join()
+    if mode == "queue":
+        WRITE_QUEUE.stop()
+    households.dispose_all()
+    for household in names:
+        for suffix in ("", "-wal", "-shm"):
+            path = households.path_for(household) + suffix
+            if os.path.exists(path):
+                os.unlink(path)
+
+    latencies.sort()
+    return {
+        "mode": mode + ("+backup" if backup else ""),
+        "households": household_count,
+        "ok": len(latencies),
+        "locked_errors": errors,
+        "commits": COMMITS.count - commits_before,
+        "writes_per_s": round(len(latencies) / elapsed),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1) if latencies else None,
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 1) if latencies else None,
+        **({"backups": backup_result.get("snapshots", 0)} if backup else {}),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--writes", type=int, default=50, help="writes per thread")
+    parser.add_argument("--households", type=int, default=1, help="spread the threads over this many databases")
+    parser.add_argument("--filler-sets", type=int, default=0, help="pre-existing sets per database")
+    parser.add_argument("--backup", action="store_true", help="also run the queue mode while backups run in a loop")
+    args = parser.parse_args()
+
+    household_count = min(max(args.households, 1), args.threads)
+    runs = [("direct", False), ("queue", False)] + ([("queue", True)] if args.backup else [])
+    for mode, backup in runs:
+        print(run(mode, args.threads, args.writes, household_count, args.filler_sets, backup))
+
+
+if __name__ == "__main__":
+    main()
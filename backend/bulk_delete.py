@@ -0,0 +1,87 @@
+"""Single-statement deletes of workouts and exercises, hot or archived.
+
+A workout's sets go with it through ON DELETE CASCADE, unseen by the ORM and so by the
+after_flush hooks. What a delete will take is read first, ids and days only, and the
+hooks' bookkeeping done here after it: sync tombstones, usage counters, daily loads
+and cache versions. An exercise with logged sets isn't deleted (ON DELETE RESTRICT).
+"""
+from collections import Counter, defaultdict
+from datetime import date
+from typing import Callable
+
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+
+from cache import bump_data_version, bump_history_version, bump_table_version, history_cutoff
+from change_log import log_changes
+from models import ArchivedSet, ArchivedWorkout, Exercise, Workout, WorkoutSet
+from notes_search import unindex_workouts
+from training_load import refresh_daily_loads
+
+HOT_AND_ARCHIVED = ((Workout, WorkoutSet), (ArchivedWorkout, ArchivedSet))
+
+
+def _sets_where(db: Session, workout_model, set_model, *criteria) -> list:
+    return db.execute(
+        select(set_model.id, set_model.workout_id, workout_model.user_id, set_model.exercise_id, set_model.logged_at)
+        .join(workout_model, set_model.workout_id == workout_model.id)
+        .where(*criteria)
+    ).all()
+
+
+def _forget_sets(db: Session, sets: list, user_ids=()):
+    """Bookkeeping for sets a cascade removed; `user_ids` get their caches invalidated as well."""
+    log_changes(db, "workout_sets", [row.id for row in sets], op="delete")
+    usage: dict[int, Counter] = defaultdict(Counter)
+    days: dict[int, set[date]] = defaultdict(set)
+    closed_users = set()
+    cutoff = history_cutoff()
+    for row in sets:
+        usage[row.user_id][row.exercise_id] -= 1
+        if row.logged_at is not None:
+            days[row.user_id].add(row.logged_at.date())
+            if row.logged_at < cutoff:
+                closed_users.add(row.user_id)
+    from routers.exercises import record_usage  # routers.exercises imports this module
+
+    for user_id, counts in usage.items():
+        record_usage(db, user_id, counts)
+    for user_id, user_days in days.items():
+        refresh_daily_loads(db.connection(), user_id, user_days)
+    bump_data_version(db, {*user_ids, *usage})
+    bump_history_version(db, closed_users)
+
+
+def remove_workouts(db: Session, where: Callable[[type], list]) -> tuple[int, int]:
+    """Delete the workouts `where(model)` selects, in the hot and archive tables, with their sets.
+
+    `where` maps a workout model to filter criteria, so one filter serves both tables.
+    Returns (workouts, sets) deleted.
+    """
+    workout_users: dict[int, int] = {}
+    sets = []
+    for workout_model, set_model in HOT_AND_ARCHIVED:
+        criteria = where(workout_model)
+        workouts = dict(db.execute(select(workout_model.id, workout_model.user_id).where(*criteria)).all())
+        if not workouts:
+            continue
+        sets += _sets_where(db, workout_model, set_model, *criteria)
+        db.execute(delete(workout_model).where(*criteria))
+        if workout_model is ArchivedWorkout:
+            unindex_workouts(db, list(workouts))
+        workout_users.update(workouts)
+    if workout_users:
+        log_changes(db, "workouts", workout_users, op="delete")
+        _forget_sets(db, sets, user_ids=workout_users.values())
+    return len(workout_users), len(sets)
+
+
+def remove_exercise(db: Session, exercise_id: int) -> bool:
+    """Delete an exercise, its usage counters by cascade. False, and nothing deleted, if any set logs it."""
+    for _workout_model, set_model in HOT_AND_ARCHIVED:
+        if db.execute(select(set_model.id).where(set_model.exercise_id == exercise_id).limit(1)).first():
+            return False
+    db.execute(delete(Exercise).where(Exercise.id == exercise_id))
+    log_changes(db, "exercises", [exercise_id], op="delete")
+    bump_table_version(db, "exercises")
+    return True
@@ -0,0 +1,143 @@
+import csv
+import io
+import json
+import math
+import re
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from typing import Iterable, Iterator
+
+from fastapi import HTTPException, UploadFile
+from sqlalchemy.orm import Session
+
+CHUNK_SIZE = 500
+
+DATE_KEYS = ("logged_at", "date", "datetime", "timestamp", "time")
+DATE_FORMATS = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%d/%m/%Y %H:%M", "%d/%m/%Y", "%Y/%m/%d")
+NDJSON_CONTENT_TYPES = {"application/x-ndjson", "application/jsonl"}
+
+
+def _normalize_key(key: str) -> str:
+    # "Weight (kg)" -> "weight", "Waist cm" -> "waist_cm"
+    key = re.sub(r"\(.*?\)", "", key or "").strip().lower()
+    return re.sub(r"[^a-z0-9]+", "_", key).strip("_")
+
+
+def _is_ndjson(upload: UploadFile) -> bool:
+    filename = (upload.filename or "").lower()
+    if filename.endswith((".ndjson", ".jsonl")):
+        return True
+    return (upload.content_type or "").lower() in NDJSON_CONTENT_TYPES
+
+
+def _is_plain_json(upload: UploadFile) -> bool:
+    return (upload.filename or "").lower().endswith(".json") or (upload.content_type or "").lower() == "application/json"
+
+
+def iter_records(upload: UploadFile) -> Iterator[dict]:
+    """Yield one dict per row of an uploaded CSV or NDJSON file, without buffering the whole file.
+
+    A JSON document (e.g. an array export) is refused with a 415 rather than read line by line.
+    """
+    if not _is_ndjson(upload) and _is_plain_json(upload):
+        raise HTTPException(
+            status_code=415, detail="JSON documents aren't supported, upload CSV or NDJSON (one object per line)",
+        )
+    text = io.TextIOWrapper(upload.file, encoding="utf-8-sig", newline="")
+    try:
+        if _is_ndjson(upload):
+            for line in text:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    yield {}
+                    continue
+                yield {_normalize_key(k): v for k, v in record.items()} if isinstance(record, dict) else {}
+        else:
+            sample = text.read(4096)
+            text.seek(0)
+            try:
+                dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+            except csv.Error:
+                dialect = csv.excel
+            reader = csv.reader(text, dialect)
+            header = next(reader, None)
+            if not header:
+                return
+            keys = [_normalize_key(h) for h in header]
+            for row in reader:
+                if row:
+                    yield dict(zip(keys, row))
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=422, detail="File must be UTF-8 encoded")
+    finally:
+        text.detach()
+
+
+def chunked(records: Iterable[dict], size: int = CHUNK_SIZE) -> Iterator[list[dict]]:
+    iterator = iter(records)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def first_value(record: dict, keys: Iterable[str]):
+    for key in keys:
+        value = record.get(key)
+        if value not in (None, ""):
+            return value
+    return None
+
+
+def parse_datetime(value) -> datetime | None:
+    if value in (None, ""):
+        return None
+    if isinstance(value, str) and value.strip().isdigit():
+        value = int(value.strip())
+    if isinstance(value, (int, float)):
+        parsed = datetime.fromtimestamp(value / 1000 if value > 1e11 else value, tz=timezone.utc)
+    else:
+        value = str(value).strip()
+        try:
+            parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            for fmt in DATE_FORMATS:
+                try:
+                    parsed = datetime.strptime(value, fmt)
+                    break
+                except ValueError:
+                    continue
+            else:
+                return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def parse_float(value) -> float | None:
+    """A finite number, else None: "nan", "inf" and overflowing values like "1e400" are rejected too."""
+    if value in (None, ""):
+        return None
+    try:
+        parsed = float(str(value).strip().replace(",", "."))
+    except ValueError:
+        return None
+    return parsed if math.isfinite(parsed) else None
+
+
+def existing_days(db: Session, model, user_id: int, rows: list[dict]) -> set:
+    """Days already logged for `user_id` within the chunk's date span (one indexed range scan)."""
+    first_day = min(r["logged_at"] for r in rows).date()
+    last_day = max(r["logged_at"] for r in rows).date()
+    logged = (
+        db.query(model.logged_at)
+        .filter(
+            model.user_id == user_id,
+            model.logged_at >= datetime.combine(first_day, datetime.min.time()),
+            model.logged_at < datetime.combine(last_day + timedelta(days=1), datetime.min.time()),
+        )
+        .all()
+    )
+    return {logged_at.date() for (logged_at,) in logged}
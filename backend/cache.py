@@ -0,0 +1,157 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Hashable, Iterable
+
+from sqlalchemy import event, select, update
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, current_household, upsert
+from models import BodyMeasurement, BodyWeight, Exercise, TableVersion, User, Workout, WorkoutSet
+
+
+class LRUCache:
+    """Thread-safe LRU map capped by entry count and by the total `size` of stored values.
+
+    Keys are scoped to current_household: user ids and versions repeat across household databases.
+    """
+
+    def __init__(self, max_entries: int = 256, max_size: int | None = None):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self._data: OrderedDict[Hashable, tuple[object, int]] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable):
+        key = (current_household.get(), key)
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            self._data.move_to_end(key)
+            return item[0]
+
+    def set(self, key: Hashable, value, size: int = 1):
+        key = (current_household.get(), key)
+        with self._lock:
+            if key in self._data:
+                self._size -= self._data.pop(key)[1]
+            self._data[key] = (value, size)
+            self._size += size
+            while self._data and (
+                len(self._data) > self.max_entries
+                or (self.max_size is not None and self._size > self.max_size)
+            ):
+                _key, (_value, evicted_size) = self._data.popitem(last=False)
+                self._size -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._size = 0
+
+    def __len__(self):
+        return len(self._data)
+
+
+# ─── User data versions ───────────────────────────────────────────────────────
+
+def get_data_version(db: Session, user_id: int) -> int | None:
+    return db.query(User.data_version).filter(User.id == user_id).scalar()
+
+
+def get_history_version(db: Session, user_id: int) -> int | None:
+    return db.query(User.history_version).filter(User.id == user_id).scalar()
+
+
+def history_cutoff(now: datetime | None = None) -> datetime:
+    """Start of the oldest week or month still open; sets logged before it only feed closed periods."""
+    today = (now or datetime.utcnow()).date()
+    week_start = today - timedelta(days=today.weekday())
+    return datetime.combine(min(week_start, today.replace(day=1)), datetime.min.time())
+
+
+def bump_data_version(db: Session, user_ids: Iterable[int]):
+    """Invalidate every cache entry derived from these users' data.
+
+    ORM writes are picked up by the after_flush hook below; call this directly
+    after Core-level statements (bulk inserts, upserts) that bypass the unit of work.
+    """
+    user_ids = sorted({uid for uid in user_ids if uid is not None})
+    if user_ids:
+        db.execute(
+            update(User)
+            .where(User.id.in_(user_ids))
+            .values(data_version=User.data_version + 1)
+        )
+
+
+def bump_history_version(db: Session, user_ids: Iterable[int]):
+    """Invalidate the per-period caches too, after Core-level writes to sets in closed weeks/months."""
+    user_ids = sorted({uid for uid in user_ids if uid is not None})
+    if user_ids:
+        db.execute(
+            update(User)
+            .where(User.id.in_(user_ids))
+            .values(history_version=User.history_version + 1)
+        )
+
+
+def get_table_version(db: Session, name: str) -> int:
+    return db.query(TableVersion.version).filter(TableVersion.name == name).scalar() or 0
+
+
+def bump_table_version(db, name: str):
+    """Invalidate in-memory copies of table `name` in every worker; call it after Core-level writes to it."""
+    stmt = upsert(db, TableVersion).values(name=name, version=1)
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[TableVersion.name],
+        set_={"version": TableVersion.version + 1},
+    ))
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _bump_versions_after_flush(session: Session, flush_context):
+    user_ids = set()
+    history_user_ids = set()
+    workout_users = {}  # workouts touched in this flush, deleted ones included
+    set_workouts = []  # (workout_id, in a closed period)
+    cutoff = history_cutoff()
+    exercises_changed = False
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Exercise):
+            exercises_changed = True
+        elif isinstance(obj, (Workout, BodyWeight, BodyMeasurement)):
+            user_ids.add(obj.user_id)
+            if isinstance(obj, Workout):
+                workout_users[obj.id] = obj.user_id
+        elif isinstance(obj, WorkoutSet):
+            set_workouts.append((obj.workout_id, obj.logged_at is not None and obj.logged_at < cutoff))
+        elif isinstance(obj, User) and obj not in session.new:
+            user_ids.add(obj.id)
+    unknown = {workout_id for workout_id, _closed in set_workouts if workout_id not in workout_users}
+    if unknown:
+        rows = session.connection().execute(select(Workout.id, Workout.user_id).where(Workout.id.in_(unknown)))
+        workout_users.update(dict(rows.all()))
+    for workout_id, closed in set_workouts:
+        user_ids.add(workout_users.get(workout_id))
+        if closed:
+            # Edits to sets in closed weeks/months invalidate the per-period caches as well
+            history_user_ids.add(workout_users.get(workout_id))
+    user_ids.discard(None)
+    history_user_ids.discard(None)
+    if user_ids:
+        session.connection().execute(
+            update(User)
+            .where(User.id.in_(sorted(user_ids)))
+            .values(data_version=User.data_version + 1)
+        )
+    if history_user_ids:
+        session.connection().execute(
+            update(User)
+            .where(User.id.in_(sorted(history_user_ids)))
+            .values(history_version=User.history_version + 1)
+        )
+    if exercises_changed:
+        bump_table_version(session.connection(), Exercise.__tablename__)
@@ -0,0 +1,132 @@
+from datetime import datetime
+from typing import Iterable
+
+from sqlalchemy import event, func, insert, select, text
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import (
+    BodyMeasurement, BodyWeight, Boost, ChangeLog, Exercise, FavoriteTemplate, User, Workout, WorkoutHistory,
+    WorkoutSet, WorkoutSetHistory,
+)
+
+# Entities clients mirror offline, by table name
+SYNCED_MODELS = {
+    model.__tablename__: model
+    for model in (User, Exercise, Workout, WorkoutSet, BodyWeight, BodyMeasurement, Boost, FavoriteTemplate)
+}
+HIDDEN_COLUMNS = {"users": {"data_version", "history_version"}}
+# Archiving moves rows without changing them for clients: found here, they are not tombstones
+ARCHIVABLE_MODELS = {"workouts": WorkoutHistory, "workout_sets": WorkoutSetHistory}
+
+DEFAULT_SYNC_LIMIT = 1000
+MAX_SYNC_LIMIT = 5000
+
+# The id is the sync cursor, so ids must become visible in order: a reader that saw id 11
+# before 10 committed would move past 10 for good. SQLite has one writer at a time anyway.
+# On PostgreSQL, sequence values are handed out before commit, in any order, so transactions
+# logging changes take this lock first and hold it until they commit: one change-log writer
+# per household schema (regclass resolves the search_path), ids drawn in commit order.
+_CHANGE_LOG_WRITER_LOCK = text("SELECT pg_advisory_xact_lock(CAST(CAST(CAST('change_log' AS regclass) AS oid) AS bigint))")
+
+
+def _insert_entries(db, rows: list[dict]):
+    dialect = db.get_bind().dialect if isinstance(db, Session) else db.dialect
+    if dialect.name == "postgresql":
+        db.execute(_CHANGE_LOG_WRITER_LOCK)
+    db.execute(insert(ChangeLog), rows)
+
+
+def log_changes(db: Session, entity: str, entity_ids: Iterable[int], op: str = "upsert"):
+    """Record Core-level writes (bulk inserts, upserts) that bypass the after_flush hook below."""
+    now = datetime.utcnow()
+    rows = [{"entity": entity, "entity_id": entity_id, "op": op, "changed_at": now} for entity_id in entity_ids]
+    if rows:
+        _insert_entries(db, rows)
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _log_changes_after_flush(session: Session, flush_context):
+    now = datetime.utcnow()
+    rows = []
+    for objects, op in ((session.new, "upsert"), (session.dirty, "upsert"), (session.deleted, "delete")):
+        for obj in objects:
+            table = getattr(obj, "__tablename__", None)
+            if table not in SYNCED_MODELS:
+                continue
+            if op == "upsert" and obj in session.dirty and not session.is_modified(obj, include_collections=False):
+                continue
+            rows.append({"entity": table, "entity_id": obj.id, "op": op, "changed_at": now})
+    if rows:
+        _insert_entries(session.connection(), rows)
+
+
+def backfill_change_log(conn):
+    """Seed an empty log with every existing row so a first sync from cursor 0 is complete."""
+    if conn.execute(text("SELECT 1 FROM change_log LIMIT 1")).first():
+        return
+    for table in SYNCED_MODELS:
+        conn.execute(text(
+            f"INSERT INTO change_log (entity, entity_id, op, changed_at) "
+            f"SELECT '{table}', id, 'upsert', CURRENT_TIMESTAMP FROM {table} ORDER BY id"
+        ))
+
+
+def compact_change_log(db: Session) -> int:
+    """Drop entries superseded by a later one for the same row; every cursor stays valid."""
+    latest = select(func.max(ChangeLog.id)).group_by(ChangeLog.entity, ChangeLog.entity_id)
+    return db.query(ChangeLog).filter(ChangeLog.id.not_in(latest)).delete(synchronize_session=False)
+
+
+def _row_to_dict(entity: str, obj) -> dict:
+    hidden = HIDDEN_COLUMNS.get(entity, set())
+    return {c.key: getattr(obj, c.key) for c in obj.__mapper__.column_attrs if c.key not in hidden}
+
+
+def changes_since(db: Session, since: int, limit: int) -> dict:
+    """Net changes after `since`: current rows for upserts, bare ids for deletes.
+
+    A row changed several times in the page appears once, with its latest state. Every entry
+    up to the returned cursor is committed, none later can get a lower id (_insert_entries).
+    """
+    entries = (
+        db.query(ChangeLog.id, ChangeLog.entity, ChangeLog.entity_id, ChangeLog.op)
+        .filter(ChangeLog.id > since)
+        .order_by(ChangeLog.id)
+        .limit(limit + 1)
+        .all()
+    )
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    latest_op: dict[tuple[str, int], str] = {}
+    for _id, entity, entity_id, op in entries:
+        latest_op[(entity, entity_id)] = op
+
+    upserts: dict[str, set[int]] = {}
+    deleted: dict[str, list[int]] = {}
+    for (entity, entity_id), op in latest_op.items():
+        if op == "delete":
+            deleted.setdefault(entity, []).append(entity_id)
+        else:
+            upserts.setdefault(entity, set()).add(entity_id)
+
+    changes: dict[str, list[dict]] = {}
+    for entity, ids in upserts.items():
+        model = SYNCED_MODELS[entity]
+        rows = db.query(model).filter(model.id.in_(ids)).order_by(model.id).all()
+        if len(rows) < len(ids) and entity in ARCHIVABLE_MODELS:
+            history = ARCHIVABLE_MODELS[entity]
+            rows = db.query(history).filter(history.id.in_(ids)).order_by(history.id).all()
+        changes[entity] = [_row_to_dict(entity, row) for row in rows]
+        # Rows deleted after this page was logged show up as tombstones right away
+        missing = ids - {row.id for row in rows}
+        if missing:
+            deleted.setdefault(entity, []).extend(sorted(missing))
+
+    return {
+        "cursor": entries[-1][0] if entries else since,
+        "has_more": has_more,
+        "changes": changes,
+        "deleted": {entity: sorted(ids) for entity, ids in deleted.items()},
+    }
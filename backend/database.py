@@ -1,20 +1,418 @@
+import hashlib
+import hmac
 import os
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+import re
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import date, datetime, timedelta
+from typing import Callable
+
+from fastapi import HTTPException, Request
+from sqlalchemy import Date, create_engine, event, inspect
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Session, sessionmaker, declarative_base
+from sqlalchemy.sql.functions import FunctionElement
 
 DB_DIR = os.path.join(os.path.dirname(__file__), "data")
-os.makedirs(DB_DIR, exist_ok=True)
+HOUSEHOLD_DIR = os.path.join(DB_DIR, "households")
+os.makedirs(HOUSEHOLD_DIR, exist_ok=True)
+
+# SQLite by default; a postgresql+psycopg:// URL moves every household to one PostgreSQL server
+DATABASE_URL = os.getenv("DATABASE_URL", f"sqlite:///{DB_DIR}/fitness.db")
+IS_SQLITE = make_url(DATABASE_URL).get_backend_name() == "sqlite"
+
+# PostgreSQL connection pool, shared by every household
+DB_POOL_SIZE = int(os.getenv("FITCOUPLE_DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("FITCOUPLE_DB_MAX_OVERFLOW", "10"))
+DB_POOL_RECYCLE_SECONDS = int(os.getenv("FITCOUPLE_DB_POOL_RECYCLE", "1800"))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("FITCOUPLE_DB_STATEMENT_CACHE", "1000"))  # compiled SQL kept per engine
+
+# Each household (one couple) gets its own SQLite file, or PostgreSQL schema, picked per
+# request by the X-Household header. The original single-couple database is the default household.
+# Requests to a household carry its access token in X-Household-Token; the default household
+# only asks for one once a token has been issued for it (manage.py household-token default).
+DEFAULT_HOUSEHOLD = "default"
+HOUSEHOLD_HEADER = "X-Household"
+HOUSEHOLD_TOKEN_HEADER = "X-Household-Token"
+TOKEN_CACHE_SECONDS = 30  # how long a token issued by another process may take to be seen
+HOUSEHOLD_PATTERN = re.compile(r"^[a-z0-9][a-z0-9_-]{0,62}$")
+MAX_OPEN_HOUSEHOLDS = int(os.getenv("FITCOUPLE_MAX_OPEN_HOUSEHOLDS", "64"))
+HOUSEHOLD_IDLE_SECONDS = 600
+IDLE_SWEEP_SECONDS = 30
+
+current_household: ContextVar[str] = ContextVar("current_household", default=DEFAULT_HOUSEHOLD)
+
+
+# Execution option for connections that group writes in savepoints (the write queue's).
+# pysqlite only BEGINs before an INSERT/UPDATE/DELETE, never before a SAVEPOINT, so each
+# savepoint's RELEASE would commit on its own; on these connections the transaction is
+# opened explicitly instead, and IMMEDIATE takes the write lock up front.
+BEGIN_IMMEDIATE = "sqlite_begin_immediate"
+
+
+def _set_sqlite_pragmas(dbapi_connection, _connection_record):
+    # WAL: readers keep their snapshot while the writer thread commits
+    dbapi_connection.execute("PRAGMA journal_mode=WAL")
+    # Off by default in SQLite, per connection: enforces the models' ON DELETE CASCADE / SET NULL
+    dbapi_connection.execute("PRAGMA foreign_keys=ON")
+
+
+def _begin_sqlite_transaction(conn):
+    # Other connections keep pysqlite's lazy BEGIN: opened at session start, a read transaction
+    # that later writes fails at once if another connection committed since its snapshot
+    if conn.get_execution_options().get(BEGIN_IMMEDIATE):
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+def household_schema(household: str) -> str:
+    return "public" if household == DEFAULT_HOUSEHOLD else f"household_{household}"
+
+
+# Execution option naming the PostgreSQL schema of a household's connections
+HOUSEHOLD_SCHEMA = "household_schema"
+_postgres_engine: Engine | None = None  # one pool for every household, created by the first _create_engine
+
+
+def _set_search_path(conn):
+    # SET LOCAL ends with the transaction, so a pooled connection never carries a household's schema into the next
+    schema = conn.get_execution_options().get(HOUSEHOLD_SCHEMA)
+    if schema:
+        conn.exec_driver_sql(f'SET LOCAL search_path TO "{schema}"')
+
+
+def _create_engine(household: str) -> Engine:
+    global _postgres_engine
+    url = make_url(DATABASE_URL)
+    if IS_SQLITE:
+        if household != DEFAULT_HOUSEHOLD:
+            url = url.set(database=os.path.join(HOUSEHOLD_DIR, f"{household}.db"))
+        engine = create_engine(url, connect_args={"check_same_thread": False})
+        event.listen(engine, "connect", _set_sqlite_pragmas)
+        event.listen(engine, "begin", _begin_sqlite_transaction)
+        return engine
+    if _postgres_engine is None:  # under HouseholdRouter's lock
+        _postgres_engine = create_engine(
+            url,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_pre_ping=True,  # drop connections the server closed while idle
+            pool_recycle=DB_POOL_RECYCLE_SECONDS,
+            query_cache_size=DB_STATEMENT_CACHE_SIZE,
+        )
+        event.listen(_postgres_engine, "begin", _set_search_path)
+    # Shares the pool and the compiled statement cache; only the search_path differs per transaction
+    return _postgres_engine.execution_options(**{HOUSEHOLD_SCHEMA: household_schema(household)})
+
+
+@contextmanager
+def household_context(household: str):
+    token = current_household.set(household)
+    try:
+        yield
+    finally:
+        current_household.reset(token)
+
+
+class UnknownHouseholdError(LookupError):
+    """A household that was never provisioned with HouseholdRouter.create."""
+
+
+class HouseholdAuthError(PermissionError):
+    """A request to a household without its access token, or with a wrong one."""
+
+
+def _token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class HouseholdRouter:
+    """Maps each household to its own database file (PostgreSQL: its own schema).
+
+    Households are provisioned explicitly with `create` (manage.py create-household,
+    POST /admin/households); only those, and the default household, are routed to.
+    Engines open on first use and are set up once per process by `initializer`
+    (schema, migrations, seed), which runs under household_context. Open engines
+    sit in an LRU: beyond `max_open`, or idle for `idle_seconds`, they are disposed
+    and simply reopened on the next request. On PostgreSQL they are views of one
+    shared engine, so every household draws on the same connection pool.
+    """
+
+    def __init__(self, max_open: int, idle_seconds: float):
+        self.max_open = max_open
+        self.idle_seconds = idle_seconds
+        self.initializer: Callable[[Engine], None] | None = None
+        self._engines: OrderedDict[str, Engine] = OrderedDict()
+        self._last_used: dict[str, float] = {}
+        self._ready: dict[str, threading.Event] = {}
+        self._initializing: dict[str, int] = {}  # household -> thread running its initializer
+        self._lock = threading.Lock()
+        self._next_sweep = 0.0
+        self._token_digests: dict[str, tuple[str | None, float]] = {}  # household -> (digest, expires)
+
+    def path_for(self, household: str) -> str:
+        if household == DEFAULT_HOUSEHOLD:
+            return make_url(DATABASE_URL).database
+        return os.path.join(HOUSEHOLD_DIR, f"{household}.db")
+
+    def known(self) -> list[str]:
+        """Every household with a database, default first."""
+        if IS_SQLITE:
+            names = [name.removesuffix(".db") for name in os.listdir(HOUSEHOLD_DIR) if name.endswith(".db")]
+        else:
+            schemas = inspect(self.engine_for(DEFAULT_HOUSEHOLD)).get_schema_names()
+            names = [schema.removeprefix("household_") for schema in schemas if schema.startswith("household_")]
+        return [DEFAULT_HOUSEHOLD, *sorted(names)]
+
+    def exists(self, household: str) -> bool:
+        """Whether the household was provisioned: it has a database file, or a schema on PostgreSQL."""
+        if household == DEFAULT_HOUSEHOLD or household in self._engines:
+            return True
+        if IS_SQLITE:
+            return os.path.exists(self.path_for(household))
+        return household in self.known()
+
+    def create(self, household: str) -> Engine:
+        """Provision a new household's database and set it up. Raises ValueError if the name is taken or invalid."""
+        if not HOUSEHOLD_PATTERN.match(household):
+            raise ValueError("Household names are lowercase letters, digits, - and _")
+        if self.exists(household):
+            raise ValueError(f"Household {household} already exists")
+        return self.engine_for(household, create=True)
+
+    def issue_token(self, household: str) -> str:
+        """Give the household a new access token, replacing any previous one. Only its digest is stored."""
+        from models import HouseholdToken  # models imports this module
+
+        token = secrets.token_urlsafe(32)
+        db = SessionLocal(household=DEFAULT_HOUSEHOLD)
+        try:
+            stmt = upsert(db, HouseholdToken).values(household=household, token_sha256=_token_digest(token))
+            db.execute(stmt.on_conflict_do_update(
+                index_elements=[HouseholdToken.household],
+                set_={"token_sha256": stmt.excluded.token_sha256, "issued_at": datetime.utcnow()},
+            ))
+            db.commit()
+        finally:
+            db.close()
+        self._token_digests.pop(household, None)
+        return token
+
+    def check_token(self, household: str, token: str | None):
+        """Raise HouseholdAuthError unless `token` is the household's; the default one may have none."""
+        digest, expires = self._token_digests.get(household, (None, 0.0))
+        if time.monotonic() >= expires:
+            from models import HouseholdToken  # models imports this module
+
+            db = SessionLocal(household=DEFAULT_HOUSEHOLD)
+            try:
+                digest = db.query(HouseholdToken.token_sha256).filter(HouseholdToken.household == household).scalar()
+            finally:
+                db.close()
+            self._token_digests[household] = (digest, time.monotonic() + TOKEN_CACHE_SECONDS)
+        if digest is None and household == DEFAULT_HOUSEHOLD:
+            return
+        if digest is None or not token or not hmac.compare_digest(_token_digest(token), digest):
+            raise HouseholdAuthError(f"Missing or invalid {HOUSEHOLD_TOKEN_HEADER} header")
+
+    def engine_for(self, household: str, create: bool = False) -> Engine:
+        if not create and not self.exists(household):
+            raise UnknownHouseholdError(household)
+        with self._lock:
+            engine = self._engines.get(household)
+            if engine is None:
+                engine = self._engines[household] = _create_engine(household)
+            self._engines.move_to_end(household)
+            self._last_used[household] = time.monotonic()
+            ready = self._ready.get(household)
+            first_open = ready is None
+            if first_open:
+                ready = self._ready[household] = threading.Event()
+                self._initializing[household] = threading.get_ident()
+            evicted = self._evict_locked(keep=household)
+        if IS_SQLITE:  # PostgreSQL households share one pool, closed by dispose_all
+            for old in evicted:
+                old.dispose()
 
-DATABASE_URL = f"sqlite:///{DB_DIR}/fitness.db"
+        if first_open:
+            try:
+                if not IS_SQLITE and household != DEFAULT_HOUSEHOLD:
+                    with engine.begin() as conn:
+                        conn.exec_driver_sql(f'CREATE SCHEMA IF NOT EXISTS "{household_schema(household)}"')
+                if self.initializer is not None:
+                    with household_context(household):
+                        self.initializer(engine)
+            except Exception:
+                with self._lock:
+                    del self._ready[household]  # let the next request retry
+                raise
+            finally:
+                self._initializing.pop(household, None)
+                ready.set()
+        elif not ready.is_set() and self._initializing.get(household) != threading.get_ident():
+            ready.wait()
+        return engine
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    def _evict_locked(self, keep: str) -> list[Engine]:
+        now = time.monotonic()
+        evicted = []
+        sweep_idle = now >= self._next_sweep
+        if sweep_idle:
+            self._next_sweep = now + IDLE_SWEEP_SECONDS
+        for household in list(self._engines):
+            if household in (keep, DEFAULT_HOUSEHOLD) or household in self._initializing:
+                continue
+            too_many = len(self._engines) > self.max_open
+            idle = sweep_idle and now - self._last_used[household] > self.idle_seconds
+            if too_many or idle:
+                evicted.append(self._engines.pop(household))
+                del self._last_used[household]
+        return evicted
+
+    def dispose_all(self):
+        global _postgres_engine
+        with self._lock:
+            engines = list(self._engines.values())
+            self._engines.clear()
+            self._last_used.clear()
+            if not IS_SQLITE and _postgres_engine is not None:
+                engines, _postgres_engine = [_postgres_engine], None
+        for engine in engines:
+            engine.dispose()
+
+
+households = HouseholdRouter(MAX_OPEN_HOUSEHOLDS, HOUSEHOLD_IDLE_SECONDS)
+
+
+class HouseholdSession(Session):
+    """Session bound to one household's database: the `household` argument, else current_household."""
+
+    def __init__(self, *args, household: str | None = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        household = household or current_household.get()
+        self.info["household"] = household
+        self.bind = households.engine_for(household)
+
+
+SessionLocal = sessionmaker(class_=HouseholdSession, autocommit=False, autoflush=False)
 Base = declarative_base()
 
 
-def get_db():
-    db = SessionLocal()
+def household_from_request(request: Request) -> str:
+    household = request.headers.get(HOUSEHOLD_HEADER, DEFAULT_HOUSEHOLD).strip().lower()
+    if not HOUSEHOLD_PATTERN.match(household):
+        raise ValueError(f"Invalid {HOUSEHOLD_HEADER} header")
+    # Checked before existence, so households can't be probed without a token
+    households.check_token(household, request.headers.get(HOUSEHOLD_TOKEN_HEADER))
+    if not households.exists(household):
+        raise UnknownHouseholdError("Unknown household")
+    return household
+
+
+def get_db(request: Request):
+    try:
+        household = household_from_request(request)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    except HouseholdAuthError as exc:
+        raise HTTPException(status_code=401, detail=str(exc))
+    except UnknownHouseholdError as exc:
+        raise HTTPException(status_code=404, detail=str(exc))
+    db = SessionLocal(household=household)
     try:
         yield db
     finally:
         db.close()
+
+
+# ─── Dialect-neutral SQL ──────────────────────────────────────────────────────
+
+class _day(FunctionElement):
+    type = Date()
+    inherit_cache = True
+
+
+class _week_start(FunctionElement):
+    type = Date()
+    inherit_cache = True
+
+
+class _month_start(FunctionElement):
+    type = Date()
+    inherit_cache = True
+
+
+class greatest(FunctionElement):
+    """Scalar max of its arguments: max() in SQLite, GREATEST() elsewhere (which skips NULLs)."""
+    inherit_cache = True
+
+
+@compiles(_day)
+def _compile_day(element, compiler, **kw):
+    return f"date({compiler.process(element.clauses, **kw)})"
+
+
+@compiles(_day, "postgresql")
+def _compile_day_pg(element, compiler, **kw):
+    return f"CAST({compiler.process(element.clauses, **kw)} AS DATE)"
+
+
+@compiles(_week_start)
+def _compile_week_start(element, compiler, **kw):
+    return f"date({compiler.process(element.clauses, **kw)}, '-6 days', 'weekday 1')"
+
+
+@compiles(_week_start, "postgresql")
+def _compile_week_start_pg(element, compiler, **kw):
+    return f"CAST(date_trunc('week', {compiler.process(element.clauses, **kw)}) AS DATE)"
+
+
+@compiles(_month_start)
+def _compile_month_start(element, compiler, **kw):
+    return f"date({compiler.process(element.clauses, **kw)}, 'start of month')"
+
+
+@compiles(_month_start, "postgresql")
+def _compile_month_start_pg(element, compiler, **kw):
+    return f"CAST(date_trunc('month', {compiler.process(element.clauses, **kw)}) AS DATE)"
+
+
+@compiles(greatest)
+def _compile_greatest(element, compiler, **kw):
+    return f"max({compiler.process(element.clauses, **kw)})"
+
+
+@compiles(greatest, "postgresql")
+def _compile_greatest_pg(element, compiler, **kw):
+    return f"GREATEST({compiler.process(element.clauses, **kw)})"
+
+
+def date_bucket(column, bucket: str = "day"):
+    """SQL date of a datetime column's day, week (Monday) or month start, on any dialect."""
+    if bucket == "week":
+        return _week_start(column)
+    if bucket == "month":
+        return _month_start(column)
+    return _day(column)
+
+
+def upsert(db, table):
+    """INSERT builder with on_conflict_do_update/do_nothing for the session's or connection's dialect."""
+    dialect = db.get_bind().dialect if isinstance(db, Session) else db.dialect
+    return (postgresql.insert if dialect.name == "postgresql" else sqlite.insert)(table)
+
+
+def bucket_range(bucket: str, day: date) -> tuple[date, date]:
+    """[start, end) of the week (Monday) or month containing `day`; the Python twin of date_bucket."""
+    if bucket == "week":
+        start = day - timedelta(days=day.weekday())
+        return start, start + timedelta(days=7)
+    start = day.replace(day=1)
+    if start.month == 12:
+        return start, start.replace(year=start.year + 1, month=1)
+    return start, start.replace(month=start.month + 1)
@@ -0,0 +1,160 @@
+import math
+import threading
+import unicodedata
+from bisect import bisect_left
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+from sqlalchemy.orm import Session
+
+from cache import get_table_version
+from models import Exercise
+
+MIN_TRIGRAM_SIMILARITY = 0.3
+USAGE_WEIGHT = 8.0
+
+
+def normalize(text: str) -> str:
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c)).lower()
+    return "".join(c if c.isalnum() else " " for c in stripped).strip()
+
+
+def trigrams(text: str) -> set[str]:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+@dataclass(frozen=True)
+class _Snapshot:
+    """One build of the index, never mutated: searches keep reading it while a rebuild is swapped in."""
+
+    version: int | None = None
+    owners: dict[int, int | None] = field(default_factory=dict)  # exercise_id -> created_by for custom exercises, None otherwise
+    names: dict[int, str] = field(default_factory=dict)
+    groups: dict[int, str] = field(default_factory=dict)
+    tokens: list[tuple[str, int]] = field(default_factory=list)  # sorted (token, exercise_id) for prefix lookups
+    trigrams: dict[str, set[int]] = field(default_factory=dict)
+    trigram_sets: dict[int, set[str]] = field(default_factory=dict)
+
+    def prefix_ids(self, prefix: str) -> set[int]:
+        ids = set()
+        i = bisect_left(self.tokens, (prefix, -1))
+        while i < len(self.tokens) and self.tokens[i][0].startswith(prefix):
+            ids.add(self.tokens[i][1])
+            i += 1
+        return ids
+
+    def match_score(self, exercise_id: int, query: str, query_tokens: list[str], query_grams: set[str]) -> float:
+        name = self.names[exercise_id]
+        group = self.groups[exercise_id]
+        name_tokens = name.split()
+        if name == query:
+            return 100.0
+        if name.startswith(query):
+            return 80.0
+        if all(any(t.startswith(q) for t in name_tokens) for q in query_tokens):
+            return 60.0
+        if all(any(t.startswith(q) for t in name_tokens + group.split()) for q in query_tokens):
+            return 45.0
+        grams = self.trigram_sets[exercise_id]
+        similarity = len(grams & query_grams) / len(grams | query_grams)
+        if similarity >= MIN_TRIGRAM_SIMILARITY:
+            return 40.0 * similarity
+        return 0.0
+
+
+def _build(db: Session, version: int) -> _Snapshot:
+    rows = db.query(
+        Exercise.id, Exercise.name, Exercise.muscle_group, Exercise.is_custom, Exercise.created_by,
+    ).all()
+    owners, names, groups, tokens = {}, {}, {}, []
+    grams: dict[str, set[int]] = defaultdict(set)
+    gram_sets = {}
+    for exercise_id, raw_name, raw_group, is_custom, created_by in rows:
+        name = normalize(raw_name)
+        group = normalize(raw_group)
+        owners[exercise_id] = created_by if is_custom else None
+        names[exercise_id] = name
+        groups[exercise_id] = group
+        for token in set(name.split()) | set(group.split()):
+            tokens.append((token, exercise_id))
+        gram_sets[exercise_id] = trigrams(name)
+        for gram in gram_sets[exercise_id]:
+            grams[gram].add(exercise_id)
+    return _Snapshot(version, owners, names, groups, sorted(tokens), dict(grams), gram_sets)
+
+
+class ExerciseSearchIndex:
+    """In-memory prefix + trigram index over exercise names and muscle groups.
+
+    Rebuilt lazily when the exercises table version changes. The version is bumped in the
+    database on every exercise insert, update or delete, so it covers custom exercises
+    created or deleted from any worker, and ids reused after a delete.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = _Snapshot()
+
+    def _ensure_fresh(self, db: Session) -> _Snapshot:
+        version = get_table_version(db, Exercise.__tablename__)
+        snapshot = self._snapshot
+        if snapshot.version == version:
+            return snapshot
+        with self._lock:
+            if self._snapshot.version != version:
+                self._snapshot = _build(db, version)
+            return self._snapshot
+
+    def search(
+        self,
+        db: Session,
+        query: str,
+        user_id: int | None,
+        usage: dict[int, int],
+        limit: int = 20,
+    ) -> list[tuple[int, float]]:
+        """Return (exercise_id, score) pairs visible to `user_id`, best match first."""
+        index = self._ensure_fresh(db)
+        query = normalize(query)
+        query_tokens = query.split()
+
+        def visible(exercise_id: int) -> bool:
+            owner = index.owners[exercise_id]
+            return owner is None or owner == user_id
+
+        if not query_tokens:
+            # Empty query: most used first, then alphabetical
+            ranked = sorted(
+                (eid for eid in index.owners if visible(eid)),
+                key=lambda eid: (-usage.get(eid, 0), index.names[eid]),
+            )
+            return [(eid, 0.0) for eid in ranked[:limit]]
+
+        query_grams = trigrams(query)
+        candidates = set.intersection(*(index.prefix_ids(q) for q in query_tokens))
+        for gram in query_grams:
+            candidates |= index.trigrams.get(gram, set())
+
+        scored = []
+        for exercise_id in candidates:
+            if not visible(exercise_id):
+                continue
+            score = index.match_score(exercise_id, query, query_tokens, query_grams)
+            if score <= 0:
+                continue
+            score += USAGE_WEIGHT * math.log1p(usage.get(exercise_id, 0))
+            scored.append((score, index.names[exercise_id], exercise_id))
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        return [(eid, round(score, 2)) for score, _name, eid in scored[:limit]]
+
+
+_indexes: dict[str, ExerciseSearchIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def exercise_index_for(db: Session) -> ExerciseSearchIndex:
+    """The index of the session's household database."""
+    with _indexes_lock:
+        return _indexes.setdefault(db.info["household"], ExerciseSearchIndex())
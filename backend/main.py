@@ -1,31 +1,158 @@
 from contextlib import asynccontextmanager
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy import text
+from fastapi.responses import JSONResponse
+from sqlalchemy import ForeignKeyConstraint, Table, inspect, text, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.schema import AddConstraint, CreateTable
 
-from database import engine, Base
+from change_log import SYNCED_MODELS, backfill_change_log, log_changes
+from database import (
+    DEFAULT_HOUSEHOLD, Base, HouseholdAuthError, UnknownHouseholdError, date_bucket, household_context,
+    household_from_request, households,
+)
+from notes_search import install_notes_search
+from scheduler import SCHEDULER_ENABLED, scheduler
 from seed import seed_initial_data
-import models  # noqa: F401 – registers ORM models with Base
+from write_queue import WRITE_QUEUE, WRITE_QUEUE_ENABLED
+import training_load
+from models import BodyMeasurement  # also registers every ORM model with Base
+import cache  # noqa: F401 – registers the data-version flush hook
 from routers import (
+    admin,
     body_measurements,
     body_weight,
     boosts,
+    compare,
     dashboard,
     exercises,
     favorites,
     insights,
+    mutations,
     progress,
     sets,
+    sync,
     users,
     workouts,
 )
 
 
-def run_migrations():
+MEASUREMENT_COLUMNS = ["chest_cm", "waist_cm", "hips_cm", "arm_cm", "thigh_cm", "calf_cm"]
+
+
+def _merge_duplicate_measurement_days(conn):
+    """Collapse same-day measurement rows (newest non-null value wins) so the unique day index can be built."""
+    duplicates = conn.execute(text(
+        "SELECT user_id, logged_day FROM body_measurements "
+        "GROUP BY user_id, logged_day HAVING COUNT(*) > 1"
+    )).all()
+    for user_id, logged_day in duplicates:
+        rows = conn.execute(
+            text(
+                f"SELECT id, {', '.join(MEASUREMENT_COLUMNS)} FROM body_measurements "
+                "WHERE user_id = :user_id AND logged_day = :logged_day ORDER BY logged_at DESC, id DESC"
+            ),
+            {"user_id": user_id, "logged_day": logged_day},
+        ).all()
+        keep_id = rows[0][0]
+        merged = {
+            column: next((row[i + 1] for row in rows if row[i + 1] is not None), None)
+            for i, column in enumerate(MEASUREMENT_COLUMNS)
+        }
+        conn.execute(
+            text(
+                f"UPDATE body_measurements SET {', '.join(f'{c} = :{c}' for c in MEASUREMENT_COLUMNS)} "
+                "WHERE id = :id"
+            ),
+            {**merged, "id": keep_id},
+        )
+        conn.execute(
+            text("DELETE FROM body_measurements WHERE user_id = :user_id AND logged_day = :logged_day AND id != :id"),
+            {"user_id": user_id, "logged_day": logged_day, "id": keep_id},
+        )
+
+
+def _column_names(conn, table: str) -> set[str]:
+    return {column["name"] for column in inspect(conn).get_columns(table)}
+
+
+def _table_sql(conn, table: str) -> str:
+    return conn.execute(
+        text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": table}
+    ).scalar() or ""
+
+
+def _rebuild_table(conn, table: Table):
+    """Recreate a SQLite table from its model, keeping its rows, for changes ALTER TABLE can't make.
+
+    Indexes are recreated here. Triggers mentioning the table are dropped (SQLite won't rename
+    around them) and reinstalled by install_notes_search.
+    """
+    triggers = conn.execute(
+        text("SELECT name FROM sqlite_master WHERE type = 'trigger' AND sql LIKE :pattern"),
+        {"pattern": f"%{table.name}%"},
+    ).scalars().all()
+    for trigger in triggers:
+        conn.execute(text(f"DROP TRIGGER {trigger}"))
+    existing = _column_names(conn, table.name)
+    columns = ", ".join(column.name for column in table.columns if column.name in existing)
+    create = str(CreateTable(table).compile(dialect=conn.dialect))
+    conn.execute(text(create.replace(f"CREATE TABLE {table.name} ", f"CREATE TABLE {table.name}_rebuild ", 1)))
+    conn.execute(text(f"INSERT INTO {table.name}_rebuild ({columns}) SELECT {columns} FROM {table.name}"))
+    conn.execute(text(f"DROP TABLE {table.name}"))
+    conn.execute(text(f"ALTER TABLE {table.name}_rebuild RENAME TO {table.name}"))
+    for index in table.indexes:
+        index.create(conn, checkfirst=True)
+
+
+def _foreign_key_actions(conn, table: str) -> dict[tuple[str, str], tuple[str | None, str]]:
+    """(column, referred table) -> (constraint name, ON DELETE action) of the table's foreign keys as they are."""
+    if conn.dialect.name == "sqlite":
+        rows = conn.exec_driver_sql(f"PRAGMA foreign_key_list({table})").mappings()
+        return {(row["from"], row["table"]): (None, row["on_delete"].upper()) for row in rows}
+    return {
+        (fk["constrained_columns"][0], fk["referred_table"]): (
+            fk["name"], (fk["options"].get("ondelete") or "NO ACTION").upper(),
+        )
+        for fk in inspect(conn).get_foreign_keys(table)
+    }
+
+
+def _stale_foreign_keys(conn, table: Table) -> list[tuple[ForeignKeyConstraint, str | None]]:
+    """The model's foreign keys the database lacks or has with another ON DELETE action, with the name of the old one."""
+    existing = _foreign_key_actions(conn, table.name)
+    stale = []
+    for constraint in table.foreign_key_constraints:
+        name, action = existing.get((constraint.elements[0].parent.name, constraint.referred_table.name), (None, None))
+        if action != (constraint.ondelete or "NO ACTION").upper():
+            stale.append((constraint, name))
+    return stale
+
+
+def _drop_orphans(conn):
+    """Delete rows whose parent is gone, or null the reference for ON DELETE SET NULL keys.
+
+    Such rows could pile up while SQLite didn't enforce foreign keys; deleting one may orphan its own children.
+    """
+    while orphans := conn.exec_driver_sql("PRAGMA foreign_key_check").all():
+        deleted: dict[str, list[int]] = {}
+        for table, rowid, _parent, fk_id in orphans:
+            fk = next(row for row in conn.exec_driver_sql(f"PRAGMA foreign_key_list({table})").mappings() if row["id"] == fk_id)
+            if fk["on_delete"].upper() == "SET NULL":
+                conn.execute(text(f"UPDATE {table} SET {fk['from']} = NULL WHERE rowid = :rowid"), {"rowid": rowid})
+            else:
+                conn.execute(text(f"DELETE FROM {table} WHERE rowid = :rowid"), {"rowid": rowid})
+                deleted.setdefault(table, []).append(rowid)
+        for table, ids in deleted.items():
+            if table in SYNCED_MODELS:
+                log_changes(conn, table, ids, op="delete")
+
+
+def run_migrations(engine: Engine):
     """Add new columns to existing tables (SQLAlchemy create_all won't do this)."""
     with engine.connect() as conn:
         # Columns added to workout_sets after initial schema creation
-        existing_sets = {row[1] for row in conn.execute(text("PRAGMA table_info(workout_sets)"))}
+        existing_sets = _column_names(conn, "workout_sets")
         for col, definition in [
             ("duration_seconds", "INTEGER"),
             ("resistance",       "INTEGER"),
@@ -34,26 +161,117 @@ def run_migrations():
         ]:
             if col not in existing_sets:
                 conn.execute(text(f"ALTER TABLE workout_sets ADD COLUMN {col} {definition}"))
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_workout_sets_exercise_status_logged "
+            "ON workout_sets (exercise_id, status, logged_at)"
+        ))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_workouts_user_started ON workouts (user_id, started_at)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_workout_sets_workout ON workout_sets (workout_id)"))
 
         # Columns added to users after initial schema creation
-        existing_users = {row[1] for row in conn.execute(text("PRAGMA table_info(users)"))}
+        existing_users = _column_names(conn, "users")
         if "target_weight_kg" not in existing_users:
             conn.execute(text("ALTER TABLE users ADD COLUMN target_weight_kg REAL"))
+        if "data_version" not in existing_users:
+            conn.execute(text("ALTER TABLE users ADD COLUMN data_version INTEGER NOT NULL DEFAULT 0"))
+        if "history_version" not in existing_users:
+            conn.execute(text("ALTER TABLE users ADD COLUMN history_version INTEGER NOT NULL DEFAULT 0"))
+        if "household" not in existing_users:
+            conn.execute(text(f"ALTER TABLE users ADD COLUMN household VARCHAR NOT NULL DEFAULT '{DEFAULT_HOUSEHOLD}'"))
 
         # Columns added to exercises after initial schema creation
-        existing_exercises = {row[1] for row in conn.execute(text("PRAGMA table_info(exercises)"))}
+        existing_exercises = _column_names(conn, "exercises")
         if "photo_filename" not in existing_exercises:
             conn.execute(text("ALTER TABLE exercises ADD COLUMN photo_filename TEXT"))
 
+        # Columns added to body_weights after initial schema creation
+        existing_weights = _column_names(conn, "body_weights")
+        if "trend_kg" not in existing_weights:
+            conn.execute(text("ALTER TABLE body_weights ADD COLUMN trend_kg REAL"))
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_body_weights_user_logged ON body_weights (user_id, logged_at)"
+        ))
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_body_measurements_user_logged ON body_measurements (user_id, logged_at)"
+        ))
+
+        # Stored day key for body_measurements, backfilled then made unique per user
+        existing_measurements = _column_names(conn, "body_measurements")
+        if "logged_day" not in existing_measurements:
+            conn.execute(text("ALTER TABLE body_measurements ADD COLUMN logged_day DATE"))
+        conn.execute(
+            update(BodyMeasurement.__table__)
+            .where(BodyMeasurement.logged_day.is_(None))
+            .values(logged_day=date_bucket(BodyMeasurement.logged_at))
+        )
+        _merge_duplicate_measurement_days(conn)
+        conn.execute(text(
+            "CREATE UNIQUE INDEX IF NOT EXISTS uq_body_measurements_user_day "
+            "ON body_measurements (user_id, logged_day)"
+        ))
+
+        # Foreign keys with their ON DELETE actions, and workout/set ids never reused once archived
+        # rows keep theirs (archive.py). SQLite can't alter either in place, so those tables are
+        # rebuilt, with enforcement off: DROP TABLE would cascade. That pragma is a no-op inside a
+        # transaction, hence the commits around it.
+        if conn.dialect.name == "sqlite":
+            rebuild = [
+                table for table in Base.metadata.sorted_tables
+                if _stale_foreign_keys(conn, table) or (
+                    table.kwargs.get("sqlite_autoincrement")
+                    and "AUTOINCREMENT" not in _table_sql(conn, table.name).upper()
+                )
+            ]
+            if rebuild:
+                conn.commit()
+                conn.exec_driver_sql("PRAGMA foreign_keys=OFF")
+                for table in rebuild:
+                    _rebuild_table(conn, table)
+                _drop_orphans(conn)
+                conn.commit()
+                conn.exec_driver_sql("PRAGMA foreign_keys=ON")
+        else:
+            for table in Base.metadata.sorted_tables:
+                for constraint, name in _stale_foreign_keys(conn, table):
+                    if name:
+                        conn.execute(text(f'ALTER TABLE {table.name} DROP CONSTRAINT "{name}"'))
+                    conn.execute(AddConstraint(constraint))
+
+        # Full-text index over workout names/notes and set notes, kept in sync by triggers
+        install_notes_search(conn)
+
+        # Existing rows become the starting point of the sync change log
+        backfill_change_log(conn)
+
         conn.commit()
 
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
+def init_household_database(engine: Engine):
+    """Bring a household's database up to date; runs once per process, on its first use."""
     Base.metadata.create_all(bind=engine)
-    run_migrations()
+    run_migrations(engine)
     seed_initial_data()
+    body_weight.backfill_weight_trends()
+    exercises.backfill_usage_counters()
+    training_load.backfill_daily_loads()
+
+
+households.initializer = init_household_database
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    households.engine_for(DEFAULT_HOUSEHOLD)  # other households are set up lazily
+    if SCHEDULER_ENABLED:
+        scheduler.start()
+    if WRITE_QUEUE_ENABLED:
+        WRITE_QUEUE.start()
+    sets.SET_WRITE_BUFFER.start()
     yield
+    sets.SET_WRITE_BUFFER.close()
+    WRITE_QUEUE.stop()
+    scheduler.stop()
+    households.dispose_all()
 
 
 app = FastAPI(title="FitCouple API", lifespan=lifespan)
@@ -66,6 +284,31 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.middleware("http")
+async def bind_household(request: Request, call_next):
+    # Sessions, the writer queue and caches all follow current_household
+    if request.url.path.startswith("/admin/"):  # not household data: guarded by the admin token instead
+        return await call_next(request)
+    try:
+        household = household_from_request(request)
+    except ValueError as exc:
+        return JSONResponse(status_code=400, content={"detail": str(exc)})
+    except HouseholdAuthError as exc:
+        return JSONResponse(status_code=401, content={"detail": str(exc)})
+    except UnknownHouseholdError as exc:
+        return JSONResponse(status_code=404, content={"detail": str(exc)})
+    with household_context(household):
+        return await call_next(request)
+
+
+@app.middleware("http")
+async def track_activity(request: Request, call_next):
+    # Idle-only background jobs wait until requests have stopped for a while
+    scheduler.note_activity()
+    return await call_next(request)
+
+
 app.include_router(users.router)
 app.include_router(exercises.router)
 app.include_router(workouts.router)
@@ -77,6 +320,10 @@ app.include_router(body_weight.router)
 app.include_router(body_measurements.router)
 app.include_router(favorites.router)
 app.include_router(insights.router)
+app.include_router(compare.router)
+app.include_router(sync.router)
+app.include_router(mutations.router)
+app.include_router(admin.router)
 
 
 @app.get("/")
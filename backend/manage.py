@@ -0,0 +1,138 @@
+"""Maintenance commands, run from the backend directory: python manage.py <command>"""
+import argparse
+from datetime import datetime, timedelta
+
+from archive import ARCHIVE_AFTER_DAYS, archive_old_workouts
+from backup import BackupError, create_backup, list_backups, restore_backup
+from database import DEFAULT_HOUSEHOLD, HOUSEHOLD_TOKEN_HEADER, SessionLocal, household_context, households
+import main  # noqa: F401 – migrates and seeds household databases on first use
+from routers.exercises import rebuild_usage_counters
+from seed import create_household
+from training_load import rebuild_daily_loads
+from write_queue import WRITE_QUEUE
+
+
+def rebuild_usage(args):
+    db = SessionLocal()
+    try:
+        written = rebuild_usage_counters(db, args.user_id)
+        db.commit()
+    finally:
+        db.close()
+    print(f"Rebuilt {written} usage counters")
+
+
+def rebuild_load(args):
+    db = SessionLocal()
+    try:
+        written = rebuild_daily_loads(db, args.user_id)
+        db.commit()
+    finally:
+        db.close()
+    print(f"Rebuilt {written} daily loads")
+
+
+def archive(args):
+    if args.days <= 0:
+        raise SystemExit("Pass --days or set FITCOUPLE_ARCHIVE_AFTER_DAYS")
+    archived = archive_old_workouts(WRITE_QUEUE.run, datetime.utcnow() - timedelta(days=args.days))
+    print(f"Archived {archived} workouts")
+
+
+def backup(args):
+    try:
+        manifest = create_backup()
+    except BackupError as exc:
+        raise SystemExit(str(exc))
+    for household, entry in manifest["databases"].items():
+        print(f"{household}: {entry['pages']} pages, {entry['compressed_bytes']} bytes compressed in {entry['seconds']}s")
+    print(f"Backup {manifest['name']}: {manifest['photos_copied']} new photos, pruned {len(manifest['pruned'])} old backups")
+
+
+def backups(args):
+    for manifest in list_backups():
+        print(f"{manifest['name']}  {', '.join(manifest['databases'])}  {len(manifest['photos'])} photos")
+
+
+def restore(args):
+    try:
+        restored = restore_backup(args.name, args.household, restore_photos=not args.skip_photos)
+    except BackupError as exc:
+        raise SystemExit(str(exc))
+    print(
+        f"Restored household {restored['household']} from {restored['name']} ({restored['pages']} pages, "
+        f"{restored['photos_restored']} photos); restart the app to drop its caches"
+    )
+
+
+def create_household_command(args):
+    users = []
+    for member in args.user:
+        name, _sep, theme_key = member.partition(":")
+        users.append({"name": name, "theme_key": theme_key or name.lower()})
+    try:
+        created, token = create_household(args.name, users)
+    except ValueError as exc:
+        raise SystemExit(str(exc))
+    print(f"Created household {args.name} with users {', '.join(f'{u.name} (id {u.id})' for u in created)}")
+    print(f"{HOUSEHOLD_TOKEN_HEADER}: {token}")
+
+
+def household_token(args):
+    if not households.exists(args.name):
+        raise SystemExit(f"Unknown household {args.name}")
+    token = households.issue_token(args.name)
+    print(f"New token for household {args.name}, the previous one no longer works")
+    print(f"{HOUSEHOLD_TOKEN_HEADER}: {token}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FitCouple maintenance commands")
+    parser.add_argument("--household", default=DEFAULT_HOUSEHOLD, help="household database to work on")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    usage = commands.add_parser("rebuild-usage", help="recompute user_exercise_usage from logged sets")
+    usage.add_argument("--user-id", type=int, help="only rebuild this user's counters")
+    usage.set_defaults(func=rebuild_usage)
+
+    load = commands.add_parser("rebuild-load", help="recompute daily_loads from logged sets")
+    load.add_argument("--user-id", type=int, help="only rebuild this user's daily loads")
+    load.set_defaults(func=rebuild_load)
+
+    archiving = commands.add_parser("archive", help="move old completed workouts to the archive tables")
+    archiving.add_argument(
+        "--days", type=int, default=ARCHIVE_AFTER_DAYS, help="archive workouts completed more than this many days ago",
+    )
+    archiving.set_defaults(func=archive)
+
+    backing_up = commands.add_parser("backup", help="snapshot every household database and the exercise photos")
+    backing_up.set_defaults(func=backup)
+
+    listing = commands.add_parser("backups", help="list the backups kept, newest first")
+    listing.set_defaults(func=backups)
+
+    restoring = commands.add_parser("restore", help="restore the --household database from a backup")
+    restoring.add_argument("name", help="backup to restore, as listed by the backups command")
+    restoring.add_argument("--skip-photos", action="store_true", help="don't copy back missing exercise photos")
+    restoring.set_defaults(func=restore)
+
+    creating = commands.add_parser("create-household", help="provision a new household database with its members")
+    creating.add_argument("name", help="household name, as sent in the X-Household header")
+    creating.add_argument(
+        "--user", action="append", required=True, metavar="NAME[:THEME]", help="a member; repeat for each",
+    )
+    creating.set_defaults(func=create_household_command)
+
+    issuing = commands.add_parser(
+        "household-token", help="issue a new access token for a household (the default one then requires it too)",
+    )
+    issuing.add_argument("name", help="household name")
+    issuing.set_defaults(func=household_token)
+
+    args = parser.parse_args()
+    with household_context(args.household):
+        args.func(args)
+
+
+if __name__ == "__main__":
+    main()
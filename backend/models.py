@@ -1,7 +1,9 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Text
+from sqlalchemy import (
+    Column, Integer, String, Float, Boolean, Date, DateTime, ForeignKey, Text, Index, UniqueConstraint, select, union_all,
+)
 from sqlalchemy.orm import relationship
-from database import Base
+from database import Base, current_household
 
 
 class User(Base):
@@ -11,14 +13,23 @@ class User(Base):
     name = Column(String, nullable=False)
     theme_key = Column(String, nullable=False)  # "pierre" | "partner"
     target_weight_kg = Column(Float, nullable=True)
+    data_version = Column(Integer, nullable=False, default=0)  # bumped on every write to the user's data
+    history_version = Column(Integer, nullable=False, default=0)  # bumped only when closed periods change
+    household = Column(String, nullable=False, default=lambda: current_household.get())  # names the database file it lives in
     created_at = Column(DateTime, default=datetime.utcnow)
 
-    workouts = relationship("Workout", back_populates="user")
-    custom_exercises = relationship("Exercise", back_populates="creator")
-    sent_boosts = relationship("Boost", foreign_keys="Boost.from_user_id", back_populates="sender")
-    received_boosts = relationship("Boost", foreign_keys="Boost.to_user_id", back_populates="recipient")
-    favorite_templates = relationship("FavoriteTemplate", back_populates="user")
-    body_measurements = relationship("BodyMeasurement", back_populates="user")
+    # The database cascades (or nulls, for custom exercises) on delete: passive_deletes
+    # keeps the ORM from loading every child row first
+    workouts = relationship("Workout", back_populates="user", passive_deletes=True)
+    custom_exercises = relationship("Exercise", back_populates="creator", passive_deletes=True)
+    sent_boosts = relationship(
+        "Boost", foreign_keys="Boost.from_user_id", back_populates="sender", passive_deletes=True,
+    )
+    received_boosts = relationship(
+        "Boost", foreign_keys="Boost.to_user_id", back_populates="recipient", passive_deletes=True,
+    )
+    favorite_templates = relationship("FavoriteTemplate", back_populates="user", passive_deletes=True)
+    body_measurements = relationship("BodyMeasurement", back_populates="user", passive_deletes=True)
 
 
 class Exercise(Base):
@@ -28,19 +39,19 @@ class Exercise(Base):
     name = Column(String, nullable=False)
     muscle_group = Column(String, nullable=False)
     is_custom = Column(Boolean, default=False)
-    created_by = Column(Integer, ForeignKey("users.id"), nullable=True)
+    created_by = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
     photo_filename = Column(String, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
 
     creator = relationship("User", back_populates="custom_exercises")
-    sets = relationship("WorkoutSet", back_populates="exercise")
+    sets = relationship("WorkoutSet", back_populates="exercise", passive_deletes=True)
 
 
 class Workout(Base):
     __tablename__ = "workouts"
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     type = Column(String, nullable=False)  # Push/Pull/Legs/Full Body/Cardio/Custom
     name = Column(String, nullable=True)
     notes = Column(Text, nullable=True)
@@ -48,15 +59,20 @@ class Workout(Base):
     completed_at = Column(DateTime, nullable=True)
 
     user = relationship("User", back_populates="workouts")
-    sets = relationship("WorkoutSet", back_populates="workout", cascade="all, delete-orphan")
+    sets = relationship("WorkoutSet", back_populates="workout", cascade="all, delete-orphan", passive_deletes=True)
+
+    __table_args__ = (
+        Index("ix_workouts_user_started", "user_id", "started_at"),
+        {"sqlite_autoincrement": True},  # ids are never reused: archived workouts keep theirs
+    )
 
 
 class WorkoutSet(Base):
     __tablename__ = "workout_sets"
 
     id = Column(Integer, primary_key=True, index=True)
-    workout_id = Column(Integer, ForeignKey("workouts.id"), nullable=False)
-    exercise_id = Column(Integer, ForeignKey("exercises.id"), nullable=False)
+    workout_id = Column(Integer, ForeignKey("workouts.id", ondelete="CASCADE"), nullable=False)
+    exercise_id = Column(Integer, ForeignKey("exercises.id", ondelete="RESTRICT"), nullable=False)  # history outlives no exercise
     set_number = Column(Integer, nullable=False)
     weight_kg = Column(Float, nullable=True)
     reps = Column(Integer, nullable=True)
@@ -72,23 +88,154 @@ class WorkoutSet(Base):
     workout = relationship("Workout", back_populates="sets")
     exercise = relationship("Exercise", back_populates="sets")
 
+    __table_args__ = (
+        Index("ix_workout_sets_exercise_status_logged", "exercise_id", "status", "logged_at"),
+        Index("ix_workout_sets_workout", "workout_id"),  # ON DELETE CASCADE from workouts looks sets up by it
+        {"sqlite_autoincrement": True},
+    )
+
+
+class ArchivedWorkout(Base):
+    """A completed workout moved out of `workouts` by the archival job (archive.py), id unchanged."""
+
+    __tablename__ = "workouts_archive"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    type = Column(String, nullable=False)
+    name = Column(String, nullable=True)
+    notes = Column(Text, nullable=True)
+    started_at = Column(DateTime, nullable=True)
+    completed_at = Column(DateTime, nullable=True)
+    last_activity_at = Column(DateTime, nullable=False)  # newest started/completed/logged time, see archived_through
+
+    __table_args__ = (
+        Index("ix_workouts_archive_user_started", "user_id", "started_at"),
+        Index("ix_workouts_archive_last_activity", "last_activity_at"),
+    )
+
+
+class ArchivedSet(Base):
+    __tablename__ = "workout_sets_archive"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    workout_id = Column(Integer, ForeignKey("workouts_archive.id", ondelete="CASCADE"), nullable=False)
+    exercise_id = Column(Integer, ForeignKey("exercises.id", ondelete="RESTRICT"), nullable=False)  # history outlives no exercise
+    set_number = Column(Integer, nullable=False)
+    weight_kg = Column(Float, nullable=True)
+    reps = Column(Integer, nullable=True)
+    rpe = Column(Integer, nullable=True)
+    status = Column(String, nullable=True)
+    logged_at = Column(DateTime, nullable=True)
+    duration_seconds = Column(Integer, nullable=True)
+    resistance = Column(Integer, nullable=True)
+    calories = Column(Integer, nullable=True)
+    notes = Column(Text, nullable=True)
+
+    __table_args__ = (
+        Index("ix_workout_sets_archive_workout", "workout_id"),
+        Index("ix_workout_sets_archive_exercise_logged", "exercise_id", "logged_at"),
+    )
+
+
+def _hot_and_archived(hot, archived, name: str):
+    columns = [column.name for column in hot.__table__.columns]
+    return union_all(
+        select(*(hot.__table__.c[column] for column in columns)),
+        select(*(archived.__table__.c[column] for column in columns)),
+    ).subquery(name)
+
+
+class WorkoutHistory(Base):
+    """Read-only workouts ∪ workouts_archive, with Workout's attributes; see archive.history_models."""
+
+    __table__ = _hot_and_archived(Workout, ArchivedWorkout, "workout_history")
+    __mapper_args__ = {"primary_key": [__table__.c.id]}
+
+    sets = relationship(
+        "WorkoutSetHistory",
+        primaryjoin="WorkoutHistory.id == foreign(WorkoutSetHistory.workout_id)",
+        viewonly=True,
+    )
+
+
+class WorkoutSetHistory(Base):
+    """Read-only workout_sets ∪ workout_sets_archive, with WorkoutSet's attributes."""
+
+    __table__ = _hot_and_archived(WorkoutSet, ArchivedSet, "workout_set_history")
+    __mapper_args__ = {"primary_key": [__table__.c.id]}
+
+    workout = relationship(
+        "WorkoutHistory",
+        primaryjoin="foreign(WorkoutSetHistory.workout_id) == WorkoutHistory.id",
+        viewonly=True,
+    )
+    exercise = relationship(
+        "Exercise",
+        primaryjoin="foreign(WorkoutSetHistory.exercise_id) == Exercise.id",
+        viewonly=True,
+    )
+
+
+class UserExerciseUsage(Base):
+    """Maintained per-user counters of logged sets, kept in step with workout_sets writes."""
+
+    __tablename__ = "user_exercise_usage"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    exercise_id = Column(Integer, ForeignKey("exercises.id", ondelete="CASCADE"), primary_key=True)
+    set_count = Column(Integer, nullable=False, default=0)
+    last_used_at = Column(DateTime, nullable=True)
+
+
+class DailyLoad(Base):
+    """Per-user training load of one day, recomputed whenever that day's sets change."""
+
+    __tablename__ = "daily_loads"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    load = Column(Float, nullable=False, default=0)
+
 
 class BodyWeight(Base):
     __tablename__ = "body_weights"
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     weight_kg = Column(Float, nullable=False)
+    trend_kg = Column(Float, nullable=True)  # EWMA of weight_kg up to this entry
     logged_at = Column(DateTime, default=datetime.utcnow)
 
     user = relationship("User")
 
+    __table_args__ = (
+        Index("ix_body_weights_user_logged", "user_id", "logged_at"),
+    )
+
+
+class BodyWeightRollup(Base):
+    __tablename__ = "body_weight_rollups"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    bucket = Column(String, nullable=False)  # week | month
+    period_start = Column(Date, nullable=False)
+    count = Column(Integer, nullable=False, default=0)
+    total_kg = Column(Float, nullable=False, default=0.0)
+    min_kg = Column(Float, nullable=True)
+    max_kg = Column(Float, nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "bucket", "period_start", name="uq_body_weight_rollups_bucket"),
+    )
+
 
 class BodyMeasurement(Base):
     __tablename__ = "body_measurements"
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     chest_cm = Column(Float, nullable=True)
     waist_cm = Column(Float, nullable=True)
     hips_cm = Column(Float, nullable=True)
@@ -96,16 +243,22 @@ class BodyMeasurement(Base):
     thigh_cm = Column(Float, nullable=True)
     calf_cm = Column(Float, nullable=True)
     logged_at = Column(DateTime, default=datetime.utcnow)
+    logged_day = Column(Date, nullable=True)  # logged_at.date(), one measurement per user per day
 
     user = relationship("User", back_populates="body_measurements")
 
+    __table_args__ = (
+        Index("ix_body_measurements_user_logged", "user_id", "logged_at"),
+        Index("uq_body_measurements_user_day", "user_id", "logged_day", unique=True),
+    )
+
 
 class Boost(Base):
     __tablename__ = "boosts"
 
     id = Column(Integer, primary_key=True, index=True)
-    from_user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    to_user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    from_user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    to_user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     message = Column(String, nullable=False)
     sent_at = Column(DateTime, default=datetime.utcnow)
     read_at = Column(DateTime, nullable=True)
@@ -118,9 +271,74 @@ class FavoriteTemplate(Base):
     __tablename__ = "favorite_templates"
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     name = Column(String, nullable=False)
     workout_type = Column(String, nullable=False)  # Push/Pull/Legs/Full Body/Cardio/Custom
     created_at = Column(DateTime, default=datetime.utcnow)
 
     user = relationship("User", back_populates="favorite_templates")
+
+
+class SchedulerLock(Base):
+    __tablename__ = "scheduler_locks"
+
+    name = Column(String, primary_key=True)
+    owner = Column(String, nullable=False)
+    heartbeat_at = Column(DateTime, nullable=False)
+
+
+class HouseholdToken(Base):
+    """Access token of a household, as a sha256 digest; kept in the default household's database."""
+
+    __tablename__ = "household_tokens"
+
+    household = Column(String, primary_key=True)
+    token_sha256 = Column(String, nullable=False)
+    issued_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+class SchedulerJobRun(Base):
+    """When each background job last started, so a newly elected leader doesn't rerun today's daily jobs."""
+
+    __tablename__ = "scheduler_job_runs"
+
+    name = Column(String, primary_key=True)
+    last_started_at = Column(DateTime, nullable=False)
+
+
+class TableVersion(Base):
+    """Write counter of a table cached in process memory (the exercise search index), bumped on every change."""
+
+    __tablename__ = "table_versions"
+
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+class ChangeLog(Base):
+    """Append-only record of synced rows written, read by GET /sync. The id is the client cursor."""
+
+    __tablename__ = "change_log"
+
+    id = Column(Integer, primary_key=True)
+    entity = Column(String, nullable=False)  # table name
+    entity_id = Column(Integer, nullable=False)
+    op = Column(String, nullable=False)  # upsert | delete
+    changed_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_change_log_entity", "entity", "entity_id"),
+        {"sqlite_autoincrement": True},  # cursors must never be reused
+    )
+
+
+class ProcessedMutation(Base):
+    """Idempotency keys of applied batch operations and their stored results, kept for MUTATION_KEY_TTL."""
+
+    __tablename__ = "processed_mutations"
+
+    key = Column(String, primary_key=True)
+    op = Column(String, nullable=False)
+    status_code = Column(Integer, nullable=False)
+    result = Column(Text, nullable=True)  # JSON body returned when the operation was applied
+    processed_at = Column(DateTime, default=datetime.utcnow, index=True)
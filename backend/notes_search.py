@@ -0,0 +1,250 @@
+import base64
+import html
+import logging
+import re
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger("fitcouple.search")
+
+# One FTS5 row per workout (rowid = workouts.id). Triggers keep it in step with
+# every write path, ORM or Core, so nothing in the routers has to remember it.
+FTS_TABLE = "workout_search"
+NAME_WEIGHT, NOTES_WEIGHT, SET_NOTES_WEIGHT = 3.0, 1.0, 1.0
+SNIPPET_TOKENS = 12
+HIGHLIGHT_START, HIGHLIGHT_END = "\x02", "\x03"  # swapped for <mark> after HTML-escaping
+
+_INDEX_FROM = f"""
+    INSERT INTO {FTS_TABLE} (rowid, name, notes, set_notes, user_id)
+    SELECT w.id, coalesce(w.name, ''), coalesce(w.notes, ''),
+           coalesce((SELECT group_concat(s.notes, ' | ') FROM {{sets}} s
+                     WHERE s.workout_id = w.id AND s.notes IS NOT NULL AND s.notes != ''), ''),
+           w.user_id
+    FROM {{workouts}} w
+"""
+_INDEX_WORKOUTS = _INDEX_FROM.format(workouts="workouts", sets="workout_sets")
+# Archived workouts (archive.py) stay indexed; the job re-adds the rows the delete triggers dropped
+_INDEX_ARCHIVED = _INDEX_FROM.format(workouts="workouts_archive", sets="workout_sets_archive")
+_REFRESH_WORKOUT = f"DELETE FROM {FTS_TABLE} WHERE rowid = {{id}}; {_INDEX_WORKOUTS} WHERE w.id = {{id}};"
+
+TRIGGERS = {
+    "workouts_search_ai": f"AFTER INSERT ON workouts BEGIN {_REFRESH_WORKOUT.format(id='new.id')} END",
+    "workouts_search_au": (
+        f"AFTER UPDATE OF name, notes, user_id ON workouts BEGIN {_REFRESH_WORKOUT.format(id='new.id')} END"
+    ),
+    "workouts_search_ad": f"AFTER DELETE ON workouts BEGIN DELETE FROM {FTS_TABLE} WHERE rowid = old.id; END",
+    "workout_sets_search_ai": (
+        "AFTER INSERT ON workout_sets WHEN new.notes IS NOT NULL AND new.notes != '' "
+        f"BEGIN {_REFRESH_WORKOUT.format(id='new.workout_id')} END"
+    ),
+    "workout_sets_search_au": (
+        "AFTER UPDATE OF notes, workout_id ON workout_sets "
+        f"BEGIN {_REFRESH_WORKOUT.format(id='old.workout_id')} {_REFRESH_WORKOUT.format(id='new.workout_id')} END"
+    ),
+    "workout_sets_search_ad": (
+        "AFTER DELETE ON workout_sets WHEN old.notes IS NOT NULL AND old.notes != '' "
+        f"BEGIN {_REFRESH_WORKOUT.format(id='old.workout_id')} END"
+    ),
+}
+
+# PostgreSQL: a stored tsvector per workout (name 'A', notes 'D') and per set (notes), each
+# GIN-indexed, in the hot and archive tables. Generated columns follow every write path like
+# the triggers do, and the ORM models never see them (archive.py copies the models' columns).
+WORKOUT_TABLES, SET_TABLES = ("workouts", "workouts_archive"), ("workout_sets", "workout_sets_archive")
+_WORKOUT_VECTOR = (
+    "setweight(to_tsvector('simple'::regconfig, coalesce(name, '')), 'A') "
+    "|| setweight(to_tsvector('simple'::regconfig, coalesce(notes, '')), 'D')"
+)
+_SET_VECTOR = "to_tsvector('simple'::regconfig, coalesce(notes, ''))"
+
+
+def install_notes_search(conn) -> bool:
+    """Create the FTS5 table and its triggers, backfilling it on first install.
+
+    Returns False (and leaves the schema untouched) when SQLite was built without FTS5.
+    On PostgreSQL, adds the generated search_vector columns and their GIN indexes instead.
+    """
+    if conn.dialect.name != "sqlite":
+        for tables, expression in ((WORKOUT_TABLES, _WORKOUT_VECTOR), (SET_TABLES, _SET_VECTOR)):
+            for table in tables:
+                conn.execute(text(
+                    f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS search_vector tsvector "
+                    f"GENERATED ALWAYS AS ({expression}) STORED"
+                ))
+                conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{table}_search ON {table} USING gin (search_vector)"))
+        return True
+    exists = conn.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": FTS_TABLE}
+    ).first()
+    if not exists:
+        try:
+            conn.execute(text(
+                f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+                "name, notes, set_notes, user_id UNINDEXED, tokenize = 'unicode61 remove_diacritics 2')"
+            ))
+        except Exception:
+            logger.warning("SQLite has no FTS5 support, workout search is disabled")
+            return False
+        conn.execute(text(_INDEX_WORKOUTS))
+    for name, body in TRIGGERS.items():
+        conn.execute(text(f"CREATE TRIGGER IF NOT EXISTS {name} {body}"))
+    return True
+
+
+def index_archived_workouts(db: Session, workout_ids: list[int]):
+    """Index workouts just moved to the archive tables, when the FTS5 index exists."""
+    if db.get_bind().dialect.name != "sqlite" or not workout_ids:
+        return
+    exists = db.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": FTS_TABLE}
+    ).first()
+    if exists:
+        db.execute(
+            text(f"{_INDEX_ARCHIVED} WHERE w.id IN :ids").bindparams(bindparam("ids", expanding=True)),
+            {"ids": workout_ids},
+        )
+
+
+def unindex_workouts(db: Session, workout_ids: list[int]):
+    """Drop archived workouts from the FTS5 index; unlike the hot tables, the archive has no triggers."""
+    if db.get_bind().dialect.name != "sqlite" or not workout_ids:
+        return
+    exists = db.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": FTS_TABLE}
+    ).first()
+    if exists:
+        db.execute(
+            text(f"DELETE FROM {FTS_TABLE} WHERE rowid IN :ids").bindparams(bindparam("ids", expanding=True)),
+            {"ids": workout_ids},
+        )
+
+
+def search_terms(q: str) -> list[str]:
+    """Words of a free-text query; every one must match, as a prefix."""
+    return re.findall(r"\w+", q or "")
+
+
+def encode_cursor(score: float, workout_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{score!r}:{workout_id}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[float, int] | None:
+    try:
+        score, workout_id = base64.urlsafe_b64decode(cursor.encode()).decode().split(":")
+        return float(score), int(workout_id)
+    except ValueError:
+        return None
+
+
+def _highlight(snippet: str) -> str:
+    return html.escape(snippet).replace(HIGHLIGHT_START, "<mark>").replace(HIGHLIGHT_END, "</mark>")
+
+
+_FTS5_HITS = f"""
+    SELECT rowid AS workout_id,
+           bm25({FTS_TABLE}, :name_weight, :notes_weight, :set_notes_weight) AS score,
+           snippet({FTS_TABLE}, -1, :hl_start, :hl_end, '…', :tokens) AS snippet
+    FROM {FTS_TABLE}
+    WHERE {FTS_TABLE} MATCH :query AND user_id = :user_id
+"""
+
+# Hot and archived rows alike: archive.py moves workouts between the two, ids included
+_ALL_WORKOUTS = " UNION ALL ".join(
+    f"SELECT id, user_id, name, notes, search_vector FROM {table}" for table in WORKOUT_TABLES
+)
+_ALL_SET_NOTES = " UNION ALL ".join(f"SELECT workout_id, notes FROM {table}" for table in SET_TABLES)
+
+# Workouts where any term hits their own or a set's vector, all through the GIN indexes; a
+# workout can match one term in its name and another in a set's notes, so every term is only
+# required of these few candidates' whole documents.
+_CANDIDATES = " UNION ".join(
+    [f"SELECT id FROM {table}, q WHERE user_id = :user_id AND search_vector @@ q.any_term" for table in WORKOUT_TABLES]
+    + [f"SELECT workout_id FROM {table}, q WHERE search_vector @@ q.any_term" for table in SET_TABLES]
+)
+
+# Same ranking shape on PostgreSQL: name weighted 'A', notes 'D', negated so lower is better like bm25
+_TSVECTOR_HITS = f"""
+    WITH q AS (SELECT to_tsquery('simple', :query) AS query, to_tsquery('simple', :any_term) AS any_term),
+         candidates (id) AS ({_CANDIDATES})
+    SELECT doc.id AS workout_id,
+           -ts_rank(CAST(:rank_weights AS real[]), doc.vector, q.query) AS score,
+           ts_headline('simple', doc.body, q.query, :headline_options) AS snippet
+    FROM (
+        SELECT w.id,
+               w.search_vector || setweight(to_tsvector('simple', coalesce(sn.notes, '')), 'D') AS vector,
+               concat_ws(' … ', w.name, w.notes, sn.notes) AS body
+        FROM ({_ALL_WORKOUTS}) AS w
+        LEFT JOIN (
+            SELECT workout_id, string_agg(notes, ' | ') AS notes
+            FROM ({_ALL_SET_NOTES}) AS s
+            WHERE notes IS NOT NULL AND notes != '' AND workout_id IN (SELECT id FROM candidates)
+            GROUP BY workout_id
+        ) AS sn ON sn.workout_id = w.id
+        WHERE w.user_id = :user_id AND w.id IN (SELECT id FROM candidates)
+    ) AS doc, q
+    WHERE doc.vector @@ q.query
+"""
+
+
+def search_workouts(
+    db: Session,
+    user_id: int,
+    terms: list[str],
+    after: tuple[float, int] | None,
+    limit: int,
+) -> list[dict]:
+    """Best matches first, resuming strictly after the `after` (score, workout_id) key."""
+    params = {"user_id": user_id, "limit": limit}
+    if db.get_bind().dialect.name == "sqlite":
+        hits = _FTS5_HITS
+        params |= {
+            "query": " ".join(f'"{term}"*' for term in terms),
+            "name_weight": NAME_WEIGHT,
+            "notes_weight": NOTES_WEIGHT,
+            "set_notes_weight": SET_NOTES_WEIGHT,
+            "hl_start": HIGHLIGHT_START,
+            "hl_end": HIGHLIGHT_END,
+            "tokens": SNIPPET_TOKENS,
+        }
+    else:
+        hits = _TSVECTOR_HITS
+        params |= {
+            "query": " & ".join(f"{term.lower()}:*" for term in terms),
+            "any_term": " | ".join(f"{term.lower()}:*" for term in terms),
+            "rank_weights": f"{{{NOTES_WEIGHT / NAME_WEIGHT}, 0, 0, 1.0}}",
+            "headline_options": (
+                f"StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_END}, "
+                f"MaxWords={SNIPPET_TOKENS}, MinWords={SNIPPET_TOKENS // 2}"
+            ),
+        }
+    resume = ""
+    if after is not None:
+        resume = (
+            "AND (hit.score > :after_score OR (hit.score = :after_score AND hit.workout_id > :after_id))"
+        )
+        params |= {"after_score": after[0], "after_id": after[1]}
+    rows = db.execute(
+        text(f"""
+            SELECT hit.workout_id, hit.score, hit.snippet,
+                   coalesce(w.type, a.type), coalesce(w.name, a.name), coalesce(w.started_at, a.started_at)
+            FROM ({hits}) AS hit
+            LEFT JOIN workouts w ON w.id = hit.workout_id
+            LEFT JOIN workouts_archive a ON a.id = hit.workout_id
+            WHERE coalesce(w.id, a.id) IS NOT NULL {resume}
+            ORDER BY hit.score, hit.workout_id
+            LIMIT :limit
+        """),
+        params,
+    ).all()
+    return [
+        {
+            "workout_id": workout_id,
+            "score": score,
+            "snippet": _highlight(snippet),
+            "type": workout_type,
+            "name": name,
+            "started_at": started_at,
+        }
+        for workout_id, score, snippet, workout_type, name, started_at in rows
+    ]
@@ -0,0 +1,157 @@
+import hashlib
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import BinaryIO
+
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+
+from models import Exercise
+
+logger = logging.getLogger("fitcouple.photos")
+
+BASE_DIR = Path(__file__).resolve().parent
+PHOTO_DIR = BASE_DIR / "data" / "exercise_photos"
+TMP_DIR = PHOTO_DIR / ".tmp"
+TMP_DIR.mkdir(parents=True, exist_ok=True)
+VARIANT_DIR = PHOTO_DIR / "variants"
+
+VARIANT_SIZES = (64, 256, 1024)
+VARIANT_FORMAT = "WEBP"
+VARIANT_EXT = ".webp"
+VARIANT_QUALITY = 82
+
+MAX_PHOTO_BYTES = 5 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+GC_GRACE_SECONDS = 60 * 60  # never collect files younger than this (in-flight uploads)
+
+
+def photo_path(photo_filename: str) -> Path:
+    return PHOTO_DIR / photo_filename
+
+
+def content_address(digest: str, ext: str) -> str:
+    """Relative, sharded path for a sha256 digest: ab/cd/abcd...ext"""
+    return f"{digest[:2]}/{digest[2:4]}/{digest}{ext}"
+
+
+def store_upload(source: BinaryIO, ext: str) -> str:
+    """Copy `source` into the store chunk by chunk and return its content-addressed filename.
+
+    The size limit is enforced while reading, and the file only becomes visible
+    through an atomic rename, so readers never see a partial photo. Identical
+    images share one file.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_name = tempfile.mkstemp(dir=TMP_DIR)
+    try:
+        with os.fdopen(fd, "wb") as tmp:
+            while chunk := source.read(CHUNK_SIZE):
+                size += len(chunk)
+                if size > MAX_PHOTO_BYTES:
+                    raise HTTPException(status_code=422, detail="File too large (max 5MB)")
+                digest.update(chunk)
+                tmp.write(chunk)
+        if size == 0:
+            raise HTTPException(status_code=422, detail="Empty file")
+
+        filename = content_address(digest.hexdigest(), ext)
+        target = photo_path(filename)
+        if target.exists():
+            os.utime(target)  # keep a shared file out of the GC grace window until we reference it
+            return filename
+        target.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(tmp_name, target)
+        return filename
+    finally:
+        if os.path.exists(tmp_name):
+            os.unlink(tmp_name)
+
+
+# ─── Resized variants ─────────────────────────────────────────────────────────
+
+def variant_filename(photo_filename: str, size: int) -> str:
+    return f"variants/{photo_filename}.{size}{VARIANT_EXT}"
+
+
+def pick_variant_size(requested: int) -> int:
+    """Smallest pre-generated size that still covers `requested` pixels."""
+    return next((size for size in VARIANT_SIZES if size >= requested), VARIANT_SIZES[-1])
+
+
+def _variant_original(relative: str) -> str | None:
+    # "variants/ab/cd/<sha>.png.256.webp" -> "ab/cd/<sha>.png"
+    if not relative.startswith("variants/") or not relative.endswith(VARIANT_EXT):
+        return None
+    original, _dot, size = relative.removeprefix("variants/").removesuffix(VARIANT_EXT).rpartition(".")
+    return original if size.isdigit() else None
+
+
+def generate_variants(photo_filename: str):
+    """Write the missing resized variants of a stored photo. Meant to run off the request path."""
+    missing = [size for size in VARIANT_SIZES if not photo_path(variant_filename(photo_filename, size)).exists()]
+    source = photo_path(photo_filename)
+    if not missing or not source.exists():
+        return
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        logger.warning("Pillow is not installed, photo variants are disabled")
+        return
+
+    with Image.open(source) as original:
+        original = ImageOps.exif_transpose(original)
+        if original.mode not in ("RGB", "RGBA"):
+            original = original.convert("RGBA" if "transparency" in original.info else "RGB")
+        for size in missing:
+            resized = original.copy()
+            resized.thumbnail((size, size), Image.Resampling.LANCZOS)
+            target = photo_path(variant_filename(photo_filename, size))
+            target.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_name = tempfile.mkstemp(dir=TMP_DIR)
+            try:
+                with os.fdopen(fd, "wb") as tmp:
+                    resized.save(tmp, VARIANT_FORMAT, quality=VARIANT_QUALITY)
+                os.replace(tmp_name, target)
+            finally:
+                if os.path.exists(tmp_name):
+                    os.unlink(tmp_name)
+
+
+def generate_missing_variants(db: Session) -> int:
+    """Backfill variants for every referenced photo (legacy uploads, failed jobs)."""
+    count = 0
+    for (filename,) in db.query(Exercise.photo_filename).filter(Exercise.photo_filename.isnot(None)).distinct():
+        try:
+            generate_variants(filename)
+            count += 1
+        except Exception:
+            logger.exception("could not build variants for %s", filename)
+    return count
+
+
+def referenced_photos(db: Session) -> set[str]:
+    return {
+        filename for (filename,) in db.query(Exercise.photo_filename)
+        .filter(Exercise.photo_filename.isnot(None))
+        .all()
+    }
+
+
+def collect_garbage(referenced: set[str]) -> int:
+    """Delete stored photos none of `referenced` (every household's exercises) point to. Returns the number removed."""
+    cutoff = time.time() - GC_GRACE_SECONDS
+    removed = 0
+    for path in PHOTO_DIR.rglob("*"):
+        if not path.is_file() or path.stat().st_mtime > cutoff:
+            continue
+        relative = path.relative_to(PHOTO_DIR).as_posix()
+        if TMP_DIR not in path.parents and (relative in referenced or _variant_original(relative) in referenced):
+            continue
+        path.unlink(missing_ok=True)
+        removed += 1
+    return removed
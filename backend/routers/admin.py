@@ -0,0 +1,70 @@
+import hmac
+import os
+from datetime import datetime
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+
+from backup import BackupError, create_backup
+from database import IS_SQLITE, households
+from scheduler import scheduler
+from schemas import BackupOut, HouseholdCreate, HouseholdOut, JobStatusOut, SchedulerStatusOut
+from seed import create_household
+
+# Unset: the admin API is off. nginx refuses /api/admin/; on the backend port callers send this token.
+ADMIN_TOKEN = os.getenv("FITCOUPLE_ADMIN_TOKEN", "")
+ADMIN_TOKEN_HEADER = "X-Admin-Token"
+
+
+def require_admin(request: Request):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin API disabled, set FITCOUPLE_ADMIN_TOKEN")
+    if not hmac.compare_digest(request.headers.get(ADMIN_TOKEN_HEADER, "").encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail=f"Missing or invalid {ADMIN_TOKEN_HEADER} header")
+
+
+router = APIRouter(prefix="/admin", tags=["admin"], dependencies=[Depends(require_admin)])
+
+
+@router.get("/jobs", response_model=SchedulerStatusOut)
+def get_jobs():
+    now = datetime.utcnow()
+    return SchedulerStatusOut(
+        owner=scheduler.owner,
+        is_leader=scheduler.is_leader,
+        jobs=[
+            JobStatusOut(
+                name=job.name,
+                running=job.running,
+                run_count=job.run_count,
+                last_started_at=job.last_started_at,
+                last_finished_at=job.last_finished_at,
+                last_error=job.last_error,
+                next_run_at=job.next_run_at(now),
+            )
+            for job in scheduler.jobs.values()
+        ],
+    )
+
+
+@router.post("/backup", response_model=BackupOut)
+def post_backup():
+    """Back up every household now; 409 at once if a backup is already running, in any process."""
+    if not IS_SQLITE:
+        raise HTTPException(status_code=501, detail="Backups are only supported on SQLite")
+    try:
+        manifest = create_backup()
+    except BackupError as exc:
+        raise HTTPException(status_code=409, detail=str(exc))
+    return BackupOut(**manifest, photo_count=len(manifest["photos"]))
+
+
+@router.post("/households", response_model=HouseholdOut, status_code=201)
+def post_household(payload: HouseholdCreate):
+    """Provision a household database; requests name it in X-Household, with the returned token, from then on."""
+    if households.exists(payload.name):
+        raise HTTPException(status_code=409, detail="Household already exists")
+    try:
+        users, token = create_household(payload.name, [member.model_dump() for member in payload.users])
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=str(exc))
+    return HouseholdOut(name=payload.name, users=users, token=token)
@@ -1,15 +1,22 @@
 from datetime import datetime
 
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy import func
+from fastapi import APIRouter, Depends, File, HTTPException, UploadFile
+from sqlalchemy import func, insert
 from sqlalchemy.orm import Session
 
-from database import get_db
+from bulk_import import DATE_KEYS, chunked, existing_days, first_value, iter_records, parse_datetime, parse_float
+from cache import bump_data_version
+from change_log import log_changes
+from database import get_db, upsert
 from models import BodyMeasurement, User
-from schemas import BodyMeasurementCreate, BodyMeasurementOut
+from schemas import BodyMeasurementCreate, BodyMeasurementOut, ImportResultOut
+from write_queue import WRITE_QUEUE
 
 router = APIRouter(prefix="/body-measurements", tags=["body-measurements"])
 
+MEASUREMENT_COLUMNS = ["chest_cm", "waist_cm", "hips_cm", "arm_cm", "thigh_cm", "calf_cm"]
+CONFLICT_MODES = {"reject", "replace", "merge"}
+
 
 @router.get("", response_model=list[BodyMeasurementOut])
 def get_body_measurements(user_id: int, limit: int = 120, db: Session = Depends(get_db)):
@@ -23,45 +30,103 @@ def get_body_measurements(user_id: int, limit: int = 120, db: Session = Depends(
 
 
 @router.post("", response_model=BodyMeasurementOut, status_code=201)
-def log_body_measurement(payload: BodyMeasurementCreate, db: Session = Depends(get_db)):
+def log_body_measurement(payload: BodyMeasurementCreate, on_conflict: str = "reject"):
+    """Log a day's measurements; `on_conflict` picks reject | replace | merge when the day already exists."""
+    if on_conflict not in CONFLICT_MODES:
+        raise HTTPException(status_code=422, detail="on_conflict must be reject, replace or merge")
+    return WRITE_QUEUE.run(lambda db: BodyMeasurementOut.model_validate(upsert_body_measurement(db, payload, on_conflict)))
+
+
+def upsert_body_measurement(db: Session, payload: BodyMeasurementCreate, on_conflict: str) -> BodyMeasurement:
     user = db.query(User).filter(User.id == payload.user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
     logged_at = payload.logged_at or datetime.utcnow()
-    day_str = logged_at.date().isoformat()
-    existing = (
-        db.query(BodyMeasurement)
-        .filter(
-            BodyMeasurement.user_id == payload.user_id,
-            func.date(BodyMeasurement.logged_at) == day_str,
-        )
-        .first()
-    )
-    if existing:
-        raise HTTPException(status_code=409, detail="Measurement already logged for this date")
-
-    entry = BodyMeasurement(
+    values = {column: getattr(payload, column) for column in MEASUREMENT_COLUMNS}
+    stmt = upsert(db, BodyMeasurement).values(
         user_id=payload.user_id,
-        chest_cm=payload.chest_cm,
-        waist_cm=payload.waist_cm,
-        hips_cm=payload.hips_cm,
-        arm_cm=payload.arm_cm,
-        thigh_cm=payload.thigh_cm,
-        calf_cm=payload.calf_cm,
         logged_at=logged_at,
+        logged_day=logged_at.date(),
+        **values,
     )
-    db.add(entry)
-    db.commit()
-    db.refresh(entry)
-    return entry
+    conflict_target = [BodyMeasurement.user_id, BodyMeasurement.logged_day]
+    if on_conflict == "reject":
+        stmt = stmt.on_conflict_do_nothing(index_elements=conflict_target)
+    elif on_conflict == "replace":
+        stmt = stmt.on_conflict_do_update(
+            index_elements=conflict_target,
+            set_={"logged_at": stmt.excluded.logged_at, **{c: stmt.excluded[c] for c in MEASUREMENT_COLUMNS}},
+        )
+    else:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=conflict_target,
+            set_={c: func.coalesce(stmt.excluded[c], getattr(BodyMeasurement, c)) for c in MEASUREMENT_COLUMNS},
+        )
 
+    entry_id = db.execute(stmt.returning(BodyMeasurement.id)).scalar()
+    if entry_id is None:
+        raise HTTPException(status_code=409, detail="Measurement already logged for this date")
+    bump_data_version(db, [payload.user_id])
+    log_changes(db, BodyMeasurement.__tablename__, [entry_id])
+    return db.query(BodyMeasurement).filter(BodyMeasurement.id == entry_id).first()
 
-@router.delete("/{entry_id}", status_code=200)
-def delete_body_measurement(entry_id: int, db: Session = Depends(get_db)):
+
+@router.post("/import", response_model=ImportResultOut)
+def import_body_measurements(user_id: int, file: UploadFile = File(...), db: Session = Depends(get_db)):
+    """Bulk import a CSV/NDJSON export; one measurement per day, existing days are skipped.
+
+    Each chunk commits as its own write unit, so a failed import can simply be uploaded again.
+    """
+    user = db.query(User).filter(User.id == user_id).first()
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    inserted = skipped = invalid = 0
+    for chunk in chunked(iter_records(file)):
+        rows = []
+        for record in chunk:
+            logged_at = parse_datetime(first_value(record, DATE_KEYS))
+            cells = {column: first_value(record, (column, column.removesuffix("_cm"))) for column in MEASUREMENT_COLUMNS}
+            values = {column: parse_float(cell) for column, cell in cells.items()}
+            unreadable = any(cells[column] not in (None, "") and value is None for column, value in values.items())
+            if logged_at is None or unreadable or all(v is None for v in values.values()):
+                invalid += 1
+                continue
+            rows.append({"user_id": user_id, "logged_at": logged_at, "logged_day": logged_at.date(), **values})
+        if rows:
+            new_rows = WRITE_QUEUE.run(lambda db: _insert_new_days(db, user_id, rows))
+            inserted += len(new_rows)
+            skipped += len(rows) - len(new_rows)
+
+    return ImportResultOut(inserted=inserted, skipped=skipped, invalid=invalid)
+
+
+def _insert_new_days(db: Session, user_id: int, rows: list[dict]) -> list[dict]:
+    """Insert the rows for days not logged yet, the first of a day repeated within `rows` only."""
+    known_days = existing_days(db, BodyMeasurement, user_id, rows)
+    new_rows = []
+    for row in rows:
+        day = row["logged_at"].date()
+        if day not in known_days:
+            known_days.add(day)
+            new_rows.append(row)
+    if new_rows:
+        new_ids = db.execute(insert(BodyMeasurement).returning(BodyMeasurement.id), new_rows).scalars().all()
+        log_changes(db, BodyMeasurement.__tablename__, new_ids)
+        bump_data_version(db, [user_id])
+    return new_rows
+
+
+def remove_body_measurement(db: Session, entry_id: int):
     entry = db.query(BodyMeasurement).filter(BodyMeasurement.id == entry_id).first()
     if not entry:
         raise HTTPException(status_code=404, detail="Entry not found")
     db.delete(entry)
-    db.commit()
+    db.flush()
+
+
+@router.delete("/{entry_id}", status_code=200)
+def delete_body_measurement(entry_id: int):
+    WRITE_QUEUE.run(lambda db: remove_body_measurement(db, entry_id))
     return {"ok": True}
@@ -1,13 +1,163 @@
-from datetime import datetime
-from fastapi import APIRouter, Depends, HTTPException
+from datetime import date, datetime, timedelta
+from fastapi import APIRouter, Depends, File, HTTPException, Query, UploadFile
+from sqlalchemy import func, insert
 from sqlalchemy.orm import Session
 
-from database import get_db
-from models import BodyWeight, User
-from schemas import BodyWeightOut, BodyWeightCreate
+from bulk_import import DATE_KEYS, chunked, existing_days, first_value, iter_records, parse_datetime, parse_float
+from cache import bump_data_version
+from change_log import log_changes
+from database import SessionLocal, bucket_range, get_db
+from models import BodyWeight, BodyWeightRollup, User
+from schemas import (
+    BodyWeightOut, BodyWeightCreate, BodyWeightRollupOut, BodyWeightTrendOut, ImportResultOut,
+)
+from write_queue import WRITE_QUEUE
 
 router = APIRouter(prefix="/body-weight", tags=["body-weight"])
 
+TREND_ALPHA = 0.1  # EWMA smoothing factor, ~10 entries of memory
+RATE_WINDOW_DAYS = 28
+
+
+# ─── Trend engine ─────────────────────────────────────────────────────────────
+
+def recompute_trend_from(db: Session, user_id: int, since: datetime):
+    """Recompute trend_kg for every entry at or after `since` (the suffix only)."""
+    previous = (
+        db.query(BodyWeight.trend_kg)
+        .filter(BodyWeight.user_id == user_id, BodyWeight.logged_at < since)
+        .order_by(BodyWeight.logged_at.desc(), BodyWeight.id.desc())
+        .first()
+    )
+    trend = previous[0] if previous else None
+    suffix = (
+        db.query(BodyWeight)
+        .filter(BodyWeight.user_id == user_id, BodyWeight.logged_at >= since)
+        .order_by(BodyWeight.logged_at.asc(), BodyWeight.id.asc())
+        .all()
+    )
+    for entry in suffix:
+        trend = entry.weight_kg if trend is None else trend + TREND_ALPHA * (entry.weight_kg - trend)
+        entry.trend_kg = round(trend, 3)
+
+
+def refresh_rollups(db: Session, user_id: int, logged_at: datetime):
+    """Re-aggregate the week and month buckets containing `logged_at`."""
+    for bucket in ("week", "month"):
+        start, end = bucket_range(bucket, logged_at.date())
+        count, total, min_kg, max_kg = (
+            db.query(
+                func.count(BodyWeight.id),
+                func.sum(BodyWeight.weight_kg),
+                func.min(BodyWeight.weight_kg),
+                func.max(BodyWeight.weight_kg),
+            )
+            .filter(
+                BodyWeight.user_id == user_id,
+                BodyWeight.logged_at >= datetime.combine(start, datetime.min.time()),
+                BodyWeight.logged_at < datetime.combine(end, datetime.min.time()),
+            )
+            .one()
+        )
+        rollup = (
+            db.query(BodyWeightRollup)
+            .filter(
+                BodyWeightRollup.user_id == user_id,
+                BodyWeightRollup.bucket == bucket,
+                BodyWeightRollup.period_start == start,
+            )
+            .first()
+        )
+        if not count:
+            if rollup:
+                db.delete(rollup)
+            continue
+        if not rollup:
+            rollup = BodyWeightRollup(user_id=user_id, bucket=bucket, period_start=start)
+            db.add(rollup)
+        rollup.count = count
+        rollup.total_kg = total
+        rollup.min_kg = min_kg
+        rollup.max_kg = max_kg
+        db.flush()
+
+
+def refresh_rollups_for(db: Session, user_id: int, logged_ats):
+    seen_buckets = set()
+    for logged_at in logged_ats:
+        week_start = bucket_range("week", logged_at.date())[0]
+        month_start = bucket_range("month", logged_at.date())[0]
+        if (week_start, month_start) in seen_buckets:
+            continue
+        seen_buckets.add((week_start, month_start))
+        refresh_rollups(db, user_id, logged_at)
+
+
+def rebuild_user_trend(db: Session, user_id: int):
+    recompute_trend_from(db, user_id, datetime.min)
+    db.query(BodyWeightRollup).filter(BodyWeightRollup.user_id == user_id).delete()
+    db.flush()
+    logged_ats = db.query(BodyWeight.logged_at).filter(BodyWeight.user_id == user_id).all()
+    refresh_rollups_for(db, user_id, [logged_at for (logged_at,) in logged_ats])
+
+
+def backfill_weight_trends():
+    """Populate trend_kg and rollups for users whose history predates the trend engine."""
+    db = SessionLocal()
+    try:
+        user_ids = [
+            user_id for (user_id,) in db.query(BodyWeight.user_id)
+            .filter(BodyWeight.trend_kg.is_(None))
+            .distinct()
+            .all()
+        ]
+        for user_id in user_ids:
+            rebuild_user_trend(db, user_id)
+        if user_ids:
+            db.commit()
+    finally:
+        db.close()
+
+
+def _rollup_to_out(rollup: BodyWeightRollup) -> BodyWeightRollupOut:
+    return BodyWeightRollupOut(
+        period_start=rollup.period_start,
+        count=rollup.count,
+        avg_kg=round(rollup.total_kg / rollup.count, 2),
+        min_kg=rollup.min_kg,
+        max_kg=rollup.max_kg,
+    )
+
+
+def weight_trend_rate(db: Session, user_id: int) -> tuple[float | None, float | None]:
+    """Return (current trend, kg/week over the last RATE_WINDOW_DAYS)."""
+    latest = (
+        db.query(BodyWeight)
+        .filter(BodyWeight.user_id == user_id)
+        .order_by(BodyWeight.logged_at.desc(), BodyWeight.id.desc())
+        .first()
+    )
+    if not latest or latest.trend_kg is None:
+        return None, None
+    cutoff = latest.logged_at - timedelta(days=RATE_WINDOW_DAYS)
+    baseline = (
+        db.query(BodyWeight)
+        .filter(BodyWeight.user_id == user_id, BodyWeight.logged_at <= cutoff)
+        .order_by(BodyWeight.logged_at.desc(), BodyWeight.id.desc())
+        .first()
+    ) or (
+        db.query(BodyWeight)
+        .filter(BodyWeight.user_id == user_id)
+        .order_by(BodyWeight.logged_at.asc(), BodyWeight.id.asc())
+        .first()
+    )
+    elapsed_days = (latest.logged_at - baseline.logged_at).total_seconds() / 86400
+    if elapsed_days < 1:
+        return latest.trend_kg, None
+    return latest.trend_kg, round((latest.trend_kg - baseline.trend_kg) / (elapsed_days / 7), 3)
+
+
+# ─── Routes ───────────────────────────────────────────────────────────────────
 
 @router.get("", response_model=list[BodyWeightOut])
 def get_body_weights(user_id: int, limit: int = 90, db: Session = Depends(get_db)):
@@ -21,8 +171,52 @@ def get_body_weights(user_id: int, limit: int = 90, db: Session = Depends(get_db
     return entries
 
 
-@router.post("", response_model=BodyWeightOut, status_code=201)
-def log_body_weight(payload: BodyWeightCreate, db: Session = Depends(get_db)):
+@router.get("/trend", response_model=BodyWeightTrendOut)
+def get_body_weight_trend(
+    user_id: int,
+    from_: date | None = Query(None, alias="from"),
+    to: date | None = None,
+    db: Session = Depends(get_db),
+):
+    user = db.query(User).filter(User.id == user_id).first()
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    points = db.query(BodyWeight).filter(BodyWeight.user_id == user_id)
+    rollups = db.query(BodyWeightRollup).filter(BodyWeightRollup.user_id == user_id)
+    first_week = bucket_range("week", from_)[0] if from_ else date.min
+    first_month = bucket_range("month", from_)[0] if from_ else date.min
+    if from_:
+        points = points.filter(BodyWeight.logged_at >= datetime.combine(from_, datetime.min.time()))
+        # The week holding from_ may start in the previous month
+        rollups = rollups.filter(BodyWeightRollup.period_start >= min(first_week, first_month))
+    if to:
+        points = points.filter(BodyWeight.logged_at < datetime.combine(to + timedelta(days=1), datetime.min.time()))
+        rollups = rollups.filter(BodyWeightRollup.period_start <= to)
+    rollups = rollups.order_by(BodyWeightRollup.period_start.asc()).all()
+
+    current, rate = weight_trend_rate(db, user_id)
+    remaining = None
+    weeks_to_target = None
+    if current is not None and user.target_weight_kg is not None:
+        remaining = round(user.target_weight_kg - current, 2)
+        if rate and remaining and (remaining > 0) == (rate > 0):
+            weeks_to_target = round(remaining / rate, 1)
+
+    return BodyWeightTrendOut(
+        user_id=user_id,
+        target_weight_kg=user.target_weight_kg,
+        current_trend_kg=current,
+        weekly_rate_kg=rate,
+        remaining_kg=remaining,
+        weeks_to_target=weeks_to_target,
+        points=points.order_by(BodyWeight.logged_at.asc(), BodyWeight.id.asc()).all(),
+        weekly=[_rollup_to_out(r) for r in rollups if r.bucket == "week" and r.period_start >= first_week],
+        monthly=[_rollup_to_out(r) for r in rollups if r.bucket == "month" and r.period_start >= first_month],
+    )
+
+
+def insert_body_weight(db: Session, payload: BodyWeightCreate) -> BodyWeight:
     user = db.query(User).filter(User.id == payload.user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
@@ -32,16 +226,83 @@ def log_body_weight(payload: BodyWeightCreate, db: Session = Depends(get_db)):
         logged_at=payload.logged_at or datetime.utcnow(),
     )
     db.add(entry)
-    db.commit()
-    db.refresh(entry)
+    db.flush()
+    recompute_trend_from(db, entry.user_id, entry.logged_at)
+    refresh_rollups(db, entry.user_id, entry.logged_at)
     return entry
 
 
-@router.delete("/{entry_id}", status_code=200)
-def delete_body_weight(entry_id: int, db: Session = Depends(get_db)):
+@router.post("", response_model=BodyWeightOut, status_code=201)
+def log_body_weight(payload: BodyWeightCreate):
+    return WRITE_QUEUE.run(lambda db: BodyWeightOut.model_validate(insert_body_weight(db, payload)))
+
+
+@router.post("/import", response_model=ImportResultOut)
+def import_body_weights(user_id: int, file: UploadFile = File(...), db: Session = Depends(get_db)):
+    """Bulk import a smart-scale CSV/NDJSON export; days already logged are skipped.
+
+    Each chunk commits as its own write unit, so a failed import can simply be uploaded again;
+    the trend and rollups are recomputed once at the end.
+    """
+    user = db.query(User).filter(User.id == user_id).first()
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    inserted = skipped = invalid = 0
+    imported_at: list[datetime] = []
+    for chunk in chunked(iter_records(file)):
+        rows = []
+        for record in chunk:
+            logged_at = parse_datetime(first_value(record, DATE_KEYS))
+            weight_kg = parse_float(first_value(record, ("weight_kg", "weight", "body_weight")))
+            if logged_at is None or weight_kg is None or weight_kg <= 0:
+                invalid += 1
+                continue
+            rows.append({"user_id": user_id, "weight_kg": weight_kg, "logged_at": logged_at})
+        if rows:
+            new_rows = WRITE_QUEUE.run(lambda db: _insert_new_days(db, user_id, rows))
+            inserted += len(new_rows)
+            skipped += len(rows) - len(new_rows)
+            imported_at.extend(row["logged_at"] for row in new_rows)
+
+    if imported_at:
+        WRITE_QUEUE.run(lambda db: _refresh_after_import(db, user_id, imported_at))
+    return ImportResultOut(inserted=inserted, skipped=skipped, invalid=invalid)
+
+
+def _insert_new_days(db: Session, user_id: int, rows: list[dict]) -> list[dict]:
+    """Insert the rows for days not logged yet, the first of a day repeated within `rows` only."""
+    known_days = existing_days(db, BodyWeight, user_id, rows)
+    new_rows = []
+    for row in rows:
+        day = row["logged_at"].date()
+        if day not in known_days:
+            known_days.add(day)
+            new_rows.append(row)
+    if new_rows:
+        new_ids = db.execute(insert(BodyWeight).returning(BodyWeight.id), new_rows).scalars().all()
+        log_changes(db, BodyWeight.__tablename__, new_ids)
+    return new_rows
+
+
+def _refresh_after_import(db: Session, user_id: int, imported_at: list[datetime]):
+    recompute_trend_from(db, user_id, min(imported_at))
+    refresh_rollups_for(db, user_id, imported_at)
+    bump_data_version(db, [user_id])
+
+
+def remove_body_weight(db: Session, entry_id: int):
     entry = db.query(BodyWeight).filter(BodyWeight.id == entry_id).first()
     if not entry:
         raise HTTPException(status_code=404, detail="Entry not found")
+    user_id, logged_at = entry.user_id, entry.logged_at
     db.delete(entry)
-    db.commit()
+    db.flush()
+    recompute_trend_from(db, user_id, logged_at)
+    refresh_rollups(db, user_id, logged_at)
+
+
+@router.delete("/{entry_id}", status_code=200)
+def delete_body_weight(entry_id: int):
+    WRITE_QUEUE.run(lambda db: remove_body_weight(db, entry_id))
     return {"ok": True}
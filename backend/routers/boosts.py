@@ -5,6 +5,7 @@ from sqlalchemy.orm import Session
 from database import get_db
 from models import Boost, User
 from schemas import BoostOut, BoostCreate
+from write_queue import WRITE_QUEUE
 
 router = APIRouter(prefix="/boosts", tags=["boosts"])
 
@@ -35,8 +36,7 @@ def get_boosts(user_id: int, db: Session = Depends(get_db)):
     return [_boost_to_out(b) for b in boosts]
 
 
-@router.post("", response_model=BoostOut, status_code=201)
-def send_boost(payload: BoostCreate, db: Session = Depends(get_db)):
+def insert_boost(db: Session, payload: BoostCreate) -> Boost:
     sender = db.query(User).filter(User.id == payload.from_user_id).first()
     if not sender:
         raise HTTPException(status_code=404, detail="Sender not found")
@@ -49,17 +49,23 @@ def send_boost(payload: BoostCreate, db: Session = Depends(get_db)):
         message=payload.message,
     )
     db.add(boost)
-    db.commit()
-    db.refresh(boost)
-    return _boost_to_out(boost)
+    db.flush()
+    return boost
+
+
+@router.post("", response_model=BoostOut, status_code=201)
+def send_boost(payload: BoostCreate):
+    return WRITE_QUEUE.run(lambda db: _boost_to_out(insert_boost(db, payload)))
 
 
 @router.patch("/{boost_id}/read", response_model=BoostOut)
-def mark_boost_read(boost_id: int, db: Session = Depends(get_db)):
-    boost = db.query(Boost).filter(Boost.id == boost_id).first()
-    if not boost:
-        raise HTTPException(status_code=404, detail="Boost not found")
-    boost.read_at = datetime.utcnow()
-    db.commit()
-    db.refresh(boost)
-    return _boost_to_out(boost)
+def mark_boost_read(boost_id: int):
+    def write(db: Session):
+        boost = db.query(Boost).filter(Boost.id == boost_id).first()
+        if not boost:
+            raise HTTPException(status_code=404, detail="Boost not found")
+        boost.read_at = datetime.utcnow()
+        db.flush()
+        return _boost_to_out(boost)
+
+    return WRITE_QUEUE.run(write)
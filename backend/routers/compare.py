@@ -0,0 +1,180 @@
+from datetime import date, datetime, timedelta
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import and_, func, select
+from sqlalchemy.orm import Session
+
+from cache import LRUCache
+from archive import history_models
+from database import bucket_range, date_bucket, get_db
+from models import Exercise, User
+from routers.sets import SET_WRITE_BUFFER
+from routers.users import compute_streaks
+from schemas import CompareOut, ComparePR, CompareUser, CompareWeek, SharedExercisePR
+
+router = APIRouter(prefix="/compare", tags=["compare"])
+
+MAX_COMPARED_USERS = 10
+DEFAULT_COMPARE_WEEKS = 12
+
+# Keyed by the compared users' data versions, so any write by one of them misses
+COMPARE_CACHE = LRUCache(max_entries=128)
+
+
+def _parse_user_ids(raw: str) -> list[int]:
+    try:
+        user_ids = sorted({int(part) for part in raw.split(",") if part.strip()})
+    except ValueError:
+        raise HTTPException(status_code=422, detail="user_ids must be a comma-separated list of ids")
+    if not user_ids or len(user_ids) > MAX_COMPARED_USERS:
+        raise HTTPException(status_code=422, detail=f"Compare between 1 and {MAX_COMPARED_USERS} users")
+    return user_ids
+
+
+def _weekly_rows(db: Session, user_ids: list[int], start: datetime, end: datetime):
+    Workout, WorkoutSet = history_models(db, start)
+    week = date_bucket(Workout.completed_at, "week")
+    return (
+        db.query(
+            Workout.user_id,
+            week,
+            func.count(func.distinct(Workout.id)),
+            func.count(WorkoutSet.id),
+            func.sum(WorkoutSet.weight_kg * WorkoutSet.reps),
+        )
+        .outerjoin(WorkoutSet, and_(WorkoutSet.workout_id == Workout.id, WorkoutSet.status == "done"))
+        .filter(
+            Workout.user_id.in_(user_ids),
+            Workout.completed_at >= start,
+            Workout.completed_at < end,
+        )
+        .group_by(Workout.user_id, week)
+        .all()
+    )
+
+
+def _active_days(db: Session, user_ids: list[int]) -> dict[int, set[date]]:
+    Workout, _WorkoutSet = history_models(db)
+    day = date_bucket(Workout.completed_at)
+    rows = (
+        db.query(Workout.user_id, day)
+        .filter(Workout.user_id.in_(user_ids), Workout.completed_at.isnot(None))
+        .group_by(Workout.user_id, day)
+        .all()
+    )
+    days: dict[int, set[date]] = {user_id: set() for user_id in user_ids}
+    for user_id, active_day in rows:
+        days[user_id].add(date.fromisoformat(str(active_day)))
+    return days
+
+
+def _shared_prs(db: Session, user_ids: list[int], start: datetime, end: datetime) -> list[SharedExercisePR]:
+    """Best done set per user for every exercise all compared users trained in the window."""
+    Workout, WorkoutSet = history_models(db, start)
+    ranked = (
+        select(
+            Workout.user_id,
+            WorkoutSet.exercise_id,
+            WorkoutSet.weight_kg,
+            WorkoutSet.reps,
+            func.row_number().over(
+                partition_by=(Workout.user_id, WorkoutSet.exercise_id),
+                order_by=(WorkoutSet.weight_kg.desc(), WorkoutSet.reps.desc()),
+            ).label("rn"),
+        )
+        .join(Workout, WorkoutSet.workout_id == Workout.id)
+        .where(
+            Workout.user_id.in_(user_ids),
+            WorkoutSet.status == "done",
+            WorkoutSet.weight_kg.isnot(None),
+            WorkoutSet.logged_at >= start,
+            WorkoutSet.logged_at < end,
+        )
+        .subquery()
+    )
+    rows = db.execute(
+        select(ranked.c.user_id, ranked.c.exercise_id, ranked.c.weight_kg, ranked.c.reps)
+        .where(ranked.c.rn == 1)
+    ).all()
+    by_exercise: dict[int, list[ComparePR]] = {}
+    for user_id, exercise_id, weight_kg, reps in rows:
+        by_exercise.setdefault(exercise_id, []).append(ComparePR(user_id=user_id, weight_kg=weight_kg, reps=reps))
+    shared = {eid: prs for eid, prs in by_exercise.items() if len(prs) == len(user_ids)}
+    if not shared:
+        return []
+    exercises = db.query(Exercise).filter(Exercise.id.in_(shared)).order_by(Exercise.muscle_group, Exercise.name).all()
+    return [
+        SharedExercisePR(
+            exercise_id=exercise.id,
+            exercise_name=exercise.name,
+            muscle_group=exercise.muscle_group,
+            prs=sorted(shared[exercise.id], key=lambda pr: pr.user_id),
+        )
+        for exercise in exercises
+    ]
+
+
+@router.get("", response_model=CompareOut)
+def compare_users(
+    user_ids: str,
+    from_: date | None = Query(None, alias="from"),
+    to: date | None = None,
+    db: Session = Depends(get_db),
+):
+    """Side-by-side weekly activity, streaks and shared-exercise PRs, one grouped query per metric."""
+    SET_WRITE_BUFFER.flush()
+    ids = _parse_user_ids(user_ids)
+    users = db.query(User).filter(User.id.in_(ids)).order_by(User.id).all()
+    if len(users) != len(ids):
+        raise HTTPException(status_code=404, detail="User not found")
+
+    today = datetime.utcnow().date()
+    to = to or today
+    from_ = from_ or to - timedelta(weeks=DEFAULT_COMPARE_WEEKS - 1)
+    if from_ > to:
+        raise HTTPException(status_code=422, detail="from must be before to")
+
+    cache_key = (tuple(ids), from_, to, today, tuple(user.data_version for user in users))
+    cached = COMPARE_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
+
+    start = datetime.combine(from_, datetime.min.time())
+    end = datetime.combine(to + timedelta(days=1), datetime.min.time())
+    weeks = [bucket_range("week", from_)[0]]
+    while (next_week := weeks[-1] + timedelta(days=7)) <= to:
+        weeks.append(next_week)
+
+    weekly: dict[tuple[int, date], CompareWeek] = {}
+    for user_id, week_start, workouts, set_count, volume in _weekly_rows(db, ids, start, end):
+        week_start = date.fromisoformat(str(week_start))
+        weekly[(user_id, week_start)] = CompareWeek(
+            week_start=week_start, workouts=workouts, sets=set_count, volume_kg=round(volume or 0, 1),
+        )
+    active_days = _active_days(db, ids)
+
+    compared = []
+    for user in users:
+        user_weeks = [
+            weekly.get((user.id, week), CompareWeek(week_start=week, workouts=0, sets=0, volume_kg=0))
+            for week in weeks
+        ]
+        current_streak, longest_streak = compute_streaks(active_days[user.id], today)
+        compared.append(CompareUser(
+            user_id=user.id,
+            name=user.name,
+            theme_key=user.theme_key,
+            total_workouts=sum(week.workouts for week in user_weeks),
+            total_volume_kg=round(sum(week.volume_kg for week in user_weeks), 1),
+            current_streak=current_streak,
+            longest_streak=longest_streak,
+            weeks=user_weeks,
+        ))
+
+    result = CompareOut(
+        from_date=from_,
+        to_date=to,
+        users=compared,
+        shared_prs=_shared_prs(db, ids, start, end),
+    )
+    COMPARE_CACHE.set(cache_key, result)
+    return result
@@ -1,28 +1,36 @@
 from fastapi import APIRouter, Depends
 from sqlalchemy.orm import Session
 
+from archive import newest_workouts
 from database import get_db
-from models import User, Workout, Boost
+from models import User, Boost
 from schemas import DashboardOut, DashboardUser
 from routers.users import compute_stats
 from routers.workouts import _workout_to_out
 from routers.boosts import _boost_to_out
+from routers.sets import SET_WRITE_BUFFER
 
 router = APIRouter(prefix="/dashboard", tags=["dashboard"])
 
 
 @router.get("", response_model=DashboardOut)
 def get_dashboard(db: Session = Depends(get_db)):
+    SET_WRITE_BUFFER.flush()
     users = db.query(User).all()
     dashboard_users = []
     for user in users:
         stats = compute_stats(user.id, db)
-        recent_workouts = (
-            db.query(Workout)
-            .filter(Workout.user_id == user.id, Workout.completed_at.isnot(None))
-            .order_by(Workout.completed_at.desc())
-            .limit(3)
-            .all()
+        recent_workouts = newest_workouts(
+            db,
+            lambda Workout: (
+                db.query(Workout)
+                .filter(Workout.user_id == user.id, Workout.completed_at.isnot(None))
+                .order_by(Workout.completed_at.desc())
+                .limit(3)
+                .all()
+            ),
+            3,
+            "completed_at",
         )
         dashboard_users.append(DashboardUser(
             id=user.id,
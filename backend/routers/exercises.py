@@ -1,22 +1,34 @@
+import os
+from datetime import datetime
 from pathlib import Path
-from uuid import uuid4
 
-from fastapi import APIRouter, Depends, File, HTTPException, UploadFile
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request, Response, UploadFile
 from fastapi.responses import FileResponse
+from starlette.formparsers import MultiPartException, MultiPartParser
 from sqlalchemy import func
 from sqlalchemy.orm import Session
 
-from database import get_db
-from models import Exercise, User, Workout, WorkoutSet
-from schemas import ExerciseCreate, ExerciseOut
+from archive import history_models
+from bulk_delete import remove_exercise
+from database import SessionLocal, get_db, greatest, upsert
+from exercise_index import exercise_index_for
+from models import Exercise, User, UserExerciseUsage, Workout, WorkoutSet
+from photo_store import (
+    MAX_PHOTO_BYTES, PHOTO_DIR, TMP_DIR,
+    generate_variants, photo_path, pick_variant_size, store_upload, variant_filename,
+)
+from schemas import ExerciseCreate, ExerciseOut, ExerciseSearchResult
+from write_queue import WRITE_QUEUE
 
 router = APIRouter(prefix="/exercises", tags=["exercises"])
 
-BASE_DIR = Path(__file__).resolve().parents[1]
-PHOTO_DIR = BASE_DIR / "data" / "exercise_photos"
-PHOTO_DIR.mkdir(parents=True, exist_ok=True)
-
-MAX_PHOTO_BYTES = 5 * 1024 * 1024
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "public, no-cache"
+# Served while a requested variant is still being generated; must not be cached for long
+FALLBACK_CACHE_CONTROL = "public, max-age=60"
+# When set (e.g. "/protected-photos/"), nginx serves the bytes from the shared volume
+ACCEL_REDIRECT_PREFIX = os.getenv("PHOTO_ACCEL_REDIRECT_PREFIX")
 ALLOWED_CONTENT_TYPES = {
     "image/jpeg": ".jpg",
     "image/png": ".png",
@@ -29,20 +41,22 @@ EXT_MEDIA_TYPE = {
     ".webp": "image/webp",
 }
 
+EXERCISE_SORTS = {"default", "usage", "recent"}
+
 
 def exercise_photo_url(exercise_id: int, photo_filename: str | None) -> str | None:
+    # Stored filenames are unique per content (sha256) or per upload (legacy uuid names),
+    # so the URL changes whenever the photo does and can be cached forever.
     if not photo_filename:
         return None
-    return f"/api/exercises/{exercise_id}/photo"
+    return f"/api/exercises/photos/{photo_filename}"
 
 
 def exercise_to_out(
     exercise: Exercise,
-    usage_count_by_exercise: dict[int, int] | None = None,
+    usage_by_exercise: dict[int, UserExerciseUsage] | None = None,
 ) -> ExerciseOut:
-    usage_count = 0
-    if usage_count_by_exercise is not None:
-        usage_count = usage_count_by_exercise.get(exercise.id, 0)
+    usage = (usage_by_exercise or {}).get(exercise.id)
     return ExerciseOut(
         id=exercise.id,
         name=exercise.name,
@@ -50,7 +64,8 @@ def exercise_to_out(
         is_custom=exercise.is_custom,
         created_by=exercise.created_by,
         photo_url=exercise_photo_url(exercise.id, exercise.photo_filename),
-        usage_count=usage_count,
+        usage_count=usage.set_count if usage else 0,
+        last_used_at=usage.last_used_at if usage else None,
     )
 
 
@@ -73,40 +88,124 @@ def _assert_can_edit_photo(exercise: Exercise, user_id: int):
         raise HTTPException(status_code=403, detail="Not your exercise")
 
 
-def _delete_photo_file(filename: str | None):
-    if not filename:
-        return
-    file_path = PHOTO_DIR / filename
-    if file_path.exists():
-        file_path.unlink()
+# ─── Usage counters ───────────────────────────────────────────────────────────
 
+def record_usage(db: Session, user_id: int, counts: dict[int, int], used_at: datetime | None = None):
+    """Apply set-count deltas per exercise for a user, in the caller's transaction.
 
-def _usage_count_by_exercise(db: Session, user_id: int) -> dict[int, int]:
+    Decrements leave last_used_at as is; `rebuild_usage_counters` recomputes it exactly.
+    """
+    for exercise_id, delta in counts.items():
+        if not delta:
+            continue
+        stmt = upsert(db, UserExerciseUsage).values(
+            user_id=user_id,
+            exercise_id=exercise_id,
+            set_count=max(delta, 0),
+            last_used_at=used_at if delta > 0 else None,
+        )
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=[UserExerciseUsage.user_id, UserExerciseUsage.exercise_id],
+            set_={
+                "set_count": greatest(UserExerciseUsage.set_count + delta, 0),
+                # SQLite's scalar max() is NULL if either side is NULL, hence the coalesce fallbacks
+                "last_used_at": func.coalesce(
+                    greatest(UserExerciseUsage.last_used_at, stmt.excluded.last_used_at),
+                    stmt.excluded.last_used_at,
+                    UserExerciseUsage.last_used_at,
+                ),
+            },
+        ))
+    db.query(UserExerciseUsage).filter(
+        UserExerciseUsage.user_id == user_id,
+        UserExerciseUsage.set_count <= 0,
+    ).delete(synchronize_session=False)
+
+
+def usage_by_exercise(db: Session, user_id: int) -> dict[int, UserExerciseUsage]:
+    rows = db.query(UserExerciseUsage).filter(UserExerciseUsage.user_id == user_id).all()
+    return {row.exercise_id: row for row in rows}
+
+
+def rebuild_usage_counters(db: Session, user_id: int | None = None) -> int:
+    """Recompute counters from workout_sets, archive included (all users by default). Returns the number of rows written."""
+    Workout, WorkoutSet = history_models(db)
+    delete = db.query(UserExerciseUsage)
     rows = (
-        db.query(WorkoutSet.exercise_id, func.count(WorkoutSet.id))
+        db.query(
+            Workout.user_id,
+            WorkoutSet.exercise_id,
+            func.count(WorkoutSet.id),
+            func.max(WorkoutSet.logged_at),
+        )
         .join(Workout, WorkoutSet.workout_id == Workout.id)
-        .filter(Workout.user_id == user_id)
-        .group_by(WorkoutSet.exercise_id)
-        .all()
+        .group_by(Workout.user_id, WorkoutSet.exercise_id)
     )
-    return {exercise_id: count for exercise_id, count in rows}
+    if user_id is not None:
+        delete = delete.filter(UserExerciseUsage.user_id == user_id)
+        rows = rows.filter(Workout.user_id == user_id)
+    delete.delete(synchronize_session=False)
+    values = [
+        {"user_id": uid, "exercise_id": eid, "set_count": count, "last_used_at": last_used_at}
+        for uid, eid, count, last_used_at in rows.all()
+    ]
+    if values:
+        db.execute(UserExerciseUsage.__table__.insert(), values)
+    return len(values)
+
+
+def backfill_usage_counters():
+    """Fill user_exercise_usage the first time it exists alongside logged sets."""
+    db = SessionLocal()
+    try:
+        if db.query(UserExerciseUsage).first() is None and db.query(WorkoutSet).first() is not None:
+            rebuild_usage_counters(db)
+            db.commit()
+    finally:
+        db.close()
+
+
+@router.get("/search", response_model=list[ExerciseSearchResult])
+def search_exercises(
+    q: str = "",
+    user_id: int | None = None,
+    limit: int = 20,
+    db: Session = Depends(get_db),
+):
+    usage = usage_by_exercise(db, user_id) if user_id else {}
+    usage_counts = {eid: row.set_count for eid, row in usage.items()}
+    ranked = exercise_index_for(db).search(db, q, user_id, usage_counts, limit=min(max(limit, 1), 100))
+    by_id = {
+        e.id: e for e in db.query(Exercise).filter(Exercise.id.in_([eid for eid, _score in ranked])).all()
+    }
+    return [
+        ExerciseSearchResult(**exercise_to_out(by_id[eid], usage).model_dump(), score=score)
+        for eid, score in ranked
+        if eid in by_id
+    ]
 
 
 @router.get("", response_model=list[ExerciseOut])
-def get_exercises(user_id: int | None = None, db: Session = Depends(get_db)):
+def get_exercises(user_id: int | None = None, sort: str = "default", db: Session = Depends(get_db)):
+    if sort not in EXERCISE_SORTS:
+        raise HTTPException(status_code=422, detail="sort must be default, usage or recent")
     query = db.query(Exercise).filter(Exercise.is_custom == False)
     if user_id:
-        usage_map = _usage_count_by_exercise(db, user_id)
+        usage_map = usage_by_exercise(db, user_id)
         custom = db.query(Exercise).filter(
             Exercise.is_custom == True,
             Exercise.created_by == user_id,
         )
-        return [exercise_to_out(e, usage_map) for e in query.all() + custom.all()]
+        results = [exercise_to_out(e, usage_map) for e in query.all() + custom.all()]
+        if sort == "usage":
+            results.sort(key=lambda e: -e.usage_count)
+        elif sort == "recent":
+            results.sort(key=lambda e: e.last_used_at or datetime.min, reverse=True)
+        return results
     return [exercise_to_out(e) for e in query.all()]
 
 
-@router.post("", response_model=ExerciseOut, status_code=201)
-def create_exercise(payload: ExerciseCreate, db: Session = Depends(get_db)):
+def insert_exercise(db: Session, payload: ExerciseCreate) -> Exercise:
     _get_user(payload.created_by, db)
     exercise = Exercise(
         name=payload.name,
@@ -115,33 +214,119 @@ def create_exercise(payload: ExerciseCreate, db: Session = Depends(get_db)):
         created_by=payload.created_by,
     )
     db.add(exercise)
-    db.commit()
-    db.refresh(exercise)
+    db.flush()
+    return exercise
+
+
+@router.post("", response_model=ExerciseOut, status_code=201)
+def create_exercise(payload: ExerciseCreate):
+    return WRITE_QUEUE.run(lambda db: exercise_to_out(insert_exercise(db, payload)))
+
+
+def _set_photo(db: Session, exercise_id: int, photo_filename: str | None) -> ExerciseOut:
+    exercise = _get_exercise(exercise_id, db)
+    exercise.photo_filename = photo_filename
+    db.flush()
     return exercise_to_out(exercise)
 
 
+def _etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag in candidates or "*" in candidates
+
+
+def _serve_photo(request: Request, photo_filename: str, cache_control: str, size: int | None = None) -> Response:
+    path = photo_path(photo_filename).resolve()
+    if PHOTO_DIR.resolve() not in path.parents or TMP_DIR.resolve() in path.parents or not path.is_file():
+        raise HTTPException(status_code=404, detail="Photo not found")
+
+    etag = f'"{Path(photo_filename).stem}"'
+    if size is not None:
+        variant_size = pick_variant_size(size)
+        variant = variant_filename(photo_filename, variant_size)
+        if photo_path(variant).is_file():
+            etag = f'"{Path(photo_filename).stem}-{variant_size}"'
+            photo_filename, path = variant, photo_path(variant).resolve()
+        else:
+            cache_control = FALLBACK_CACHE_CONTROL
+
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if _etag_matches(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+
+    media_type = EXT_MEDIA_TYPE.get(path.suffix.lower(), "application/octet-stream")
+    if ACCEL_REDIRECT_PREFIX:
+        headers["X-Accel-Redirect"] = f"{ACCEL_REDIRECT_PREFIX.rstrip('/')}/{photo_filename}"
+        return Response(headers=headers, media_type=media_type)
+    # FileResponse answers Range / If-Range requests itself
+    return FileResponse(path, media_type=media_type, headers=headers)
+
+
+@router.get("/photos/{photo_filename:path}")
+def get_photo_file(photo_filename: str, request: Request, size: int | None = None):
+    return _serve_photo(request, photo_filename, IMMUTABLE_CACHE_CONTROL, size)
+
+
 @router.get("/{exercise_id}/photo")
-def get_exercise_photo(exercise_id: int, db: Session = Depends(get_db)):
+def get_exercise_photo(
+    exercise_id: int,
+    request: Request,
+    size: int | None = None,
+    db: Session = Depends(get_db),
+):
     exercise = _get_exercise(exercise_id, db)
     if not exercise.photo_filename:
         raise HTTPException(status_code=404, detail="Photo not found")
+    return _serve_photo(request, exercise.photo_filename, REVALIDATE_CACHE_CONTROL, size)
 
-    photo_path = PHOTO_DIR / exercise.photo_filename
-    if not photo_path.exists():
-        raise HTTPException(status_code=404, detail="Photo not found")
 
-    ext = photo_path.suffix.lower()
-    media_type = EXT_MEDIA_TYPE.get(ext, "application/octet-stream")
-    return FileResponse(photo_path, media_type=media_type)
+async def photo_upload(request: Request):
+    """The multipart `file` field, read off the request stream under a byte cap.
+
+    FastAPI's File() spools the whole body before the handler runs, and a chunked
+    request carries no Content-Length to check, so the body is counted as it arrives
+    and the upload refused as soon as it passes the cap.
+    """
+    limit = MAX_PHOTO_BYTES + MULTIPART_OVERHEAD_BYTES
+    if int(request.headers.get("content-length") or 0) > limit:
+        raise HTTPException(status_code=422, detail="File too large (max 5MB)")
+    if not request.headers.get("content-type", "").startswith("multipart/form-data"):
+        raise HTTPException(status_code=422, detail="Expected a multipart/form-data upload")
+
+    async def capped_body():
+        received = 0
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > limit:
+                raise HTTPException(status_code=422, detail="File too large (max 5MB)")
+            yield chunk
+
+    parser = MultiPartParser(request.headers, capped_body(), max_files=1, max_fields=10)
+    try:
+        form = await parser.parse()
+    except MultiPartException as exc:
+        raise HTTPException(status_code=400, detail=exc.message)
+    try:
+        file = form.get("file")
+        if file is None or isinstance(file, str):
+            raise HTTPException(status_code=422, detail="Missing file")
+        yield file
+    finally:
+        await form.close()
 
 
 @router.post("/{exercise_id}/photo", response_model=ExerciseOut, status_code=201)
-async def upload_exercise_photo(
+def upload_exercise_photo(
+    background_tasks: BackgroundTasks,
     exercise_id: int,
     user_id: int,
-    file: UploadFile = File(...),
+    file: UploadFile = Depends(photo_upload),
     db: Session = Depends(get_db),
 ):
+    # Sync handler on purpose: chunked disk I/O and ORM calls run in the threadpool, not on the event loop.
     _get_user(user_id, db)
     exercise = _get_exercise(exercise_id, db)
     _assert_can_edit_photo(exercise, user_id)
@@ -151,22 +336,13 @@ async def upload_exercise_photo(
     if not ext:
         raise HTTPException(status_code=422, detail="Only JPEG, PNG and WEBP are supported")
 
-    file_bytes = await file.read()
-    if not file_bytes:
-        raise HTTPException(status_code=422, detail="Empty file")
-    if len(file_bytes) > MAX_PHOTO_BYTES:
-        raise HTTPException(status_code=422, detail="File too large (max 5MB)")
-
-    _delete_photo_file(exercise.photo_filename)
-
-    filename = f"exercise_{exercise.id}_{uuid4().hex}{ext}"
-    photo_path = PHOTO_DIR / filename
-    photo_path.write_bytes(file_bytes)
-
-    exercise.photo_filename = filename
-    db.commit()
-    db.refresh(exercise)
-    return exercise_to_out(exercise)
+    # Stored before the write unit, so the writer never waits on disk I/O. The previous file is
+    # left to the background photo GC, it may be shared by other exercises.
+    photo_filename = store_upload(file.file, ext)
+    out = WRITE_QUEUE.run(lambda db: _set_photo(db, exercise_id, photo_filename))
+    # Thumbnails are resized after the response is sent; ?size= falls back to the original meanwhile
+    background_tasks.add_task(generate_variants, photo_filename)
+    return out
 
 
 @router.delete("/{exercise_id}/photo", response_model=ExerciseOut)
@@ -174,12 +350,7 @@ def delete_exercise_photo(exercise_id: int, user_id: int, db: Session = Depends(
     _get_user(user_id, db)
     exercise = _get_exercise(exercise_id, db)
     _assert_can_edit_photo(exercise, user_id)
-
-    _delete_photo_file(exercise.photo_filename)
-    exercise.photo_filename = None
-    db.commit()
-    db.refresh(exercise)
-    return exercise_to_out(exercise)
+    return WRITE_QUEUE.run(lambda db: _set_photo(db, exercise_id, None))
 
 
 @router.delete("/{exercise_id}", status_code=200)
@@ -189,7 +360,10 @@ def delete_exercise(exercise_id: int, user_id: int, db: Session = Depends(get_db
         raise HTTPException(status_code=403, detail="Cannot delete predefined exercises")
     if exercise.created_by != user_id:
         raise HTTPException(status_code=403, detail="Not your exercise")
-    _delete_photo_file(exercise.photo_filename)
-    db.delete(exercise)
-    db.commit()
+    from routers.sets import SET_WRITE_BUFFER  # routers.sets imports this module
+
+    # Buffered sets land before the check; logged history is never deleted with its exercise
+    SET_WRITE_BUFFER.flush()
+    if not WRITE_QUEUE.run(lambda db: remove_exercise(db, exercise_id)):
+        raise HTTPException(status_code=409, detail="Exercise has logged sets")
     return {"ok": True}
@@ -4,6 +4,7 @@ from sqlalchemy.orm import Session
 from database import get_db
 from models import FavoriteTemplate, User
 from schemas import FavoriteOut, FavoriteCreate
+from write_queue import WRITE_QUEUE
 
 router = APIRouter(prefix="/favorites", tags=["favorites"])
 
@@ -18,8 +19,7 @@ def get_favorites(user_id: int, db: Session = Depends(get_db)):
     )
 
 
-@router.post("", response_model=FavoriteOut, status_code=201)
-def create_favorite(payload: FavoriteCreate, db: Session = Depends(get_db)):
+def insert_favorite(db: Session, payload: FavoriteCreate) -> FavoriteTemplate:
     user = db.query(User).filter(User.id == payload.user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
@@ -29,16 +29,24 @@ def create_favorite(payload: FavoriteCreate, db: Session = Depends(get_db)):
         workout_type=payload.workout_type,
     )
     db.add(fav)
-    db.commit()
-    db.refresh(fav)
+    db.flush()
     return fav
 
 
-@router.delete("/{favorite_id}", status_code=200)
-def delete_favorite(favorite_id: int, db: Session = Depends(get_db)):
+@router.post("", response_model=FavoriteOut, status_code=201)
+def create_favorite(payload: FavoriteCreate):
+    return WRITE_QUEUE.run(lambda db: FavoriteOut.model_validate(insert_favorite(db, payload)))
+
+
+def remove_favorite(db: Session, favorite_id: int):
     fav = db.query(FavoriteTemplate).filter(FavoriteTemplate.id == favorite_id).first()
     if not fav:
         raise HTTPException(status_code=404, detail="Favorite not found")
     db.delete(fav)
-    db.commit()
+    db.flush()
+
+
+@router.delete("/{favorite_id}", status_code=200)
+def delete_favorite(favorite_id: int):
+    WRITE_QUEUE.run(lambda db: remove_favorite(db, favorite_id))
     return {"ok": True}
@@ -1,12 +1,19 @@
+import hashlib
 from datetime import datetime, timedelta
 
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import joinedload
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from sqlalchemy import func
+from sqlalchemy.orm import selectinload
 from sqlalchemy.orm import Session
 
-from database import get_db
-from models import BodyMeasurement, BodyWeight, User, Workout, WorkoutSet
-from schemas import InsightPromptOut
+from archive import history_models
+from cache import LRUCache, get_data_version
+from database import date_bucket, get_db
+from models import BodyMeasurement, BodyWeight, Exercise, User, Workout, WorkoutSet
+from routers.body_weight import weight_trend_rate
+from routers.sets import SET_WRITE_BUFFER
+from schemas import InsightPromptOut, TrainingLoadDay, TrainingLoadOut
+from training_load import load_metrics
 
 router = APIRouter(prefix="/insights", tags=["insights"])
 
@@ -17,6 +24,22 @@ PERIOD_DAYS = {
     "6m": 183,
 }
 
+# Prompts are keyed by (user_id, template, period, day, data_version), so any write
+# to the user's data makes old entries unreachable and they age out of the LRU.
+PROMPT_CACHE = LRUCache(max_entries=256, max_size=32 * 1024 * 1024)
+
+# Prompt size budget. Recent sessions keep per-set detail; older ones collapse into
+# per-exercise weekly aggregates, then per-exercise period totals, until it fits.
+CHARS_PER_TOKEN = 4
+DEFAULT_MAX_CHARS = 40_000
+MIN_MAX_CHARS = 4_000
+MAX_MAX_CHARS = 400_000
+DETAIL_BUDGET_SHARE = 0.6
+DETAIL_BATCH_SIZE = 10
+
+DEFAULT_LOAD_DAYS = 90
+MAX_LOAD_DAYS = 730
+
 MEASUREMENT_FIELDS = [
     ("chest_cm", "Poitrine"),
     ("waist_cm", "Taille"),
@@ -140,19 +163,204 @@ def _format_workouts_full_lines(workouts: list[Workout]) -> list[str]:
     return lines
 
 
-@router.get("/prompt", response_model=InsightPromptOut)
-def get_insight_prompt(
-    user_id: int,
-    template: str = "weekly",
-    period: str | None = None,
-    db: Session = Depends(get_db),
-):
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+def _resolve_max_chars(max_chars: int | None, max_tokens: int | None) -> int:
+    if max_chars is None and max_tokens is not None:
+        max_chars = max_tokens * CHARS_PER_TOKEN
+    if max_chars is None:
+        return DEFAULT_MAX_CHARS
+    return max(MIN_MAX_CHARS, min(MAX_MAX_CHARS, max_chars))
 
-    resolved_period, days = _parse_template_period(template, period)
-    now = datetime.utcnow()
+
+def _lines_len(lines: list[str]) -> int:
+    return sum(len(line) + 1 for line in lines)
+
+
+def _truncate_lines(lines: list[str], budget: int) -> list[str]:
+    marker = "  - ... (tronque pour respecter la taille du prompt)"
+    kept: list[str] = []
+    used = len(marker) + 1
+    for line in lines:
+        if used + len(line) + 1 > budget:
+            return kept + [marker]
+        kept.append(line)
+        used += len(line) + 1
+    return kept
+
+
+def _fit_lines(levels, budget: int) -> list[str]:
+    """Return the first, most detailed rendering that fits `budget`, else truncate the coarsest one."""
+    lines: list[str] = []
+    for build in levels:
+        lines = build()
+        if _lines_len(lines) <= budget:
+            return lines
+    return _truncate_lines(lines, budget)
+
+
+def _done_sets_in_window(db: Session, models, user_id: int, start: datetime, end: datetime):
+    Workout, WorkoutSet = models
+    return (
+        db.query(WorkoutSet)
+        .join(Workout, WorkoutSet.workout_id == Workout.id)
+        .join(Exercise, WorkoutSet.exercise_id == Exercise.id)
+        .filter(
+            Workout.user_id == user_id,
+            Workout.completed_at.isnot(None),
+            Workout.completed_at >= start,
+            Workout.completed_at < end,
+            WorkoutSet.status == "done",
+        )
+    )
+
+
+def _bucketed_aggregate_lines(db: Session, user_id: int, start: datetime, end: datetime, bucket: str) -> list[str]:
+    Workout, WorkoutSet = history_models(db, start)
+    period_start = date_bucket(Workout.completed_at, bucket)
+    rows = (
+        _done_sets_in_window(db, (Workout, WorkoutSet), user_id, start, end)
+        .with_entities(
+            Exercise.name,
+            period_start,
+            func.count(WorkoutSet.id),
+            func.max(WorkoutSet.weight_kg),
+            func.sum(WorkoutSet.weight_kg * WorkoutSet.reps),
+            func.avg(WorkoutSet.rpe),
+            func.sum(WorkoutSet.duration_seconds),
+        )
+        .group_by(Exercise.name, period_start)
+        .order_by(Exercise.name, period_start)
+        .all()
+    )
+    lines: list[str] = []
+    current_exercise = None
+    label = "semaine du" if bucket == "week" else "mois du"
+    for name, bucket_start, set_count, top_kg, volume, avg_rpe, duration in rows:
+        if name != current_exercise:
+            lines.append(f"- {name}")
+            current_exercise = name
+        parts = [f"  - {label} {bucket_start}", f"series={set_count}"]
+        if top_kg is not None:
+            parts.append(f"top={_fmt(top_kg)} kg")
+        if volume:
+            parts.append(f"volume={_fmt(volume, 0)} kg")
+        if avg_rpe is not None:
+            parts.append(f"rpe_moy={_fmt(avg_rpe)}")
+        if duration:
+            parts.append(f"duree={int(duration) // 60} min")
+        lines.append(" | ".join(parts))
+    return lines
+
+
+def _period_aggregate_lines(db: Session, user_id: int, start: datetime, end: datetime) -> list[str]:
+    Workout, WorkoutSet = history_models(db, start)
+    rows = (
+        _done_sets_in_window(db, (Workout, WorkoutSet), user_id, start, end)
+        .with_entities(
+            Exercise.name,
+            func.count(func.distinct(Workout.id)),
+            func.count(WorkoutSet.id),
+            func.max(WorkoutSet.weight_kg),
+            func.sum(WorkoutSet.weight_kg * WorkoutSet.reps),
+            func.avg(WorkoutSet.rpe),
+        )
+        .group_by(Exercise.name)
+        .order_by(func.count(WorkoutSet.id).desc())
+        .all()
+    )
+    lines: list[str] = []
+    for name, session_count, set_count, top_kg, volume, avg_rpe in rows:
+        parts = [f"- {name}", f"seances={session_count}", f"series={set_count}"]
+        if top_kg is not None:
+            parts.append(f"top={_fmt(top_kg)} kg")
+        if volume:
+            parts.append(f"volume={_fmt(volume, 0)} kg")
+        if avg_rpe is not None:
+            parts.append(f"rpe_moy={_fmt(avg_rpe)}")
+        lines.append(" | ".join(parts))
+    return lines
+
+
+def _aggregate_levels(db: Session, user_id: int, start: datetime, end: datetime):
+    heading = "- Seances plus anciennes (agregats {} par exercice, series validees):"
+    return [
+        lambda: [heading.format("hebdomadaires"), *_bucketed_aggregate_lines(db, user_id, start, end, "week")],
+        lambda: [heading.format("mensuels"), *_bucketed_aggregate_lines(db, user_id, start, end, "month")],
+        lambda: [heading.format("sur la periode"), *_period_aggregate_lines(db, user_id, start, end)],
+    ]
+
+
+def _budgeted_workout_lines(
+    db: Session,
+    user_id: int,
+    start: datetime,
+    end: datetime,
+    budget: int,
+) -> list[str]:
+    """Full per-set detail for the most recent sessions, SQL aggregates for the older remainder."""
+    Workout, WorkoutSet = history_models(db, start)
+    base_query = (
+        db.query(Workout)
+        .filter(
+            Workout.user_id == user_id,
+            Workout.completed_at.isnot(None),
+            Workout.completed_at >= start,
+            Workout.completed_at < end,
+        )
+        .order_by(Workout.completed_at.desc(), Workout.id.desc())
+    )
+    detailed: list[tuple[datetime, list[str]]] = []
+    used = 0
+    offset = 0
+    complete = False
+    while True:
+        batch = (
+            base_query
+            .options(selectinload(Workout.sets).joinedload(WorkoutSet.exercise))
+            .offset(offset)
+            .limit(DETAIL_BATCH_SIZE)
+            .all()
+        )
+        offset += len(batch)
+        fits = True
+        for workout in batch:
+            lines = _format_workouts_full_lines([workout])
+            if used + _lines_len(lines) > budget:
+                fits = False
+                break
+            detailed.append((workout.completed_at, lines))
+            used += _lines_len(lines)
+        if not fits:
+            break
+        if len(batch) < DETAIL_BATCH_SIZE:
+            complete = True
+            break
+    if offset == 0:
+        return _format_workouts_full_lines([])
+    if complete:
+        return [line for _completed_at, lines in reversed(detailed) for line in lines]
+
+    # Not everything fits: keep the newest sessions within the detail share, summarize the rest.
+    while detailed and used > budget * DETAIL_BUDGET_SHARE:
+        used -= _lines_len(detailed.pop()[1])
+    oldest_detailed = detailed[-1][0] if detailed else end
+    full_lines = [line for _completed_at, lines in reversed(detailed) for line in lines]
+    older = _fit_lines(
+        _aggregate_levels(db, user_id, start, oldest_detailed),
+        budget - used,
+    )
+    return older + full_lines
+
+
+def build_insight_prompt(
+    db: Session,
+    user: User,
+    template: str,
+    resolved_period: str,
+    days: int,
+    now: datetime,
+    max_chars: int = DEFAULT_MAX_CHARS,
+) -> InsightPromptOut:
+    user_id = user.id
     start = now - timedelta(days=days)
     prev_start = start - timedelta(days=days)
     prev_end = start
@@ -187,31 +395,6 @@ def get_insight_prompt(
     meas_cur = _summarize_measurements(meas_current)
     meas_prev = _summarize_measurements(meas_previous)
 
-    workouts_current = (
-        db.query(Workout)
-        .options(joinedload(Workout.sets).joinedload(WorkoutSet.exercise))
-        .filter(
-            Workout.user_id == user_id,
-            Workout.completed_at.isnot(None),
-            Workout.completed_at >= start,
-            Workout.completed_at < now,
-        )
-        .order_by(Workout.completed_at.asc())
-        .all()
-    )
-    workouts_previous = (
-        db.query(Workout)
-        .options(joinedload(Workout.sets).joinedload(WorkoutSet.exercise))
-        .filter(
-            Workout.user_id == user_id,
-            Workout.completed_at.isnot(None),
-            Workout.completed_at >= prev_start,
-            Workout.completed_at < prev_end,
-        )
-        .order_by(Workout.completed_at.asc())
-        .all()
-    )
-
     weight_lines = []
     if weight_cur.get("count", 0) == 0:
         weight_lines.append("- Donnees insuffisantes: aucune mesure de poids sur la periode.")
@@ -225,6 +408,10 @@ def get_insight_prompt(
             weight_lines.append(f"- vs periode precedente: moyenne {_fmt(avg_delta)} kg.")
         else:
             weight_lines.append("- vs periode precedente: donnees insuffisantes.")
+        trend_kg, weekly_rate = weight_trend_rate(db, user_id)
+        if trend_kg is not None:
+            rate_txt = f", rythme {_fmt(weekly_rate, 2)} kg/semaine" if weekly_rate is not None else ""
+            weight_lines.append(f"- Tendance lissee: {_fmt(trend_kg)} kg{rate_txt}.")
 
     measurement_lines = []
     if not meas_cur:
@@ -239,8 +426,24 @@ def get_insight_prompt(
             delta_txt = f"delta periode {_fmt(cur['delta'])} cm" if cur["delta"] is not None else "une seule mesure"
             measurement_lines.append(f"- {label}: {_fmt(cur['last'])} cm ({delta_txt}{prev_delta_txt}).")
 
-    full_workout_lines = _format_workouts_full_lines(workouts_current)
-    full_workout_prev_lines = _format_workouts_full_lines(workouts_previous)
+    load_lines = []
+    load_series = load_metrics(db, user_id, days, now.date())
+    if not any(day["load"] for day in load_series):
+        load_lines.append("- Donnees insuffisantes: aucune serie terminee sur la periode.")
+    else:
+        current = load_series[-1]
+        load_lines.append(
+            f"- Charge aigue (7 j): {_fmt(current['acute'], 0)} UA/jour, chronique (28 j): {_fmt(current['chronic'], 0)} UA/jour."
+        )
+        if current["acwr"] is not None:
+            load_lines.append(f"- Ratio aigu/chronique (ACWR): {_fmt(current['acwr'], 2)}.")
+        if current["monotony"] is not None:
+            load_lines.append(
+                f"- Monotonie: {_fmt(current['monotony'], 2)}, contrainte hebdo: {_fmt(current['strain'], 0)}."
+            )
+        peak = max(load_series, key=lambda day: day["acwr"] or 0)
+        if peak["acwr"]:
+            load_lines.append(f"- ACWR max sur la periode: {_fmt(peak['acwr'], 2)} le {peak['day']}.")
 
     raw_weight_lines = [
         f"- {w.logged_at.strftime('%Y-%m-%d')}: {_fmt(w.weight_kg)} kg"
@@ -248,50 +451,131 @@ def get_insight_prompt(
     ] or ["- Aucune entree."]
     raw_measurement_lines = [_format_measurement_row(m) for m in meas_current[-5:]] or ["- Aucune entree."]
 
-    prompt = "\n".join(
-        [
-            "Tu es un coach sportif et analyste de progression.",
-            "Analyse les donnees ci-dessous et reponds en francais clair et concret.",
-            "",
-            "## Contexte",
-            f"- Profil: {user.name}",
-            f"- Objectif poids: {_fmt(user.target_weight_kg)} kg",
-            f"- Template demande: {template}",
-            f"- Periode analysee: {resolved_period} ({days} jours) du {start.strftime('%Y-%m-%d')} au {now.strftime('%Y-%m-%d')}",
-            "",
-            "## Synthese poids",
-            *weight_lines,
-            "",
-            "## Synthese mensurations",
-            *measurement_lines,
-            "",
-            "## Seances completes (periode analysee)",
-            *full_workout_lines,
-            "",
-            "## Seances completes (periode precedente de reference)",
-            *full_workout_prev_lines,
-            "",
-            "## Donnees semi-brutes recentes",
-            "Poids (dernieres entrees):",
-            *raw_weight_lines,
-            "Mensurations (dernieres entrees):",
-            *raw_measurement_lines,
-            "",
-            "## Ta mission",
-            "Donne une reponse en 3 parties:",
-            "1) Analyse de la progression (forces / stagnations / incoherences).",
-            "2) Hypotheses explicatives priorisees (entrainement, recuperation, nutrition, adherence).",
-            "3) Avis global sur l'evolution a partir des seances completes, du poids et des mensurations.",
-            "",
-            "Contrainte: ne rends pas un plan d'action obligatoire.",
-            "Si tu proposes des pistes, garde-les optionnelles et non prescriptives.",
-            "Si les donnees sont insuffisantes, dis-le explicitement.",
-        ]
+    head_lines = [
+        "Tu es un coach sportif et analyste de progression.",
+        "Analyse les donnees ci-dessous et reponds en francais clair et concret.",
+        "",
+        "## Contexte",
+        f"- Profil: {user.name}",
+        f"- Objectif poids: {_fmt(user.target_weight_kg)} kg",
+        f"- Template demande: {template}",
+        f"- Periode analysee: {resolved_period} ({days} jours) du {start.strftime('%Y-%m-%d')} au {now.strftime('%Y-%m-%d')}",
+        "",
+        "## Synthese poids",
+        *weight_lines,
+        "",
+        "## Synthese mensurations",
+        *measurement_lines,
+        "",
+        "## Charge d'entrainement (UA = minutes ou kg x RPE)",
+        *load_lines,
+        "",
+        "## Seances completes (periode analysee)",
+    ]
+    tail_lines = [
+        "",
+        "## Donnees semi-brutes recentes",
+        "Poids (dernieres entrees):",
+        *raw_weight_lines,
+        "Mensurations (dernieres entrees):",
+        *raw_measurement_lines,
+        "",
+        "## Ta mission",
+        "Donne une reponse en 3 parties:",
+        "1) Analyse de la progression (forces / stagnations / incoherences).",
+        "2) Hypotheses explicatives priorisees (entrainement, recuperation, nutrition, adherence).",
+        "3) Avis global sur l'evolution a partir des seances completes, du poids et des mensurations.",
+        "",
+        "Contrainte: ne rends pas un plan d'action obligatoire.",
+        "Si tu proposes des pistes, garde-les optionnelles et non prescriptives.",
+        "Si les donnees sont insuffisantes, dis-le explicitement.",
+    ]
+    prev_heading = ["", "## Seances completes (periode precedente de reference)"]
+
+    # Workouts get whatever the fixed sections leave, the analysed period first.
+    workout_budget = max(0, max_chars - _lines_len(head_lines) - _lines_len(tail_lines) - _lines_len(prev_heading))
+    full_workout_lines = _budgeted_workout_lines(db, user_id, start, now, int(workout_budget * 0.7))
+    full_workout_prev_lines = _budgeted_workout_lines(
+        db, user_id, prev_start, prev_end, workout_budget - _lines_len(full_workout_lines),
     )
 
+    prompt = "\n".join([*head_lines, *full_workout_lines, *prev_heading, *full_workout_prev_lines, *tail_lines])
+
     return InsightPromptOut(
         template=template,
         period=resolved_period,
         generated_at=now,
         prompt=prompt,
     )
+
+
+def _prompt_etag(cache_key: tuple) -> str:
+    return '"' + hashlib.sha1(repr(cache_key).encode()).hexdigest() + '"'
+
+
+def _prompt_cache_key(
+    db: Session,
+    user: User,
+    template: str,
+    resolved_period: str,
+    now: datetime,
+    max_chars: int,
+) -> tuple:
+    return (user.id, template, resolved_period, now.date(), max_chars, get_data_version(db, user.id))
+
+
+def cached_insight_prompt(
+    db: Session,
+    user: User,
+    template: str,
+    period: str | None = None,
+    now: datetime | None = None,
+    max_chars: int = DEFAULT_MAX_CHARS,
+) -> tuple[InsightPromptOut, str]:
+    """Return (prompt, etag) for the day and user data version, building the prompt only on a miss."""
+    resolved_period, days = _parse_template_period(template, period)
+    now = now or datetime.utcnow()
+    cache_key = _prompt_cache_key(db, user, template, resolved_period, now, max_chars)
+    prompt = PROMPT_CACHE.get(cache_key)
+    if prompt is None:
+        prompt = build_insight_prompt(db, user, template, resolved_period, days, now, max_chars)
+        PROMPT_CACHE.set(cache_key, prompt, size=len(prompt.prompt))
+    return prompt, _prompt_etag(cache_key)
+
+
+@router.get("/{user_id}/load", response_model=TrainingLoadOut)
+def get_training_load(user_id: int, days: int = DEFAULT_LOAD_DAYS, db: Session = Depends(get_db)):
+    SET_WRITE_BUFFER.flush()
+    if not db.query(User.id).filter(User.id == user_id).first():
+        raise HTTPException(status_code=404, detail="User not found")
+    series = [TrainingLoadDay(**day) for day in load_metrics(db, user_id, min(max(days, 1), MAX_LOAD_DAYS))]
+    return TrainingLoadOut(user_id=user_id, current=series[-1], days=series)
+
+
+@router.get("/prompt", response_model=InsightPromptOut)
+def get_insight_prompt(
+    request: Request,
+    response: Response,
+    user_id: int,
+    template: str = "weekly",
+    period: str | None = None,
+    max_chars: int | None = None,
+    max_tokens: int | None = None,
+    db: Session = Depends(get_db),
+):
+    SET_WRITE_BUFFER.flush()
+    user = db.query(User).filter(User.id == user_id).first()
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    resolved_period, _days = _parse_template_period(template, period)
+    budget = _resolve_max_chars(max_chars, max_tokens)
+    now = datetime.utcnow()
+    etag = _prompt_etag(_prompt_cache_key(db, user, template, resolved_period, now, budget))
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    prompt, _etag = cached_insight_prompt(db, user, template, resolved_period, now, budget)
+    response.headers.update(headers)
+    return prompt
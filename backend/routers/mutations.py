@@ -0,0 +1,167 @@
+import json
+import logging
+from datetime import datetime, timedelta
+from fastapi import APIRouter, HTTPException
+from pydantic import ValidationError
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from models import ProcessedMutation
+from routers.sets import SET_WRITE_BUFFER, apply_set_update, remove_set
+from routers.workouts import (
+    _set_to_out, _workout_to_out, apply_workout_update, insert_set, insert_workout,
+)
+from schemas import (
+    MutationBatchIn, MutationBatchOut, MutationIn, MutationResultOut,
+    SetCreate, SetUpdate, WorkoutCreate, WorkoutUpdate,
+)
+from write_queue import WRITE_QUEUE, is_busy
+
+logger = logging.getLogger("fitcouple.mutations")
+
+router = APIRouter(tags=["mutations"])
+
+MUTATION_KEY_TTL = timedelta(days=7)
+REFERENCE_PREFIX = "@"  # "workout_id": "@<key>" points at the id created by an earlier operation
+REFERENCE_FIELDS = ("workout_id", "set_id", "template_id")
+
+
+def _resolve_references(db: Session, args: dict, created_ids: dict[str, int]) -> dict:
+    resolved = dict(args)
+    for field in REFERENCE_FIELDS:
+        value = resolved.get(field)
+        if isinstance(value, str) and value.startswith(REFERENCE_PREFIX):
+            key = value.removeprefix(REFERENCE_PREFIX)
+            if key not in created_ids:
+                # Created by an earlier batch
+                previous = db.query(ProcessedMutation.result).filter(ProcessedMutation.key == key).scalar()
+                body = json.loads(previous) if previous else {}
+                if "id" not in body:
+                    raise HTTPException(status_code=422, detail=f"Unknown reference {value}")
+                created_ids[key] = body["id"]
+            resolved[field] = created_ids[key]
+    return resolved
+
+
+def _target_id(args: dict, field: str) -> int:
+    value = args.get(field)
+    if not isinstance(value, int):
+        raise HTTPException(status_code=422, detail=f"{field} is required")
+    return value
+
+
+class MutationKeyConflict(Exception):
+    """The idempotency key was recorded by a concurrent request since the batch looked it up."""
+
+
+def _apply(db: Session, op: str, args: dict) -> tuple[int, dict]:
+    """Run one operation through the same helpers as the REST routes. Returns (status_code, body)."""
+    if op == "create_workout":
+        workout = insert_workout(db, WorkoutCreate(**args))
+        return 201, _workout_to_out(workout).model_dump(mode="json")
+    if op == "update_workout":
+        workout = apply_workout_update(db, _target_id(args, "workout_id"), WorkoutUpdate(**args))
+        return 200, _workout_to_out(workout).model_dump(mode="json")
+    if op == "add_set":
+        ws = insert_set(db, _target_id(args, "workout_id"), SetCreate(**args))
+        return 201, _set_to_out(ws).model_dump(mode="json")
+    if op == "update_set":
+        ws = apply_set_update(db, _target_id(args, "set_id"), SetUpdate(**args))
+        return 200, _set_to_out(ws).model_dump(mode="json")
+    remove_set(db, _target_id(args, "set_id"))
+    return 200, {"ok": True}
+
+
+def _run_operation(db: Session, operation: MutationIn, created_ids: dict[str, int]) -> MutationResultOut:
+    savepoint = db.begin_nested()
+    try:
+        status_code, body = _apply(db, operation.op, _resolve_references(db, operation.args, created_ids))
+        db.flush()
+    except HTTPException as exc:
+        savepoint.rollback()
+        return MutationResultOut(
+            key=operation.key, op=operation.op, status="error", status_code=exc.status_code, error=exc.detail,
+        )
+    except ValidationError as exc:
+        savepoint.rollback()
+        return MutationResultOut(
+            key=operation.key, op=operation.op, status="error", status_code=422,
+            error="; ".join(f"{'.'.join(map(str, e['loc']))}: {e['msg']}" for e in exc.errors()),
+        )
+    except SQLAlchemyError as exc:
+        if is_busy(exc):
+            raise  # the write queue retries the whole batch
+        savepoint.rollback()
+        if isinstance(exc, IntegrityError):
+            return MutationResultOut(
+                key=operation.key, op=operation.op, status="error", status_code=409,
+                error="Conflicts with existing data",
+            )
+        logger.exception("mutation %s (%s) failed", operation.key, operation.op)
+        return MutationResultOut(
+            key=operation.key, op=operation.op, status="error", status_code=500, error="Database error",
+        )
+
+    db.add(ProcessedMutation(
+        key=operation.key, op=operation.op, status_code=status_code, result=json.dumps(body),
+    ))
+    try:
+        savepoint.commit()
+    except IntegrityError as exc:
+        raise MutationKeyConflict(operation.key) from exc
+    if "id" in body:
+        created_ids[operation.key] = body["id"]
+    return MutationResultOut(
+        key=operation.key, op=operation.op, status="applied", status_code=status_code, result=body,
+    )
+
+
+def _apply_batch(db: Session, operations: list[MutationIn]) -> MutationBatchOut:
+    keys = [operation.key for operation in operations]
+    processed = {
+        row.key: row for row in db.query(ProcessedMutation).filter(ProcessedMutation.key.in_(keys)).all()
+    }
+
+    created_ids: dict[str, int] = {}
+    results = []
+    for operation in operations:
+        previous = processed.get(operation.key)
+        if previous is not None:
+            body = json.loads(previous.result) if previous.result else None
+            if body and "id" in body:
+                created_ids[operation.key] = body["id"]
+            results.append(MutationResultOut(
+                key=operation.key, op=previous.op, status="replayed",
+                status_code=previous.status_code, result=body,
+            ))
+            continue
+        results.append(_run_operation(db, operation, created_ids))
+    return MutationBatchOut(results=results)
+
+
+@router.post("/mutations:batch", response_model=MutationBatchOut)
+def apply_mutation_batch(payload: MutationBatchIn):
+    """Apply queued offline operations in order, in one transaction.
+
+    Keys already processed are not applied again: their stored result comes back
+    with status "replayed". Failed operations, database errors included, are rolled
+    back on their own and are not recorded, so the client can fix and resend them.
+    """
+    keys = [operation.key for operation in payload.operations]
+    if len(set(keys)) != len(keys):
+        raise HTTPException(status_code=422, detail="Duplicate idempotency keys in batch")
+    # Buffered PATCHes land first, so batch operations apply on top of them
+    SET_WRITE_BUFFER.flush()
+    try:
+        return WRITE_QUEUE.run(lambda db: _apply_batch(db, payload.operations))
+    except MutationKeyConflict:
+        raise HTTPException(status_code=409, detail="Batch overlaps a concurrent replay, retry it")
+
+
+def purge_processed_mutations(db: Session, now: datetime | None = None) -> int:
+    cutoff = (now or datetime.utcnow()) - MUTATION_KEY_TTL
+    return (
+        db.query(ProcessedMutation)
+        .filter(ProcessedMutation.processed_at < cutoff)
+        .delete(synchronize_session=False)
+    )
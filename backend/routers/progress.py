@@ -1,29 +1,82 @@
-from datetime import datetime
-from fastapi import APIRouter, Depends, HTTPException
+from datetime import date, datetime, timedelta
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import case, func
 
-from database import get_db
-from models import Workout, WorkoutSet, Exercise, User
+from cache import LRUCache, get_history_version, history_cutoff
+from archive import history_models
+from database import bucket_range, date_bucket, get_db
+from models import Exercise, User
 from routers.exercises import exercise_photo_url
-from schemas import PROut, ExerciseProgress, ExerciseOut, ProgressEntry
+from routers.sets import SET_WRITE_BUFFER
+from schemas import (
+    PROut, ExerciseProgress, ExerciseOut, ProgressEntry,
+    MuscleGroupVolume, MuscleVolumeOut, MuscleVolumePeriod,
+)
 
 router = APIRouter(prefix="/progress", tags=["progress"])
 
+VOLUME_BUCKETS = ("week", "month")
+DEFAULT_VOLUME_PERIODS = 12
+HARD_SET_RPE = 8
+
+# Closed periods keyed by (user_id, bucket, period_start, history_version): they only
+# change when a set in the past is edited, which bumps history_version.
+VOLUME_CACHE = LRUCache(max_entries=4096)
+
+
+def _muscle_volume_by_period(
+    db: Session, user_id: int, bucket: str, start: date, end: date,
+) -> dict[date, list[MuscleGroupVolume]]:
+    """Per-period, per-muscle-group totals of done sets in [start, end), in one grouped query."""
+    Workout, WorkoutSet = history_models(db, start)
+    period = date_bucket(WorkoutSet.logged_at, bucket)
+    rows = (
+        db.query(
+            period,
+            Exercise.muscle_group,
+            func.count(WorkoutSet.id),
+            func.sum(case((WorkoutSet.rpe >= HARD_SET_RPE, 1), else_=0)),
+            func.sum(WorkoutSet.weight_kg * WorkoutSet.reps),
+        )
+        .join(Workout, WorkoutSet.workout_id == Workout.id)
+        .join(Exercise, WorkoutSet.exercise_id == Exercise.id)
+        .filter(
+            Workout.user_id == user_id,
+            WorkoutSet.status == "done",
+            WorkoutSet.logged_at >= datetime.combine(start, datetime.min.time()),
+            WorkoutSet.logged_at < datetime.combine(end, datetime.min.time()),
+        )
+        .group_by(period, Exercise.muscle_group)
+        .order_by(period, Exercise.muscle_group)
+        .all()
+    )
+    by_period: dict[date, list[MuscleGroupVolume]] = {}
+    for period_start, muscle_group, set_count, hard_sets, volume in rows:
+        by_period.setdefault(date.fromisoformat(str(period_start)), []).append(MuscleGroupVolume(
+            muscle_group=muscle_group,
+            sets=set_count,
+            hard_sets=hard_sets or 0,
+            volume_kg=round(volume or 0, 1),
+        ))
+    return by_period
+
 
 @router.get("/{user_id}/prs", response_model=list[PROut])
 def get_prs(user_id: int, db: Session = Depends(get_db)):
+    SET_WRITE_BUFFER.flush()
     user = db.query(User).filter(User.id == user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    # For each exercise, find the set with the highest weight_kg
+    # For each exercise, find the set with the highest weight_kg, archived workouts included
+    Workout, WorkoutSet = history_models(db)
     subq = (
         db.query(
             WorkoutSet.exercise_id,
             func.max(WorkoutSet.weight_kg).label("max_weight"),
         )
-        .join(Workout)
+        .join(Workout, WorkoutSet.workout_id == Workout.id)
         .filter(
             Workout.user_id == user_id,
             WorkoutSet.status == "done",
@@ -40,7 +93,7 @@ def get_prs(user_id: int, db: Session = Depends(get_db)):
         # Find the actual set for the date
         best_set = (
             db.query(WorkoutSet)
-            .join(Workout)
+            .join(Workout, WorkoutSet.workout_id == Workout.id)
             .filter(
                 Workout.user_id == user_id,
                 WorkoutSet.exercise_id == exercise_id,
@@ -65,8 +118,60 @@ def get_prs(user_id: int, db: Session = Depends(get_db)):
     return prs
 
 
+@router.get("/{user_id}/muscle-volume", response_model=MuscleVolumeOut)
+def get_muscle_volume(
+    user_id: int,
+    from_: date | None = Query(None, alias="from"),
+    to: date | None = None,
+    bucket: str = "week",
+    db: Session = Depends(get_db),
+):
+    SET_WRITE_BUFFER.flush()
+    if bucket not in VOLUME_BUCKETS:
+        raise HTTPException(status_code=422, detail="bucket must be week or month")
+    history_version = get_history_version(db, user_id)
+    if history_version is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    to = to or datetime.utcnow().date()
+    if from_ is None:
+        from_ = to - timedelta(days=(7 if bucket == "week" else 31) * (DEFAULT_VOLUME_PERIODS - 1))
+    if from_ > to:
+        raise HTTPException(status_code=422, detail="from must be before to")
+    starts = [bucket_range(bucket, from_)[0]]
+    while (next_start := bucket_range(bucket, starts[-1])[1]) <= to:
+        starts.append(next_start)
+    end = bucket_range(bucket, to)[1]
+
+    closed_before = history_cutoff().date()
+    periods: dict[date, list[MuscleGroupVolume]] = {}
+    for start in starts:
+        if bucket_range(bucket, start)[1] > closed_before:
+            break
+        cached = VOLUME_CACHE.get((user_id, bucket, start, history_version))
+        if cached is None:
+            break
+        periods[start] = cached
+
+    # Everything after the cached prefix (missing closed periods and open ones) in one query
+    remaining = [start for start in starts if start not in periods]
+    if remaining:
+        computed = _muscle_volume_by_period(db, user_id, bucket, remaining[0], end)
+        for start in remaining:
+            periods[start] = computed.get(start, [])
+            if bucket_range(bucket, start)[1] <= closed_before:
+                VOLUME_CACHE.set((user_id, bucket, start, history_version), periods[start])
+
+    return MuscleVolumeOut(
+        user_id=user_id,
+        bucket=bucket,
+        periods=[MuscleVolumePeriod(period_start=start, groups=periods[start]) for start in starts],
+    )
+
+
 @router.get("/{user_id}/exercise/{exercise_id}", response_model=ExerciseProgress)
 def get_exercise_progress(user_id: int, exercise_id: int, db: Session = Depends(get_db)):
+    SET_WRITE_BUFFER.flush()
     user = db.query(User).filter(User.id == user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
@@ -76,9 +181,10 @@ def get_exercise_progress(user_id: int, exercise_id: int, db: Session = Depends(
         raise HTTPException(status_code=404, detail="Exercise not found")
 
     # Group sets by workout date
+    Workout, WorkoutSet = history_models(db)
     workouts_with_sets = (
         db.query(Workout)
-        .join(WorkoutSet)
+        .join(WorkoutSet, WorkoutSet.workout_id == Workout.id)
         .filter(
             Workout.user_id == user_id,
             WorkoutSet.exercise_id == exercise_id,
@@ -1,13 +1,24 @@
+import os
+
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 
+from archive import restore_set_workout
 from database import get_db
 from models import WorkoutSet, Exercise
-from routers.exercises import exercise_photo_url
+from routers.exercises import exercise_photo_url, record_usage
 from schemas import SetOut, SetUpdate
+from write_buffer import CoalescingBuffer
+from write_queue import WRITE_QUEUE
 
 router = APIRouter(prefix="/sets", tags=["sets"])
 
+# Opt-in: PATCHes to the same set within this window are merged into one UPDATE.
+# The buffer is per process, which matches the single-worker deployment; edits still
+# inside the window are lost if the process crashes. Reads that aggregate sets (PRs,
+# stats, dashboard, insights, compare, workout lists) flush it first.
+SET_COALESCE_MS = int(os.getenv("FITCOUPLE_SET_COALESCE_MS", "0"))
+
 
 def _set_to_out(s: WorkoutSet) -> SetOut:
     return SetOut(
@@ -30,11 +41,19 @@ def _set_to_out(s: WorkoutSet) -> SetOut:
     )
 
 
-@router.patch("/{set_id}", response_model=SetOut)
-def update_set(set_id: int, payload: SetUpdate, db: Session = Depends(get_db)):
+def get_writable_set(db: Session, set_id: int) -> WorkoutSet:
+    """The set a write targets, its workout moved back to the hot tables first if it was archived."""
     ws = db.query(WorkoutSet).filter(WorkoutSet.id == set_id).first()
+    if not ws and restore_set_workout(db, set_id):
+        ws = db.query(WorkoutSet).filter(WorkoutSet.id == set_id).first()
     if not ws:
         raise HTTPException(status_code=404, detail="Set not found")
+    return ws
+
+
+def apply_set_update(db: Session, set_id: int, payload: SetUpdate) -> WorkoutSet:
+    """Apply a partial update in the caller's transaction."""
+    ws = get_writable_set(db, set_id)
     if payload.weight_kg is not None:
         ws.weight_kg = payload.weight_kg
     if payload.reps is not None:
@@ -51,16 +70,54 @@ def update_set(set_id: int, payload: SetUpdate, db: Session = Depends(get_db)):
         ws.notes = payload.notes
     if payload.status is not None:
         ws.status = payload.status
-    db.commit()
-    db.refresh(ws)
-    return _set_to_out(ws)
+    db.flush()
+    return ws
 
 
-@router.delete("/{set_id}", status_code=200)
-def delete_set(set_id: int, db: Session = Depends(get_db)):
-    ws = db.query(WorkoutSet).filter(WorkoutSet.id == set_id).first()
-    if not ws:
-        raise HTTPException(status_code=404, detail="Set not found")
+def _write_buffered_sets(changes: dict[int, dict]):
+    def write(db: Session):
+        for set_id, fields in changes.items():
+            ws = db.get(WorkoutSet, set_id)
+            if ws is None and restore_set_workout(db, set_id):
+                ws = db.get(WorkoutSet, set_id)  # archived since it was buffered, written back like a PATCH
+            if ws is None:
+                continue  # deleted since, the delete wins
+            for name, value in fields.items():
+                setattr(ws, name, value)
+        db.flush()
+
+    WRITE_QUEUE.run(write)
+
+
+SET_WRITE_BUFFER = CoalescingBuffer(SET_COALESCE_MS / 1000, _write_buffered_sets)
+
+
+def remove_set(db: Session, set_id: int):
+    ws = get_writable_set(db, set_id)
+    record_usage(db, ws.workout.user_id, {ws.exercise_id: -1})
     db.delete(ws)
-    db.commit()
+    db.flush()
+
+
+@router.patch("/{set_id}", response_model=SetOut)
+def update_set(set_id: int, payload: SetUpdate, db: Session = Depends(get_db)):
+    if SET_WRITE_BUFFER.enabled:
+        def load():
+            ws = db.query(WorkoutSet).filter(WorkoutSet.id == set_id).first()
+            if not ws:
+                raise LookupError(set_id)  # missing or archived: written directly below
+            return ws.workout_id, _set_to_out(ws)
+
+        # Returned as it will be once written; reads of the workout flush first
+        try:
+            return SET_WRITE_BUFFER.update(set_id, payload.model_dump(exclude_none=True), load)
+        except LookupError:
+            pass
+    return WRITE_QUEUE.run(lambda db: _set_to_out(apply_set_update(db, set_id, payload)))
+
+
+@router.delete("/{set_id}", status_code=200)
+def delete_set(set_id: int):
+    SET_WRITE_BUFFER.flush(row_ids={set_id})
+    WRITE_QUEUE.run(lambda db: remove_set(db, set_id))
     return {"ok": True}
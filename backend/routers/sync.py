@@ -0,0 +1,20 @@
+from fastapi import APIRouter, Depends
+from sqlalchemy.orm import Session
+
+from change_log import DEFAULT_SYNC_LIMIT, MAX_SYNC_LIMIT, changes_since
+from database import get_db
+from routers.sets import SET_WRITE_BUFFER
+from schemas import SyncOut
+
+router = APIRouter(prefix="/sync", tags=["sync"])
+
+
+@router.get("", response_model=SyncOut)
+def sync(since: int = 0, limit: int = DEFAULT_SYNC_LIMIT, db: Session = Depends(get_db)):
+    """Rows inserted, updated or deleted after the `since` cursor, across every synced table.
+
+    Start from 0 for a full snapshot, then keep passing back the returned cursor;
+    follow up immediately while has_more is true.
+    """
+    SET_WRITE_BUFFER.flush()
+    return changes_since(db, max(since, 0), min(max(limit, 1), MAX_SYNC_LIMIT))
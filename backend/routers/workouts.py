@@ -1,21 +1,37 @@
-from datetime import datetime
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta
 import csv
 import io
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from fastapi.responses import StreamingResponse
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy.orm import Session, joinedload, selectinload
+from sqlalchemy import func, select
 
+from archive import find_workout, history_models, newest_workouts, reaches_archive, restore_workout
+from bulk_delete import remove_workouts
 from database import get_db
-from models import Workout, WorkoutSet, Exercise, User
-from routers.exercises import exercise_photo_url
+from models import Workout, WorkoutHistory, WorkoutSet, WorkoutSetHistory, Exercise, User
+from notes_search import decode_cursor, encode_cursor, search_terms, search_workouts
+from routers.exercises import exercise_photo_url, record_usage
+from routers.sets import SET_WRITE_BUFFER
 from schemas import (
     WorkoutOut, WorkoutDetail, WorkoutCreate, WorkoutUpdate,
-    SetOut, SetCreate,
+    SetOut, SetCreate, ExerciseSuggestionOut, WorkoutSearchHit, WorkoutSearchPage,
 )
+from write_queue import WRITE_QUEUE
 
 router = APIRouter(prefix="/workouts", tags=["workouts"])
 
+SUGGESTION_HISTORY_SETS = 5
+MAX_SUGGESTION_HISTORY_SETS = 20
+REP_RANGE_BOTTOM = 8
+REP_RANGE_TOP = 12
+WEIGHT_STEP_KG = 2.5
+LIGHT_WEIGHT_STEP_KG = 1.0  # dumbbell / isolation loads below LIGHT_WEIGHT_KG
+LIGHT_WEIGHT_KG = 20
+DELOAD_FACTOR = 0.9
+MAX_SEARCH_RESULTS = 50
+
 
 def _workout_to_out(w: Workout) -> WorkoutOut:
     exercise_ids = {s.exercise_id for s in w.sets}
@@ -61,6 +77,94 @@ def _set_to_out(s: WorkoutSet) -> SetOut:
     )
 
 
+def _round_weight(weight_kg: float) -> float:
+    return round(weight_kg * 2) / 2
+
+
+def _recent_done_sets(
+    db: Session,
+    user_id: int,
+    exercise_ids: list[int],
+    exclude_workout_id: int,
+    per_exercise: int,
+    models=(Workout, WorkoutSet),
+) -> dict[int, list[WorkoutSet]]:
+    """Last `per_exercise` done sets of each exercise, newest first, in a single windowed query."""
+    Workout, WorkoutSet = models
+    ranked = (
+        select(
+            WorkoutSet.id,
+            func.row_number().over(
+                partition_by=WorkoutSet.exercise_id,
+                order_by=(WorkoutSet.logged_at.desc(), WorkoutSet.id.desc()),
+            ).label("rn"),
+        )
+        .join(Workout, WorkoutSet.workout_id == Workout.id)
+        .where(
+            Workout.user_id == user_id,
+            WorkoutSet.exercise_id.in_(exercise_ids),
+            WorkoutSet.status == "done",
+            WorkoutSet.workout_id != exclude_workout_id,
+        )
+        .subquery()
+    )
+    rows = (
+        db.query(WorkoutSet)
+        .join(ranked, ranked.c.id == WorkoutSet.id)
+        .filter(ranked.c.rn <= per_exercise)
+        .options(joinedload(WorkoutSet.exercise))
+        .order_by(WorkoutSet.logged_at.desc(), WorkoutSet.id.desc())
+        .all()
+    )
+    by_exercise = defaultdict(list)
+    for s in rows:
+        by_exercise[s.exercise_id].append(s)
+    return by_exercise
+
+
+def suggest_next_set(history: list[WorkoutSet]) -> tuple[float | None, int | None, str]:
+    """Double progression on the last session's top sets, driven by RPE when it was logged.
+
+    `history` is newest first. Returns (weight_kg, reps, rule).
+    """
+    if not history:
+        return None, None, "first_time"
+    last_session = [s for s in history if s.workout_id == history[0].workout_id]
+    earlier = [s for s in history if s.workout_id != history[0].workout_id]
+    if all(s.reps is None for s in last_session):
+        return None, None, "none"  # cardio / timed work
+    rpe_values = [s.rpe for s in last_session if s.rpe]
+
+    weighted = [s for s in last_session if s.weight_kg]
+    if not weighted:
+        reps = max(s.reps or 0 for s in last_session)
+        if rpe_values and max(rpe_values) >= 9:
+            return None, reps, "repeat"
+        return None, reps + 1, "add_rep"
+
+    top_weight = max(s.weight_kg for s in weighted)
+    top_sets = [s for s in weighted if s.weight_kg == top_weight and s.reps]
+    if not top_sets:
+        return top_weight, None, "repeat"
+    reps = min(s.reps for s in top_sets)
+    rpe_values = [s.rpe for s in top_sets if s.rpe]
+    rpe = max(rpe_values) if rpe_values else None
+    step = LIGHT_WEIGHT_STEP_KG if top_weight < LIGHT_WEIGHT_KG else WEIGHT_STEP_KG
+
+    if rpe is not None and rpe <= 7:
+        return top_weight + step, reps, "increase_weight"
+    if rpe is None or rpe == 8:
+        if reps >= REP_RANGE_TOP:
+            return top_weight + step, REP_RANGE_BOTTOM, "increase_weight"
+        return top_weight, reps + 1, "add_rep"
+    if rpe >= 10:
+        # Max effort and fewer reps than an earlier session at the same load: back off
+        earlier_reps = [s.reps for s in earlier if s.weight_kg == top_weight and s.reps]
+        if earlier_reps and reps < max(earlier_reps):
+            return _round_weight(top_weight * DELOAD_FACTOR), max(earlier_reps), "deload"
+    return top_weight, reps, "repeat"
+
+
 @router.get("", response_model=list[WorkoutOut])
 def get_workouts(
     user_id: int,
@@ -68,19 +172,24 @@ def get_workouts(
     offset: int = 0,
     db: Session = Depends(get_db),
 ):
-    workouts = (
-        db.query(Workout)
-        .filter(Workout.user_id == user_id)
-        .order_by(Workout.started_at.desc())
-        .offset(offset)
-        .limit(limit)
-        .all()
+    workouts = newest_workouts(
+        db,
+        lambda Workout: (
+            db.query(Workout)
+            .filter(Workout.user_id == user_id)
+            .order_by(Workout.started_at.desc())
+            .offset(offset)
+            .limit(limit)
+            .all()
+        ),
+        limit,
+        "started_at",
     )
     return [_workout_to_out(w) for w in workouts]
 
 
-@router.post("", response_model=WorkoutOut, status_code=201)
-def create_workout(payload: WorkoutCreate, db: Session = Depends(get_db)):
+def insert_workout(db: Session, payload: WorkoutCreate) -> Workout:
+    """Create a workout (cloning the template's sets as pending) in the caller's transaction."""
     user = db.query(User).filter(User.id == payload.user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
@@ -93,7 +202,7 @@ def create_workout(payload: WorkoutCreate, db: Session = Depends(get_db)):
     db.flush()  # get workout.id before commit
 
     if payload.template_id:
-        template = db.query(Workout).filter(Workout.id == payload.template_id).first()
+        template = find_workout(db, payload.template_id)
         if template:
             for s in _sort_sets(template.sets):
                 copied = WorkoutSet(
@@ -109,24 +218,36 @@ def create_workout(payload: WorkoutCreate, db: Session = Depends(get_db)):
                     status="pending",
                 )
                 db.add(copied)
+            record_usage(db, workout.user_id, Counter(s.exercise_id for s in template.sets), datetime.utcnow())
+            db.flush()
+    return workout
 
-    db.commit()
-    db.refresh(workout)
-    return _workout_to_out(workout)
+
+@router.post("", response_model=WorkoutOut, status_code=201)
+def create_workout(payload: WorkoutCreate):
+    return WRITE_QUEUE.run(lambda db: _workout_to_out(insert_workout(db, payload)))
 
 
 @router.get("/last", response_model=WorkoutDetail)
 def get_last_workout(user_id: int, type: str, db: Session = Depends(get_db)):
-    workout = (
-        db.query(Workout)
-        .filter(
-            Workout.user_id == user_id,
-            Workout.type == type,
-            Workout.completed_at.isnot(None),
-        )
-        .order_by(Workout.started_at.desc())
-        .first()
+    SET_WRITE_BUFFER.flush()
+    latest = newest_workouts(
+        db,
+        lambda Workout: (
+            db.query(Workout)
+            .filter(
+                Workout.user_id == user_id,
+                Workout.type == type,
+                Workout.completed_at.isnot(None),
+            )
+            .order_by(Workout.started_at.desc())
+            .limit(1)
+            .all()
+        ),
+        1,
+        "started_at",
     )
+    workout = latest[0] if latest else None
     if not workout:
         raise HTTPException(status_code=404, detail="No previous workout of this type")
     return WorkoutDetail(
@@ -143,8 +264,11 @@ def get_last_workout(user_id: int, type: str, db: Session = Depends(get_db)):
 
 @router.get("/export")
 def export_workouts(user_id: int, db: Session = Depends(get_db)):
+    SET_WRITE_BUFFER.flush()
+    Workout, WorkoutSet = history_models(db)
     workouts = (
         db.query(Workout)
+        .options(selectinload(Workout.sets).joinedload(WorkoutSet.exercise))
         .filter(Workout.user_id == user_id, Workout.completed_at.isnot(None))
         .order_by(Workout.completed_at.desc())
         .all()
@@ -175,23 +299,56 @@ def export_workouts(user_id: int, db: Session = Depends(get_db)):
     )
 
 
+@router.get("/search", response_model=WorkoutSearchPage)
+def search_workout_notes(
+    user_id: int,
+    q: str,
+    limit: int = 20,
+    cursor: str | None = None,
+    db: Session = Depends(get_db),
+):
+    """Ranked full-text search over workout names, workout notes and set notes."""
+    terms = search_terms(q)
+    if not terms:
+        return WorkoutSearchPage(results=[])
+    after = None
+    if cursor:
+        after = decode_cursor(cursor)
+        if after is None:
+            raise HTTPException(status_code=422, detail="Invalid cursor")
+    limit = min(max(limit, 1), MAX_SEARCH_RESULTS)
+    hits = search_workouts(db, user_id, terms, after, limit + 1)
+    next_cursor = None
+    if len(hits) > limit:
+        hits = hits[:limit]
+        next_cursor = encode_cursor(hits[-1]["score"], hits[-1]["workout_id"])
+    return WorkoutSearchPage(results=[WorkoutSearchHit(**hit) for hit in hits], next_cursor=next_cursor)
+
+
 @router.get("/{workout_id}/previous", response_model=WorkoutDetail)
 def get_previous_workout(workout_id: int, db: Session = Depends(get_db)):
-    workout = db.query(Workout).filter(Workout.id == workout_id).first()
+    workout = find_workout(db, workout_id)
     if not workout:
         raise HTTPException(status_code=404, detail="Workout not found")
-    previous = (
-        db.query(Workout)
-        .filter(
-            Workout.user_id == workout.user_id,
-            Workout.type == workout.type,
-            Workout.completed_at.isnot(None),
-            Workout.id != workout_id,
-            Workout.started_at < workout.started_at,
-        )
-        .order_by(Workout.started_at.desc())
-        .first()
+    earlier = newest_workouts(
+        db,
+        lambda Workout: (
+            db.query(Workout)
+            .filter(
+                Workout.user_id == workout.user_id,
+                Workout.type == workout.type,
+                Workout.completed_at.isnot(None),
+                Workout.id != workout_id,
+                Workout.started_at < workout.started_at,
+            )
+            .order_by(Workout.started_at.desc())
+            .limit(1)
+            .all()
+        ),
+        1,
+        "started_at",
     )
+    previous = earlier[0] if earlier else None
     if not previous:
         raise HTTPException(status_code=404, detail="No previous workout of this type")
     return WorkoutDetail(
@@ -206,9 +363,54 @@ def get_previous_workout(workout_id: int, db: Session = Depends(get_db)):
     )
 
 
+@router.get("/{workout_id}/suggestions", response_model=list[ExerciseSuggestionOut])
+def get_workout_suggestions(
+    workout_id: int,
+    history: int = SUGGESTION_HISTORY_SETS,
+    db: Session = Depends(get_db),
+):
+    """Previous done sets and a next-set target for every exercise of the workout."""
+    SET_WRITE_BUFFER.flush(group=workout_id)
+    workout = find_workout(db, workout_id, eager_sets=True)
+    if not workout:
+        raise HTTPException(status_code=404, detail="Workout not found")
+    exercises = {}
+    for s in _sort_sets(workout.sets):
+        exercises.setdefault(s.exercise_id, s.exercise)
+    if not exercises:
+        return []
+
+    per_exercise = min(max(history, 1), MAX_SUGGESTION_HISTORY_SETS)
+    recent = _recent_done_sets(db, workout.user_id, list(exercises), workout.id, per_exercise)
+    # Older sets are only needed when some exercise's hot history is short or reaches the archive
+    full = all(len(recent.get(eid, [])) == per_exercise for eid in exercises)
+    oldest = min(sets[-1].logged_at for sets in recent.values()) if full else None
+    if reaches_archive(db, oldest):
+        recent = _recent_done_sets(
+            db, workout.user_id, list(exercises), workout.id, per_exercise,
+            models=(WorkoutHistory, WorkoutSetHistory),
+        )
+    suggestions = []
+    for exercise_id, exercise in exercises.items():
+        last_sets = recent.get(exercise_id, [])
+        weight_kg, reps, rule = suggest_next_set(last_sets)
+        suggestions.append(ExerciseSuggestionOut(
+            exercise_id=exercise_id,
+            exercise_name=exercise.name,
+            exercise_photo_url=exercise_photo_url(exercise_id, exercise.photo_filename),
+            last_performed_at=last_sets[0].logged_at if last_sets else None,
+            last_sets=[_set_to_out(s) for s in last_sets],
+            suggested_weight_kg=weight_kg,
+            suggested_reps=reps,
+            rule=rule,
+        ))
+    return suggestions
+
+
 @router.get("/{workout_id}", response_model=WorkoutDetail)
 def get_workout(workout_id: int, db: Session = Depends(get_db)):
-    workout = db.query(Workout).filter(Workout.id == workout_id).first()
+    SET_WRITE_BUFFER.flush(group=workout_id)
+    workout = find_workout(db, workout_id)
     if not workout:
         raise HTTPException(status_code=404, detail="Workout not found")
     return WorkoutDetail(
@@ -223,37 +425,74 @@ def get_workout(workout_id: int, db: Session = Depends(get_db)):
     )
 
 
-@router.patch("/{workout_id}", response_model=WorkoutOut)
-def update_workout(workout_id: int, payload: WorkoutUpdate, db: Session = Depends(get_db)):
+def get_writable_workout(db: Session, workout_id: int) -> Workout:
+    """The workout a write targets, moved back to the hot tables first if it was archived."""
     workout = db.query(Workout).filter(Workout.id == workout_id).first()
+    if not workout and restore_workout(db, workout_id):
+        workout = db.query(Workout).filter(Workout.id == workout_id).first()
     if not workout:
         raise HTTPException(status_code=404, detail="Workout not found")
+    return workout
+
+
+def apply_workout_update(db: Session, workout_id: int, payload: WorkoutUpdate) -> Workout:
+    """Apply a partial update in the caller's transaction."""
+    workout = get_writable_workout(db, workout_id)
     if payload.completed_at is not None:
         workout.completed_at = payload.completed_at
     if payload.notes is not None:
         workout.notes = payload.notes
     if payload.name is not None:
         workout.name = payload.name
-    db.commit()
-    db.refresh(workout)
-    return _workout_to_out(workout)
+    db.flush()
+    return workout
 
 
-@router.delete("/{workout_id}", status_code=200)
-def delete_workout(workout_id: int, db: Session = Depends(get_db)):
-    workout = db.query(Workout).filter(Workout.id == workout_id).first()
-    if not workout:
+@router.patch("/{workout_id}", response_model=WorkoutOut)
+def update_workout(workout_id: int, payload: WorkoutUpdate):
+    return WRITE_QUEUE.run(lambda db: _workout_to_out(apply_workout_update(db, workout_id, payload)))
+
+
+def remove_workout(db: Session, workout_id: int):
+    """Delete a workout, hot or archived, and its sets (by cascade) in one statement."""
+    deleted, _sets = remove_workouts(db, lambda Workout: [Workout.id == workout_id])
+    if not deleted:
         raise HTTPException(status_code=404, detail="Workout not found")
-    db.delete(workout)
-    db.commit()
+
+
+@router.delete("/{workout_id}", status_code=200)
+def delete_workout(workout_id: int):
+    SET_WRITE_BUFFER.flush(group=workout_id)
+    WRITE_QUEUE.run(lambda db: remove_workout(db, workout_id))
     return {"ok": True}
 
 
-@router.post("/{workout_id}/sets", response_model=SetOut, status_code=201)
-def add_set(workout_id: int, payload: SetCreate, db: Session = Depends(get_db)):
-    workout = db.query(Workout).filter(Workout.id == workout_id).first()
-    if not workout:
-        raise HTTPException(status_code=404, detail="Workout not found")
+@router.delete("", status_code=200)
+def delete_workouts(
+    user_id: int,
+    from_: date | None = Query(None, alias="from"),
+    to: date | None = None,
+):
+    """Delete a user's workouts started in [from, to], all of them without bounds."""
+    if from_ and to and from_ > to:
+        raise HTTPException(status_code=422, detail="from must be before to")
+
+    def where(Workout):
+        criteria = [Workout.user_id == user_id]
+        if from_:
+            criteria.append(Workout.started_at >= datetime.combine(from_, datetime.min.time()))
+        if to:
+            criteria.append(Workout.started_at < datetime.combine(to + timedelta(days=1), datetime.min.time()))
+        return criteria
+
+    SET_WRITE_BUFFER.flush()
+    workouts, sets = WRITE_QUEUE.run(lambda db: remove_workouts(db, where))
+    return {"ok": True, "deleted_workouts": workouts, "deleted_sets": sets}
+
+
+def insert_set(db: Session, workout_id: int, payload: SetCreate) -> WorkoutSet:
+    """Log a set in the caller's transaction."""
+    workout = get_writable_workout(db, workout_id)
     exercise = db.query(Exercise).filter(Exercise.id == payload.exercise_id).first()
     if not exercise:
         raise HTTPException(status_code=404, detail="Exercise not found")
@@ -267,9 +506,15 @@ def add_set(workout_id: int, payload: SetCreate, db: Session = Depends(get_db)):
         duration_seconds=payload.duration_seconds,
         resistance=payload.resistance,
         calories=payload.calories,
+        notes=payload.notes,
         status=payload.status,
     )
     db.add(ws)
-    db.commit()
-    db.refresh(ws)
-    return _set_to_out(ws)
+    db.flush()
+    record_usage(db, workout.user_id, {ws.exercise_id: 1}, ws.logged_at)
+    return ws
+
+
+@router.post("/{workout_id}/sets", response_model=SetOut, status_code=201)
+def add_set(workout_id: int, payload: SetCreate):
+    return WRITE_QUEUE.run(lambda db: _set_to_out(insert_set(db, workout_id, payload)))
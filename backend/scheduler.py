@@ -0,0 +1,326 @@
+import logging
+import os
+import socket
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Callable
+from uuid import uuid4
+
+from sqlalchemy import or_, text, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from database import DEFAULT_HOUSEHOLD, IS_SQLITE, SessionLocal, household_context, households, upsert
+from models import SchedulerJobRun, SchedulerLock, User
+
+logger = logging.getLogger("fitcouple.scheduler")
+
+SCHEDULER_ENABLED = os.getenv("FITCOUPLE_SCHEDULER", "1") != "0"
+LOCK_NAME = "background-scheduler"
+LOCK_TTL = timedelta(minutes=2)
+HEARTBEAT_SECONDS = 30  # well inside LOCK_TTL
+TICK_SECONDS = 30
+IDLE_SECONDS = 60
+NIGHTLY_HOUR_UTC = 3
+
+
+@dataclass
+class Job:
+    name: str
+    func: Callable[["Scheduler", Session], None]
+    every: timedelta | None = None  # interval jobs
+    at_hour: int | None = None  # daily jobs, hour in UTC
+    idle_only: bool = True
+    per_household: bool = True  # run once against every household's database
+    last_started_at: datetime | None = None
+    last_finished_at: datetime | None = None
+    last_error: str | None = None
+    run_count: int = 0
+    running: bool = False
+
+    def is_due(self, now: datetime) -> bool:
+        if self.at_hour is not None:
+            ran_today = self.last_started_at is not None and self.last_started_at.date() == now.date()
+            return now.hour >= self.at_hour and not ran_today
+        if self.every is not None:
+            return self.last_started_at is None or now - self.last_started_at >= self.every
+        return False
+
+    def next_run_at(self, now: datetime) -> datetime | None:
+        if self.at_hour is not None:
+            today_run = now.replace(hour=self.at_hour, minute=0, second=0, microsecond=0)
+            if self.last_started_at is not None and self.last_started_at.date() == now.date():
+                return today_run + timedelta(days=1)
+            return max(today_run, now)
+        if self.every is not None:
+            return (self.last_started_at + self.every) if self.last_started_at else now
+        return None
+
+
+@dataclass
+class Scheduler:
+    """In-process background job runner; one leader across uvicorn workers via a lock row."""
+
+    jobs: dict[str, Job] = field(default_factory=dict)
+    owner: str = field(default_factory=lambda: f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}")
+    is_leader: bool = False
+    _stop: threading.Event = field(default_factory=threading.Event)
+    _thread: threading.Thread | None = None
+    _heartbeat_thread: threading.Thread | None = None
+    _last_activity: float = field(default_factory=time.monotonic)
+
+    def add_job(self, job: Job):
+        self.jobs[job.name] = job
+
+    def note_activity(self):
+        self._last_activity = time.monotonic()
+
+    def is_idle(self) -> bool:
+        return time.monotonic() - self._last_activity >= IDLE_SECONDS
+
+    @property
+    def cancelled(self) -> bool:
+        return self._stop.is_set()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._heartbeat_thread = threading.Thread(target=self._heartbeat, name="fitcouple-scheduler-lock", daemon=True)
+        self._heartbeat_thread.start()
+        self._thread = threading.Thread(target=self._run, name="fitcouple-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        self._stop.set()
+        for thread in (self._heartbeat_thread, self._thread):
+            if thread is not None:
+                thread.join(timeout)
+        self._thread = self._heartbeat_thread = None
+        if self.is_leader:
+            self._release_lock()
+
+    # ─── Leader election ─────────────────────────────────────────────────────
+
+    def _acquire_lock(self) -> bool:
+        now = datetime.utcnow()
+        db = SessionLocal()
+        try:
+            claimed = db.execute(
+                update(SchedulerLock)
+                .where(
+                    SchedulerLock.name == LOCK_NAME,
+                    or_(SchedulerLock.owner == self.owner, SchedulerLock.heartbeat_at < now - LOCK_TTL),
+                )
+                .values(owner=self.owner, heartbeat_at=now)
+            ).rowcount
+            if not claimed:
+                db.add(SchedulerLock(name=LOCK_NAME, owner=self.owner, heartbeat_at=now))
+                try:
+                    db.flush()
+                except IntegrityError:
+                    db.rollback()
+                    return False
+            db.commit()
+            return True
+        finally:
+            db.close()
+
+    def _release_lock(self):
+        db = SessionLocal()
+        try:
+            db.query(SchedulerLock).filter(
+                SchedulerLock.name == LOCK_NAME,
+                SchedulerLock.owner == self.owner,
+            ).delete()
+            db.commit()
+        finally:
+            db.close()
+        self.is_leader = False
+
+    def _load_job_runs(self):
+        """Pick up the last starts recorded by earlier leaders, so at_hour jobs run once a day across restarts."""
+        db = SessionLocal(household=DEFAULT_HOUSEHOLD)
+        try:
+            for name, started_at in db.query(SchedulerJobRun.name, SchedulerJobRun.last_started_at):
+                job = self.jobs.get(name)
+                if job is not None and (job.last_started_at is None or started_at > job.last_started_at):
+                    job.last_started_at = started_at
+        finally:
+            db.close()
+
+    def _record_start(self, job: Job):
+        db = SessionLocal(household=DEFAULT_HOUSEHOLD)
+        try:
+            stmt = upsert(db, SchedulerJobRun).values(name=job.name, last_started_at=job.last_started_at)
+            db.execute(stmt.on_conflict_do_update(
+                index_elements=[SchedulerJobRun.name],
+                set_={"last_started_at": job.last_started_at},
+            ))
+            db.commit()
+        except Exception:
+            # The job still runs; a later leader may just repeat it
+            logger.exception("could not record the start of job %s", job.name)
+        finally:
+            db.close()
+
+    def _heartbeat(self):
+        # Renewed on its own thread: jobs run inline in _run and can outlast LOCK_TTL
+        while not self._stop.is_set():
+            try:
+                leader = self._acquire_lock()
+                if leader and not self.is_leader:
+                    self._load_job_runs()  # before _run sees the leadership
+                self.is_leader = leader
+            except Exception:
+                logger.exception("scheduler lock check failed")
+                self.is_leader = False
+            self._stop.wait(HEARTBEAT_SECONDS)
+
+    # ─── Worker loop ─────────────────────────────────────────────────────────
+
+    def _run(self):
+        while not self._stop.is_set():
+            for job in list(self.jobs.values()):
+                # Leadership is re-checked before every job: another worker may have taken over
+                if self._stop.is_set() or not self.is_leader:
+                    break
+                if job.is_due(datetime.utcnow()) and (not job.idle_only or self.is_idle()):
+                    self.run_job(job, as_leader=True)
+            self._stop.wait(TICK_SECONDS)
+
+    def run_job(self, job: Job, as_leader: bool = False):
+        """Run `job` now. `as_leader` (the worker loop) stops it between households once the lock is lost."""
+        job.running = True
+        job.last_started_at = datetime.utcnow()
+        errors = []
+        try:
+            self._record_start(job)
+            for household in households.known() if job.per_household else [DEFAULT_HOUSEHOLD]:
+                if self.cancelled:
+                    break
+                if as_leader and not self.is_leader:
+                    logger.warning("scheduler lock lost, job %s stopped before household %s", job.name, household)
+                    errors.append("scheduler lock lost")
+                    break
+                with household_context(household):
+                    db = SessionLocal()
+                    try:
+                        job.func(self, db)
+                        db.commit()
+                    except Exception as exc:
+                        db.rollback()
+                        errors.append(f"{household}: {type(exc).__name__}: {exc}")
+                        logger.exception("scheduled job %s failed for household %s", job.name, household)
+                    finally:
+                        db.close()
+            job.last_error = "; ".join(errors) or None
+        finally:
+            job.running = False
+            job.run_count += 1
+            job.last_finished_at = datetime.utcnow()
+
+
+# ─── Jobs ─────────────────────────────────────────────────────────────────────
+
+PRECOMPUTED_PROMPTS = [("weekly", "4w"), ("monthly", "1m")]
+
+
+def precompute_insight_prompts(scheduler: Scheduler, db: Session):
+    from routers.insights import cached_insight_prompt
+
+    for user in db.query(User).all():
+        for template, period in PRECOMPUTED_PROMPTS:
+            if scheduler.cancelled:
+                return
+            cached_insight_prompt(db, user, template, period)
+
+
+def backfill_rollups(scheduler: Scheduler, db: Session):
+    from routers.body_weight import backfill_weight_trends
+
+    backfill_weight_trends()
+
+
+def collect_photo_garbage(scheduler: Scheduler, db: Session):
+    from photo_store import collect_garbage, referenced_photos
+
+    # Photos are content-addressed and shared by every household's database
+    referenced = set()
+    for household in households.known():
+        household_db = SessionLocal(household=household)
+        try:
+            referenced |= referenced_photos(household_db)
+        finally:
+            household_db.close()
+    removed = collect_garbage(referenced)
+    if removed:
+        logger.info("photo GC removed %d unreferenced files", removed)
+
+
+def backfill_photo_variants(scheduler: Scheduler, db: Session):
+    from photo_store import generate_missing_variants
+
+    generate_missing_variants(db)
+
+
+def compact_sync_log(scheduler: Scheduler, db: Session):
+    from change_log import compact_change_log
+
+    removed = compact_change_log(db)
+    if removed:
+        logger.info("change log compaction removed %d superseded entries", removed)
+
+
+def purge_mutation_keys(scheduler: Scheduler, db: Session):
+    from routers.mutations import purge_processed_mutations
+
+    purge_processed_mutations(db)
+
+
+def archive_cold_workouts(scheduler: Scheduler, db: Session):
+    from archive import ARCHIVE_AFTER_DAYS, archive_old_workouts
+    from routers.sets import SET_WRITE_BUFFER
+    from write_queue import WRITE_QUEUE
+
+    if not ARCHIVE_AFTER_DAYS:
+        return
+    SET_WRITE_BUFFER.flush()
+    archived = archive_old_workouts(WRITE_QUEUE.run)
+    if archived:
+        logger.info("archived %d workouts completed over %d days ago", archived, ARCHIVE_AFTER_DAYS)
+
+
+def back_up_databases(scheduler: Scheduler, db: Session):
+    from backup import create_backup
+
+    manifest = create_backup()
+    logger.info(
+        "backup %s: %d databases, %d new photos, pruned %d old backups",
+        manifest["name"], len(manifest["databases"]), manifest["photos_copied"], len(manifest["pruned"]),
+    )
+
+
+def optimize_database(scheduler: Scheduler, db: Session):
+    if db.get_bind().dialect.name == "sqlite":  # PostgreSQL's autovacuum covers this
+        db.execute(text("PRAGMA optimize"))
+
+
+def analyze_database(scheduler: Scheduler, db: Session):
+    db.execute(text("ANALYZE"))
+
+
+scheduler = Scheduler()
+scheduler.add_job(Job("insight-prompts", precompute_insight_prompts, at_hour=NIGHTLY_HOUR_UTC))
+scheduler.add_job(Job("rollup-backfill", backfill_rollups, every=timedelta(hours=1)))
+scheduler.add_job(Job("photo-gc", collect_photo_garbage, every=timedelta(hours=6), per_household=False))
+scheduler.add_job(Job("photo-variants", backfill_photo_variants, every=timedelta(hours=6)))
+scheduler.add_job(Job("change-log-compact", compact_sync_log, every=timedelta(days=1)))
+scheduler.add_job(Job("mutation-key-ttl", purge_mutation_keys, every=timedelta(hours=6)))
+scheduler.add_job(Job("archive", archive_cold_workouts, at_hour=NIGHTLY_HOUR_UTC))
+if IS_SQLITE:
+    scheduler.add_job(Job("backup", back_up_databases, at_hour=NIGHTLY_HOUR_UTC, per_household=False))
+scheduler.add_job(Job("pragma-optimize", optimize_database, at_hour=NIGHTLY_HOUR_UTC))
+scheduler.add_job(Job("analyze", analyze_database, every=timedelta(days=7)))
@@ -1,6 +1,6 @@
-from datetime import datetime
-from typing import Optional
-from pydantic import BaseModel, model_validator
+from datetime import date, datetime
+from typing import Literal, Optional
+from pydantic import BaseModel, Field, model_validator
 
 
 # ─── Users ────────────────────────────────────────────────────────────────────
@@ -36,10 +36,15 @@ class ExerciseOut(BaseModel):
     created_by: Optional[int]
     photo_url: Optional[str] = None
     usage_count: int = 0
+    last_used_at: Optional[datetime] = None
 
     model_config = {"from_attributes": True}
 
 
+class ExerciseSearchResult(ExerciseOut):
+    score: float = 0.0
+
+
 class ExerciseCreate(BaseModel):
     name: str
     muscle_group: str
@@ -135,6 +140,31 @@ class WorkoutUpdate(BaseModel):
     name: Optional[str] = None
 
 
+class ExerciseSuggestionOut(BaseModel):
+    exercise_id: int
+    exercise_name: str
+    exercise_photo_url: Optional[str] = None
+    last_performed_at: Optional[datetime] = None
+    last_sets: list[SetOut]
+    suggested_weight_kg: Optional[float] = None
+    suggested_reps: Optional[int] = None
+    rule: str  # first_time | increase_weight | add_rep | repeat | deload | none
+
+
+class WorkoutSearchHit(BaseModel):
+    workout_id: int
+    type: str
+    name: Optional[str]
+    started_at: datetime
+    snippet: str  # HTML-escaped, matches wrapped in <mark>
+    score: float
+
+
+class WorkoutSearchPage(BaseModel):
+    results: list[WorkoutSearchHit]
+    next_cursor: Optional[str] = None
+
+
 # ─── Progress ─────────────────────────────────────────────────────────────────
 
 class PROut(BaseModel):
@@ -159,6 +189,24 @@ class ExerciseProgress(BaseModel):
     history: list[ProgressEntry]
 
 
+class MuscleGroupVolume(BaseModel):
+    muscle_group: str
+    sets: int
+    hard_sets: int  # RPE >= 8
+    volume_kg: float
+
+
+class MuscleVolumePeriod(BaseModel):
+    period_start: date
+    groups: list[MuscleGroupVolume]
+
+
+class MuscleVolumeOut(BaseModel):
+    user_id: int
+    bucket: str
+    periods: list[MuscleVolumePeriod]
+
+
 # ─── Boosts ───────────────────────────────────────────────────────────────────
 
 class BoostOut(BaseModel):
@@ -184,6 +232,7 @@ class BodyWeightOut(BaseModel):
     id: int
     user_id: int
     weight_kg: float
+    trend_kg: Optional[float] = None
     logged_at: datetime
 
     model_config = {"from_attributes": True}
@@ -195,6 +244,32 @@ class BodyWeightCreate(BaseModel):
     logged_at: Optional[datetime] = None
 
 
+class BodyWeightRollupOut(BaseModel):
+    period_start: date
+    count: int
+    avg_kg: float
+    min_kg: Optional[float]
+    max_kg: Optional[float]
+
+
+class BodyWeightTrendOut(BaseModel):
+    user_id: int
+    target_weight_kg: Optional[float]
+    current_trend_kg: Optional[float]
+    weekly_rate_kg: Optional[float]
+    remaining_kg: Optional[float]
+    weeks_to_target: Optional[float]
+    points: list[BodyWeightOut]
+    weekly: list[BodyWeightRollupOut]
+    monthly: list[BodyWeightRollupOut]
+
+
+class ImportResultOut(BaseModel):
+    inserted: int
+    skipped: int
+    invalid: int
+
+
 class BodyMeasurementOut(BaseModel):
     id: int
     user_id: int
@@ -260,6 +335,96 @@ class InsightPromptOut(BaseModel):
     prompt: str
 
 
+class TrainingLoadDay(BaseModel):
+    day: date
+    load: float
+    acute: float
+    chronic: float
+    acwr: Optional[float] = None
+    monotony: Optional[float] = None
+    strain: Optional[float] = None
+
+
+class TrainingLoadOut(BaseModel):
+    user_id: int
+    current: TrainingLoadDay
+    days: list[TrainingLoadDay]
+
+
+# ─── Compare ──────────────────────────────────────────────────────────────────
+
+class CompareWeek(BaseModel):
+    week_start: date
+    workouts: int
+    sets: int
+    volume_kg: float
+
+
+class CompareUser(BaseModel):
+    user_id: int
+    name: str
+    theme_key: str
+    total_workouts: int
+    total_volume_kg: float
+    current_streak: int
+    longest_streak: int
+    weeks: list[CompareWeek]
+
+
+class ComparePR(BaseModel):
+    user_id: int
+    weight_kg: float
+    reps: Optional[int] = None
+
+
+class SharedExercisePR(BaseModel):
+    exercise_id: int
+    exercise_name: str
+    muscle_group: str
+    prs: list[ComparePR]
+
+
+class CompareOut(BaseModel):
+    from_date: date
+    to_date: date
+    users: list[CompareUser]
+    shared_prs: list[SharedExercisePR]
+
+
+# ─── Sync ─────────────────────────────────────────────────────────────────────
+
+class SyncOut(BaseModel):
+    cursor: int  # pass back as ?since= for the next page
+    has_more: bool
+    changes: dict[str, list[dict]]  # table -> current rows inserted or updated since the cursor
+    deleted: dict[str, list[int]]  # table -> ids deleted since the cursor
+
+
+# ─── Batched mutations ────────────────────────────────────────────────────────
+
+class MutationIn(BaseModel):
+    key: str = Field(min_length=1, max_length=128)  # client-generated idempotency key
+    op: Literal["create_workout", "update_workout", "add_set", "update_set", "delete_set"]
+    args: dict = {}
+
+
+class MutationBatchIn(BaseModel):
+    operations: list[MutationIn] = Field(max_length=500)
+
+
+class MutationResultOut(BaseModel):
+    key: str
+    op: str
+    status: str  # applied | replayed | error
+    status_code: int
+    result: Optional[dict] = None
+    error: Optional[str] = None
+
+
+class MutationBatchOut(BaseModel):
+    results: list[MutationResultOut]
+
+
 # ─── Favorites ────────────────────────────────────────────────────────────────
 
 class FavoriteOut(BaseModel):
@@ -276,3 +441,55 @@ class FavoriteCreate(BaseModel):
     user_id: int
     name: str
     workout_type: str
+
+
+# ─── Admin ────────────────────────────────────────────────────────────────────
+
+class JobStatusOut(BaseModel):
+    name: str
+    running: bool
+    run_count: int
+    last_started_at: Optional[datetime]
+    last_finished_at: Optional[datetime]
+    last_error: Optional[str]
+    next_run_at: Optional[datetime]
+
+
+class SchedulerStatusOut(BaseModel):
+    owner: str
+    is_leader: bool
+    jobs: list[JobStatusOut]
+
+
+class HouseholdMemberIn(BaseModel):
+    name: str = Field(min_length=1, max_length=64)
+    theme_key: str = Field(min_length=1, max_length=32)
+
+
+class HouseholdCreate(BaseModel):
+    name: str
+    users: list[HouseholdMemberIn] = Field(min_length=1, max_length=8)
+
+
+class HouseholdOut(BaseModel):
+    name: str
+    users: list[UserOut]
+    token: str  # X-Household-Token, shown only once
+
+
+class BackupDatabaseOut(BaseModel):
+    file: str
+    bytes: int
+    compressed_bytes: int
+    pages: int
+    steps: int
+    seconds: float
+
+
+class BackupOut(BaseModel):
+    name: str
+    created_at: datetime
+    databases: dict[str, BackupDatabaseOut]
+    photos_copied: int
+    photo_count: int
+    pruned: list[str]
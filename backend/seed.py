@@ -1,4 +1,4 @@
-from database import SessionLocal
+from database import DEFAULT_HOUSEHOLD, SessionLocal, current_household, households
 from models import User, Exercise
 
 PREDEFINED_EXERCISES = [
@@ -113,7 +113,8 @@ USERS = [
 def seed_initial_data():
     db = SessionLocal()
     try:
-        if db.query(User).count() == 0:
+        # The original couple only lives in the default household; others bring their own (create_household)
+        if current_household.get() == DEFAULT_HOUSEHOLD and db.query(User).count() == 0:
             for u in USERS:
                 db.add(User(name=u["name"], theme_key=u["theme_key"]))
             db.commit()
@@ -134,3 +135,22 @@ def seed_initial_data():
             db.commit()
     finally:
         db.close()
+
+
+def create_household(household: str, users: list[dict]) -> tuple[list[User], str]:
+    """Provision a household with its members ({"name", "theme_key"}); the exercise catalog is seeded as usual.
+
+    Returns the members and the household's access token, which is only ever shown here.
+    """
+    households.create(household)
+    db = SessionLocal(household=household)
+    try:
+        members = [User(name=u["name"], theme_key=u["theme_key"]) for u in users]
+        db.add_all(members)
+        db.commit()
+        for member in members:
+            db.refresh(member)
+        db.expunge_all()
+    finally:
+        db.close()
+    return members, households.issue_token(household)
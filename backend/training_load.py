@@ -0,0 +1,191 @@
+import math
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import case, event, func, select
+from sqlalchemy.orm import Session
+
+from archive import history_models
+from cache import LRUCache, get_data_version
+from database import SessionLocal, date_bucket, upsert
+from models import DailyLoad, Workout, WorkoutSet
+
+# Load is in arbitrary units (AU), session-RPE style: effort x intensity.
+#   cardio:     minutes x RPE (calories-only entries use CALORIES_PER_MINUTE)
+#   strength:   weight_kg x reps x RPE / STRENGTH_KG_PER_AU
+#   bodyweight: reps count as BODYWEIGHT_REP_KG each
+DEFAULT_RPE = 7
+CALORIES_PER_MINUTE = 10
+STRENGTH_KG_PER_AU = 100
+BODYWEIGHT_REP_KG = 30
+
+ACUTE_DAYS = 7
+CHRONIC_DAYS = 28
+
+METRICS_CACHE = LRUCache(max_entries=256)
+
+def set_load(WorkoutSet):
+    """SQL load of one set of `WorkoutSet` (the model or its hot ∪ archive twin)."""
+    rpe = func.coalesce(WorkoutSet.rpe, DEFAULT_RPE)
+    return case(
+        (WorkoutSet.duration_seconds.isnot(None), WorkoutSet.duration_seconds / 60.0 * rpe),
+        (WorkoutSet.calories.isnot(None), WorkoutSet.calories * 1.0 / CALORIES_PER_MINUTE * rpe),
+        (
+            WorkoutSet.weight_kg.isnot(None),
+            WorkoutSet.weight_kg * func.coalesce(WorkoutSet.reps, 0) * rpe / STRENGTH_KG_PER_AU,
+        ),
+        else_=func.coalesce(WorkoutSet.reps, 0) * BODYWEIGHT_REP_KG * rpe / STRENGTH_KG_PER_AU,
+    )
+
+
+def _day_loads(connection, user_id: int, first_day: date | None = None, last_day: date | None = None) -> dict[date, float]:
+    Workout, WorkoutSet = history_models(connection, first_day)
+    day = date_bucket(WorkoutSet.logged_at)
+    stmt = (
+        select(day, func.sum(set_load(WorkoutSet)))
+        .join(Workout, WorkoutSet.workout_id == Workout.id)
+        .where(Workout.user_id == user_id, WorkoutSet.status == "done")
+        .group_by(day)
+    )
+    if first_day is not None:
+        stmt = stmt.where(WorkoutSet.logged_at >= datetime.combine(first_day, datetime.min.time()))
+    if last_day is not None:
+        stmt = stmt.where(WorkoutSet.logged_at < datetime.combine(last_day + timedelta(days=1), datetime.min.time()))
+    return {date.fromisoformat(str(d)): round(load or 0, 1) for d, load in connection.execute(stmt)}
+
+
+def refresh_daily_loads(connection, user_id: int, days: set[date]):
+    """Recompute the stored load of `days` for one user (rows for days without sets are removed)."""
+    if not days:
+        return
+    loads = _day_loads(connection, user_id, min(days), max(days))
+    for day in days:
+        load = loads.get(day)
+        if not load:
+            connection.execute(DailyLoad.__table__.delete().where(
+                DailyLoad.user_id == user_id, DailyLoad.day == day,
+            ))
+            continue
+        stmt = upsert(connection, DailyLoad).values(user_id=user_id, day=day, load=load)
+        connection.execute(stmt.on_conflict_do_update(
+            index_elements=[DailyLoad.user_id, DailyLoad.day],
+            set_={"load": stmt.excluded.load},
+        ))
+
+
+def rebuild_daily_loads(db: Session, user_id: int | None = None) -> int:
+    """Recompute daily_loads from workout_sets (all users by default). Returns the number of rows written."""
+    Workout, _WorkoutSet = history_models(db)
+    user_ids = [user_id] if user_id is not None else [
+        uid for (uid,) in db.query(Workout.user_id).distinct().all()
+    ]
+    written = 0
+    for uid in user_ids:
+        db.query(DailyLoad).filter(DailyLoad.user_id == uid).delete(synchronize_session=False)
+        rows = [
+            {"user_id": uid, "day": day, "load": load}
+            for day, load in _day_loads(db.connection(), uid).items() if load
+        ]
+        if rows:
+            db.execute(DailyLoad.__table__.insert(), rows)
+        written += len(rows)
+    return written
+
+
+def backfill_daily_loads():
+    """Fill daily_loads the first time it exists alongside logged sets."""
+    db = SessionLocal()
+    try:
+        if db.query(DailyLoad).first() is None and db.query(WorkoutSet).first() is not None:
+            rebuild_daily_loads(db)
+            db.commit()
+    finally:
+        db.close()
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _refresh_loads_after_flush(session: Session, flush_context):
+    workout_users = {}
+    touched = []  # (workout_id, day)
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Workout):
+            workout_users[obj.id] = obj.user_id
+        elif isinstance(obj, WorkoutSet) and obj.logged_at is not None:
+            touched.append((obj.workout_id, obj.logged_at.date()))
+    if not touched:
+        return
+    connection = session.connection()
+    unknown = {workout_id for workout_id, _day in touched if workout_id not in workout_users}
+    if unknown:
+        workout_users.update(dict(
+            connection.execute(select(Workout.id, Workout.user_id).where(Workout.id.in_(unknown))).all()
+        ))
+    days_by_user: dict[int, set[date]] = {}
+    for workout_id, day in touched:
+        user_id = workout_users.get(workout_id)
+        if user_id is not None:
+            days_by_user.setdefault(user_id, set()).add(day)
+    for user_id, days in days_by_user.items():
+        refresh_daily_loads(connection, user_id, days)
+
+
+# ─── Rolling metrics ──────────────────────────────────────────────────────────
+
+def _window_sums(values: list[float], window: int) -> list[float]:
+    """sums[i] = values[i - window + 1 .. i], from one prefix-sum pass."""
+    prefix = [0.0]
+    for value in values:
+        prefix.append(prefix[-1] + value)
+    return [prefix[i + 1] - prefix[max(0, i + 1 - window)] for i in range(len(values))]
+
+
+def compute_load_metrics(daily: dict[date, float], start: date, end: date) -> list[dict]:
+    """Dense per-day series over [start, end] with acute/chronic load, ACWR, monotony and strain.
+
+    Acute and chronic loads are rolling daily averages over ACUTE_DAYS and CHRONIC_DAYS.
+    Monotony is the acute mean over its standard deviation; strain is the acute weekly
+    total times monotony (Foster).
+    """
+    origin = start - timedelta(days=CHRONIC_DAYS - 1)
+    span = (end - origin).days + 1
+    loads = [daily.get(origin + timedelta(days=i), 0.0) for i in range(span)]
+    acute_sums = _window_sums(loads, ACUTE_DAYS)
+    acute_squares = _window_sums([load * load for load in loads], ACUTE_DAYS)
+    chronic_sums = _window_sums(loads, CHRONIC_DAYS)
+
+    series = []
+    for i in range(CHRONIC_DAYS - 1, span):
+        acute = acute_sums[i] / ACUTE_DAYS
+        chronic = chronic_sums[i] / CHRONIC_DAYS
+        variance = max(acute_squares[i] / ACUTE_DAYS - acute * acute, 0.0)
+        monotony = acute / math.sqrt(variance) if variance > 1e-9 else None
+        series.append({
+            "day": origin + timedelta(days=i),
+            "load": round(loads[i], 1),
+            "acute": round(acute, 1),
+            "chronic": round(chronic, 1),
+            "acwr": round(acute / chronic, 2) if chronic > 0 else None,
+            "monotony": round(monotony, 2) if monotony is not None else None,
+            "strain": round(acute_sums[i] * monotony, 1) if monotony is not None else None,
+        })
+    return series
+
+
+def load_metrics(db: Session, user_id: int, days: int, today: date | None = None) -> list[dict]:
+    """Metrics for the last `days` days, cached per user data version."""
+    today = today or datetime.utcnow().date()
+    cache_key = (user_id, today, days, get_data_version(db, user_id))
+    series = METRICS_CACHE.get(cache_key)
+    if series is None:
+        start = today - timedelta(days=days - 1)
+        rows = (
+            db.query(DailyLoad.day, DailyLoad.load)
+            .filter(
+                DailyLoad.user_id == user_id,
+                DailyLoad.day >= start - timedelta(days=CHRONIC_DAYS - 1),
+                DailyLoad.day <= today,
+            )
+            .all()
+        )
+        series = compute_load_metrics(dict(rows), start, today)
+        METRICS_CACHE.set(cache_key, series)
+    return series
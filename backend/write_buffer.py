@@ -0,0 +1,144 @@
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Hashable
+
+from pydantic import BaseModel
+
+from database import current_household, household_context
+
+logger = logging.getLogger("fitcouple.write_buffer")
+
+
+@dataclass
+class _Pending:
+    household: str
+    group: Hashable  # e.g. the workout a set belongs to, for targeted flushes
+    snapshot: BaseModel  # what the client was last told the row looks like
+    fields: dict = field(default_factory=dict)  # merged, not yet written
+    due: float = 0.0
+
+
+class CoalescingBuffer:
+    """Write-behind buffer that merges partial updates to the same row within `window` seconds.
+
+    `write` receives {row_id: fields} and must persist all of it in one transaction;
+    if it raises, the entries go back into the buffer and are retried on the next tick.
+    Buffered state lives in this process only: it is flushed on close(), but edits
+    still inside the window are lost if the process crashes or is killed.
+    Rows are scoped to current_household; targeted flushes only see that household's rows.
+    """
+
+    def __init__(self, window: float, write: Callable[[dict[Hashable, dict]], None]):
+        self.window = window
+        self._write = write
+        self._pending: dict[tuple[str, Hashable], _Pending] = {}
+        self._writing: dict[tuple[str, Hashable], _Pending] = {}  # taken out by the running flush
+        self._lock = threading.RLock()  # guards _pending only, never held across a write
+        self._flush_lock = threading.Lock()  # one flush writes at a time, so a row's older fields never land last
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.flush_count = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    def update(
+        self,
+        row_id: Hashable,
+        fields: dict,
+        load: Callable[[], tuple[Hashable, BaseModel]],
+    ) -> BaseModel:
+        """Merge `fields` into the row's pending write and return the row as it will be once written.
+
+        `load` returns (group, snapshot) from the database and is only called for the first
+        update of a row in a window; it may raise to reject the update (e.g. 404). It runs
+        outside the lock, so a slow query doesn't hold up other rows' updates and flushes;
+        the entry is looked up again before it is added, in case another update won the race.
+        A row whose earlier fields are being written right now starts from their snapshot instead.
+        """
+        key = (current_household.get(), row_id)
+        loaded = None
+        while True:
+            with self._lock:
+                pending = self._pending.get(key)
+                if pending is None and key in self._writing:
+                    writing = self._writing[key]
+                    loaded = writing.group, writing.snapshot
+                if pending is None and loaded is not None:
+                    group, snapshot = loaded
+                    pending = _Pending(key[0], group, snapshot, due=time.monotonic() + self.window)
+                    self._pending[key] = pending
+                if pending is not None:
+                    pending.fields.update(fields)
+                    pending.snapshot = pending.snapshot.model_copy(update=fields)
+                    return pending.snapshot
+            loaded = load()
+
+    def flush(self, group: Hashable | None = None, row_ids=None, due_only: bool = False, all_households=False):
+        """Write the household's buffered rows now: all of them, one group's, or specific rows."""
+        household = current_household.get()
+        with self._flush_lock:
+            with self._lock:
+                now = time.monotonic()
+                selected: dict[str, dict[Hashable, _Pending]] = {}
+                for (row_household, row_id), pending in self._pending.items():
+                    if (
+                        (all_households or row_household == household)
+                        and (group is None or pending.group == group)
+                        and (row_ids is None or row_id in row_ids)
+                        and (not due_only or pending.due <= now)
+                    ):
+                        selected.setdefault(row_household, {})[row_id] = pending
+                for row_household, rows in selected.items():
+                    for row_id, pending in rows.items():
+                        self._writing[(row_household, row_id)] = self._pending.pop((row_household, row_id))
+            # Written with the lock released: updates keep merging into fresh entries meanwhile
+            households = list(selected)
+            try:
+                for i, row_household in enumerate(households):
+                    rows = selected[row_household]
+                    try:
+                        with household_context(row_household):
+                            self._write({row_id: dict(pending.fields) for row_id, pending in rows.items()})
+                    except Exception:
+                        self._requeue({name: selected[name] for name in households[i:]})
+                        raise
+                    self.flush_count += 1
+            finally:
+                with self._lock:
+                    self._writing.clear()
+
+    def _requeue(self, selected: dict[str, dict[Hashable, _Pending]]):
+        """Put unwritten entries back, under any fields merged into the row since they were taken out."""
+        with self._lock:
+            for row_household, rows in selected.items():
+                for row_id, pending in rows.items():
+                    newer = self._pending.get((row_household, row_id))
+                    if newer is not None:
+                        newer.snapshot = pending.snapshot.model_copy(update=newer.fields)
+                        newer.fields = {**pending.fields, **newer.fields}
+                    else:
+                        self._pending[(row_household, row_id)] = pending
+
+    def start(self):
+        if not self.enabled or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="write-buffer", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        self.flush(all_households=True)
+
+    def _run(self):
+        while not self._stop.wait(self.window / 2):
+            try:
+                self.flush(due_only=True, all_households=True)
+            except Exception:
+                logger.exception("buffered write failed, will retry")
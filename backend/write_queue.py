@@ -0,0 +1,172 @@
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Callable, TypeVar
+
+from sqlalchemy.exc import DBAPIError, OperationalError
+from sqlalchemy.orm import Session
+
+from database import BEGIN_IMMEDIATE, SessionLocal, current_household
+
+logger = logging.getLogger("fitcouple.write_queue")
+
+WRITE_QUEUE_ENABLED = os.getenv("FITCOUPLE_WRITE_QUEUE", "1") != "0"
+MAX_BATCH = 32
+WRITER_IDLE_SECONDS = 60
+BUSY_RETRIES = 6
+BUSY_BACKOFF_SECONDS = 0.02  # doubled on every retry, with jitter
+
+T = TypeVar("T")
+WriteUnit = Callable[[Session], T]
+
+
+RETRYABLE_SQLSTATES = {"40001", "40P01"}  # PostgreSQL serialization failure, deadlock
+
+
+def is_busy(exc: Exception) -> bool:
+    """SQLITE_BUSY / SQLITE_LOCKED (another connection holds the write lock) or a retryable PostgreSQL conflict."""
+    if not isinstance(exc, DBAPIError):
+        return False
+    if getattr(exc.orig, "sqlstate", None) in RETRYABLE_SQLSTATES:
+        return True
+    message = str(exc.orig).lower()
+    return isinstance(exc, OperationalError) and ("locked" in message or "busy" in message)
+
+
+@dataclass
+class _Writer:
+    units: queue.Queue = field(default_factory=queue.Queue)
+    thread: threading.Thread | None = None
+
+
+class WriteQueue:
+    """One thread per household database owns its writes and group-commits them.
+
+    A write unit is a function of a session that does its work, flushes, and
+    returns a plain result (an Out schema, not ORM objects, which die with the
+    writer's session). Units queued together run in one transaction, each in
+    its own savepoint so a failing unit (404, validation) only rolls back itself
+    and its exception is re-raised in the submitting thread. The whole batch is
+    retried with backoff when the database is busy, e.g. held by another worker.
+    Households write to separate files, so their writers run in parallel; a
+    writer exits after WRITER_IDLE_SECONDS without work.
+    """
+
+    def __init__(self):
+        self._writers: dict[str, _Writer] = {}
+        self._lock = threading.Lock()
+        self._running = False
+        self.batch_count = 0
+        self.unit_count = 0
+
+    def start(self):
+        self._running = True
+
+    def stop(self, timeout: float = 10.0):
+        with self._lock:
+            self._running = False
+            writers = list(self._writers.values())
+            self._writers.clear()
+        for writer in writers:
+            writer.units.put(None)
+        for writer in writers:
+            writer.thread.join(timeout)
+
+    def run(self, unit: WriteUnit, household: str | None = None) -> T:
+        """Run `unit` in the household's writer and wait for its commit.
+
+        Runs inline when the queue isn't started (CLI, scripts) or when called from the writer itself.
+        """
+        household = household or current_household.get()
+        future: Future = Future()
+        with self._lock:
+            writer = self._writers.get(household)
+            inline = not self._running or (writer is not None and threading.current_thread() is writer.thread)
+            if not inline:
+                if writer is None:
+                    writer = self._writers[household] = _Writer()
+                    writer.thread = threading.Thread(
+                        target=self._run, args=(household, writer), name=f"fitcouple-writer-{household}", daemon=True,
+                    )
+                    writer.thread.start()
+                writer.units.put((unit, future))
+        if inline:
+            self._commit_batch(household, [(unit, future)])
+        return future.result()
+
+    def _run(self, household: str, writer: _Writer):
+        current_household.set(household)
+        while True:
+            try:
+                item = writer.units.get(timeout=WRITER_IDLE_SECONDS)
+            except queue.Empty:
+                with self._lock:
+                    if writer.units.empty():
+                        if self._writers.get(household) is writer:
+                            del self._writers[household]
+                        return
+                continue
+            if item is None:
+                return
+            batch = [item]
+            stopping = False
+            while len(batch) < MAX_BATCH:
+                try:
+                    item = writer.units.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._commit_batch(household, batch)
+            if stopping:
+                return
+
+    def _commit_batch(self, household: str, batch: list[tuple[WriteUnit, Future]]):
+        for attempt in range(BUSY_RETRIES + 1):
+            outcomes = []
+            db = SessionLocal(household=household)
+            try:
+                db.connection(execution_options={BEGIN_IMMEDIATE: True})
+                for unit, _future in batch:
+                    savepoint = db.begin_nested()
+                    try:
+                        result = unit(db)
+                        savepoint.commit()
+                    except Exception as exc:
+                        if is_busy(exc):
+                            raise
+                        savepoint.rollback()
+                        outcomes.append((None, exc))
+                    else:
+                        outcomes.append((result, None))
+                db.commit()
+            except Exception as exc:
+                db.rollback()
+                if is_busy(exc) and attempt < BUSY_RETRIES:
+                    time.sleep(BUSY_BACKOFF_SECONDS * 2 ** attempt * random.uniform(0.5, 1.5))
+                    continue
+                logger.exception("write batch of %d failed", len(batch))
+                for _unit, future in batch:
+                    future.set_exception(exc)
+                return
+            finally:
+                db.close()
+
+            self.batch_count += 1
+            self.unit_count += len(batch)
+            for (_unit, future), (result, exc) in zip(batch, outcomes):
+                if exc is not None:
+                    future.set_exception(exc)
+                else:
+                    future.set_result(result)
+            return
+
+
+WRITE_QUEUE = WriteQueue()